@@ -0,0 +1,120 @@
+"""
+Measures events per second through IRCClient.bus, comparing the EventBus
+which checked every handler with iscoroutinefunction on every broadcast with
+the one resolving and classifying handlers once per event class.
+
+Handlers are subscribed the way TamaBot and a few plugins would: several sync
+handlers per event class, and optionally an async one whose tasks are run to
+completion before the clock stops.
+
+Usage: python bench/bench_bus.py [--count N] [--handlers N] [--repeat N]
+"""
+import argparse
+import asyncio as aio
+import time
+from typing import Callable, Dict, List, Type
+
+from bench_client import make_config
+
+from tama.event import Event, EventBus
+from tama.irc import IRCClient, IRCUser
+from tama.irc.event import MessagedEvent, ChannelJoinedEvent, QuitEvent
+
+
+class LegacyEventBus:
+    """
+    EventBus as implemented before dispatch was resolved per event class.
+    """
+
+    def __init__(self, accept) -> None:
+        self.event_handlers: Dict[Type[Event], List[Callable]] = {
+            event_type: [] for event_type in accept
+        }
+
+    def subscribe(self, event_type, handler, batched: bool = False) -> None:
+        self.event_handlers[event_type].append(handler)
+
+    def broadcast(self, event, batched: bool = False) -> None:
+        if (event_type := type(event)) not in self.event_handlers:
+            raise TypeError
+        for handler in self.event_handlers[event_type]:
+            if aio.iscoroutinefunction(handler):
+                aio.ensure_future(handler(event))
+            else:
+                handler(event)
+
+
+def make_events(client: IRCClient, count: int) -> List[Event]:
+    who = IRCUser.parse("nick!user@host.example")
+    kinds = (
+        lambda i: MessagedEvent(client, who, "#bench", f"message {i}"),
+        lambda i: ChannelJoinedEvent(client, "#bench", who),
+        lambda i: QuitEvent(client, who, frozenset(("#bench",)), "bye"),
+    )
+    return [kinds[i % 3](i) for i in range(count)]
+
+
+async def run(
+    bus_cls, count: int, handlers: int, with_async: bool, repeat: int
+) -> float:
+    client = IRCClient("bench", make_config(), None)
+    client.bus = bus_cls(accept=list(client.bus.event_handlers))
+    if isinstance(client.bus, EventBus):
+        # Measure dispatch, not the supervisor limits
+        client.bus.supervisor.limit = None
+        client.bus.supervisor.owner_limit = None
+        client.bus.supervisor.lane_limit = count * repeat
+    calls = 0
+
+    def handler(evt: Event) -> None:
+        nonlocal calls
+        calls += 1
+
+    async def async_handler(evt: Event) -> None:
+        nonlocal calls
+        calls += 1
+
+    for event_type in (MessagedEvent, ChannelJoinedEvent, QuitEvent):
+        for _ in range(handlers):
+            # Distinct functions, like handlers of different plugins
+            client.bus.subscribe(event_type, lambda e: handler(e))
+        if with_async:
+            client.bus.subscribe(event_type, async_handler)
+
+    events = make_events(client, count)
+    broadcast = client.bus.broadcast
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for event in events:
+            broadcast(event)
+        if with_async:
+            # Let the scheduled handler tasks run
+            await aio.sleep(0)
+            await aio.sleep(0)
+        best = min(best, time.perf_counter() - start)
+    return count / best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--handlers", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for with_async in (False, True):
+        label = "sync + 1 async" if with_async else "sync only"
+        print(f"-- {args.handlers} {label} handlers per event")
+        for name, bus_cls in (
+            ("legacy EventBus", LegacyEventBus),
+            ("EventBus", EventBus),
+        ):
+            rate = aio.run(run(
+                bus_cls, args.count, args.handlers, with_async, args.repeat
+            ))
+            print(f"{name:<20} {rate:>10.0f} events/s")
+
+
+if __name__ == "__main__":
+    main()
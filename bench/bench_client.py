@@ -0,0 +1,179 @@
+"""
+Measures messages per second through a single IRCClient connection, comparing
+the task-per-message run loop used before with the long-lived reader, writer
+and keepalive tasks.
+
+The connection is simulated in memory: the inbound side replays generated
+traffic and the outbound side discards everything written to it.
+
+Usage: python bench/bench_client.py [--count N] [--outbound N]
+"""
+import argparse
+import asyncio as aio
+import time
+from collections import deque
+from logging import getLogger
+from typing import Tuple
+
+from corpus import generate_lines
+
+from tama.config import ServerConfig
+from tama.config.schema_validate import validate_map_schema
+from tama.irc import IRCClient
+from tama.irc.stream import IRCStream
+
+
+class ReplayReader:
+    """
+    Stand-in for asyncio.StreamReader serving a fixed log. Every read yields
+    to the event loop once, like a socket read would.
+    """
+
+    def __init__(self, log: bytes) -> None:
+        self.log = memoryview(log)
+        self.pos = 0
+
+    async def read(self, n: int) -> bytes:
+        await aio.sleep(0)
+        data = bytes(self.log[self.pos: self.pos + n])
+        self.pos += len(data)
+        return data
+
+
+class IdleReader:
+    """
+    Stand-in for asyncio.StreamReader on a connection that never sends.
+    """
+
+    async def read(self, n: int) -> bytes:
+        await aio.Event().wait()
+        return b""
+
+
+class NullWriter:
+    """
+    Stand-in for asyncio.StreamWriter which drops all data. The flushed event
+    is set once the expected amount of messages has been written.
+    """
+
+    def __init__(self, expected: int = 0) -> None:
+        self.written = 0
+        self.messages = 0
+        self.drains = 0
+        self.expected = expected
+        self.flushed = aio.Event()
+
+    def write(self, data: bytes) -> None:
+        self.written += len(data)
+        self.messages += data.count(b"\r\n")
+        if self.messages >= self.expected:
+            self.flushed.set()
+
+    async def drain(self) -> None:
+        self.drains += 1
+        # A real drain yields to the event loop
+        await aio.sleep(0)
+
+
+class LegacyClient(IRCClient):
+    """
+    IRCClient.run as implemented before persistent tasks: one task per
+    inbound and outbound message and a timeout task recreated every
+    iteration.
+    """
+
+    async def run(self) -> Tuple[str, ServerConfig]:
+        self._inbound_queue = deque()
+        inbound = aio.create_task(self._legacy_inbound())
+        outbound = aio.create_task(self._legacy_outbound())
+        timeout = aio.create_task(self._legacy_timeout())
+        while not self._shutting_down:
+            done, pending = await aio.wait(
+                [inbound, outbound, timeout], return_when=aio.FIRST_COMPLETED
+            )
+            if inbound in done:
+                inbound.result()
+                inbound = aio.create_task(self._legacy_inbound())
+            if outbound in done:
+                outbound.result()
+                outbound = aio.create_task(self._legacy_outbound())
+            if timeout not in done:
+                timeout.cancel()
+            else:
+                timeout.result()
+            timeout = aio.create_task(self._legacy_timeout())
+        inbound.cancel()
+        outbound.cancel()
+        timeout.cancel()
+        return self.name, self.startup_config
+
+    async def _legacy_inbound(self) -> None:
+        if len(self._inbound_queue) == 0:
+            new_messages = await self.stream.read_messages()
+            if new_messages is None:
+                getLogger(__name__).info("IRC connection closed")
+                self._shutting_down = True
+                return
+            self._inbound_queue.extend(new_messages)
+        self._inbound(self._inbound_queue.popleft())
+
+    async def _legacy_outbound(self) -> None:
+        msg, = await self._outbound_queue.get_batch(1)
+        await self.stream.send_message(msg)
+
+    async def _legacy_timeout(self) -> None:
+        await aio.sleep(30)
+
+
+def make_config() -> ServerConfig:
+    # Flood control and per-target limits are disabled to measure the client
+    # itself
+    return validate_map_schema({
+        "host": "irc.example.net", "port": "6667",
+        "nick": "tama", "user": "tama", "realname": "tama",
+        "flood": {"enabled": False, "target_limit": 2**31},
+    }, ServerConfig)
+
+
+async def run_inbound(cls, log: bytes) -> float:
+    writer = NullWriter()
+    client = cls("bench", make_config(), IRCStream(ReplayReader(log), writer))
+    start = time.perf_counter()
+    await client.run()
+    return time.perf_counter() - start
+
+
+async def run_outbound(cls, count: int) -> Tuple[float, int]:
+    writer = NullWriter(expected=count)
+    client = cls("bench", make_config(), IRCStream(IdleReader(), writer))
+    for i in range(count):
+        client.privmsg("#bench", f"outbound message {i}")
+    start = time.perf_counter()
+    task = aio.create_task(client.run())
+    await writer.flushed.wait()
+    elapsed = time.perf_counter() - start
+    task.cancel()
+    return elapsed, writer.drains
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=200000)
+    parser.add_argument("--outbound", type=int, default=20000)
+    args = parser.parse_args()
+
+    log = b"".join(generate_lines(args.count))
+    clients = (("legacy run loop", LegacyClient), ("IRCClient", IRCClient))
+    for name, cls in clients:
+        elapsed = aio.run(run_inbound(cls, log))
+        print(f"{name:<20} inbound  {args.count / elapsed:>10.0f} msg/s")
+    for name, cls in clients:
+        elapsed, drains = aio.run(run_outbound(cls, args.outbound))
+        print(
+            f"{name:<20} outbound {args.outbound / elapsed:>10.0f} msg/s "
+            f"({drains} drains)"
+        )
+
+
+if __name__ == "__main__":
+    main()
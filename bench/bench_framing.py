@@ -0,0 +1,120 @@
+"""
+Replays a raw IRC log through the legacy read_messages framing and through
+IRCStream with LineFramer, reporting throughput for both.
+
+Usage: python bench/bench_framing.py [--size MIB] [--log PATH]
+"""
+import argparse
+import asyncio as aio
+import time
+from typing import List, Optional
+
+from corpus import generate_log, load_log
+
+from tama.irc.stream import IRCStream, IRCMessage, DEFAULT_READ_SIZE
+
+
+class LegacyStream:
+    """
+    Framing as implemented before LineFramer: fixed 1 KiB reads and a
+    re-slice of the remaining data after every delimiter.
+    """
+
+    def __init__(self, reader: aio.StreamReader) -> None:
+        self.reader = reader
+        self.buffer = bytearray()
+
+    async def read_lines(self) -> Optional[List[bytes]]:
+        lines = []
+        data = await self.reader.read(1024)
+        if len(data) == 0:
+            return None
+        if (lim := data.find(b"\r\n")) == -1:
+            self.buffer.extend(data)
+            return lines
+        if len(self.buffer) > 0:
+            msg, data = self.buffer + data[: lim], data[lim + 2:]
+            lines.append(bytes(msg))
+            self.buffer.clear()
+        while (lim := data.find(b"\r\n")) != -1:
+            msg, data = data[: lim], data[lim + 2:]
+            lines.append(msg)
+        if len(data) > 0:
+            self.buffer = bytearray(data)
+        return lines
+
+    async def read_messages(self) -> Optional[List[IRCMessage]]:
+        lines = await self.read_lines()
+        if lines is None:
+            return None
+        return [IRCMessage.parse(line) for line in lines]
+
+
+def make_reader(log: bytes) -> aio.StreamReader:
+    reader = aio.StreamReader(limit=len(log) + 1)
+    reader.feed_data(log)
+    reader.feed_eof()
+    return reader
+
+
+async def replay(make_stream) -> int:
+    stream = make_stream()
+    count = 0
+    while (messages := await stream.read_messages()) is not None:
+        count += len(messages)
+    return count
+
+
+async def replay_legacy_framing_only(log: bytes) -> int:
+    stream = LegacyStream(make_reader(log))
+    count = 0
+    while (lines := await stream.read_lines()) is not None:
+        count += len(lines)
+    return count
+
+
+async def replay_framing_only(log: bytes, read_size: int) -> int:
+    stream = IRCStream(make_reader(log), None, read_size)
+    count = 0
+    while data := await stream.reader.read(read_size):
+        count += len(stream.framer.feed(data))
+    return count
+
+
+def run(name: str, size: int, coro) -> None:
+    start = time.perf_counter()
+    count = aio.run(coro)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{name:<32} {count:>9} msgs {elapsed:8.3f} s "
+        f"{size / elapsed / 2**20:8.1f} MiB/s {count / elapsed:>10.0f} msg/s"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=8, help="Log size in MiB")
+    parser.add_argument("--log", help="Replay a raw log file instead")
+    args = parser.parse_args()
+
+    log = load_log(args.log) if args.log else generate_log(args.size * 2**20)
+    size = len(log)
+    print(f"Replaying {size / 2**20:.1f} MiB")
+
+    run("legacy framing + parse", size, replay(
+        lambda: LegacyStream(make_reader(log))
+    ))
+    run("IRCStream 1 KiB reads", size, replay(
+        lambda: IRCStream(make_reader(log), None, 1024)
+    ))
+    run("IRCStream default reads", size, replay(
+        lambda: IRCStream(make_reader(log), None, DEFAULT_READ_SIZE)
+    ))
+    run("legacy framing only", size, replay_legacy_framing_only(log))
+    run("LineFramer only, default reads", size, replay_framing_only(
+        log, DEFAULT_READ_SIZE
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Compares the eager dataclass IRCMessage parser with the lazy, slotted one.
+
+Two workloads are measured: dispatch only, where just the command is read as
+for numerics, MODE and PING, and full access, where every field is decoded.
+Retained memory for the parsed messages is reported through tracemalloc.
+
+Untagged traffic is also parsed with the lazy parser as it was before IRCv3
+tag support, to check that recognising tags costs untagged lines nothing.
+Tagged traffic is then measured with and without reading the tags.
+
+Usage: python bench/bench_message.py [--count N] [--repeat N]
+"""
+import argparse
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Optional, Tuple, List, Callable
+
+from corpus import generate_lines
+
+from tama.irc.command import COMMANDS, REPLY_CODES
+from tama.irc.exc import InvalidIRCCommandError
+from tama.irc.stream import IRCMessage
+from tama.irc.stream.payloads import _COMMAND_TABLE, _UNSET
+
+
+@dataclass
+class LegacyIRCMessage:
+    """
+    IRCMessage as implemented before lazy decoding.
+    """
+    command: str
+    prefix: Optional[str] = None
+    middle: Tuple[str, ...] = ()
+    trailing: Optional[str] = None
+    numeric: Optional[str] = None
+    encoding: str = "utf-8"
+
+    @classmethod
+    def parse(cls, msg: bytes, encoding: str = "utf-8") -> "LegacyIRCMessage":
+        prefix = None
+        if msg[0] == 0x3a:
+            sep = msg.find(b" ")
+            prefix, msg = msg[1: sep].decode(encoding), msg[sep+1:]
+        if (sep := msg.find(b" ")) == -1:
+            sep = len(msg)
+        command, msg = msg[: sep].decode(encoding), msg[sep+1:]
+        if (sep := msg.find(b":")) == -1:
+            middle_b, trailing_b = msg, None
+        else:
+            middle_b, trailing_b = msg[: sep], msg[sep+1:]
+        if len(middle_b) > 0:
+            middle = tuple(
+                m.decode(encoding) for m in middle_b.split(b" ") if len(m) > 0
+            )
+        else:
+            middle = tuple()
+        trailing = trailing_b.decode(encoding) if trailing_b else None
+        if len(command) == 3 and "0" <= command[0] <= "9":
+            numeric = command
+            command = REPLY_CODES[command]
+        else:
+            numeric = None
+            assert command in COMMANDS
+        return cls(
+            encoding=encoding, prefix=prefix, command=command,
+            numeric=numeric, middle=middle, trailing=trailing
+        )
+
+    @property
+    def raw(self) -> bytes:
+        buf = bytearray()
+        if self.prefix:
+            buf.extend(f":{self.prefix} ".encode(self.encoding))
+        buf.extend((self.numeric or self.command).encode(self.encoding))
+        for mid in self.middle:
+            buf.extend(f" {mid}".encode(self.encoding))
+        if self.trailing:
+            buf.extend(f" :{self.trailing}".encode(self.encoding))
+        buf.extend(b"\r\n")
+        return bytes(buf)
+
+
+class PreTagIRCMessage(IRCMessage):
+    """
+    Lazy IRCMessage parser as implemented before tag support.
+    """
+    __slots__ = ("_trailing_start",)
+
+    @classmethod
+    def parse(cls, msg: bytes, encoding: str = "utf-8") -> "PreTagIRCMessage":
+        if msg.endswith(b"\r\n"):
+            end = len(msg) - 2
+        else:
+            end = len(msg)
+            msg = msg + b"\r\n"
+        prefix_end = 0
+        pos = 0
+        if msg[0] == 0x3a:
+            if (prefix_end := msg.find(b" ", 0, end)) == -1:
+                prefix_end = end
+            pos = prefix_end + 1
+        if (sep := msg.find(b" ", pos, end)) == -1:
+            sep = end
+        try:
+            command, numeric = _COMMAND_TABLE[msg[pos: sep]]
+        except KeyError:
+            raise InvalidIRCCommandError(
+                msg[pos: sep].decode(encoding, "replace")
+            ) from None
+        if (trailing_start := msg.find(b" :", sep, end)) != -1:
+            trailing_start += 2
+        obj = cls.__new__(cls)
+        obj.command = command
+        obj.numeric = numeric
+        obj.encoding = encoding
+        obj._raw = msg
+        obj._prefix_end = prefix_end
+        obj._params_start = sep
+        obj._trailing_start = trailing_start
+        obj._end = end
+        obj._prefix = _UNSET
+        obj._middle = _UNSET
+        obj._trailing = _UNSET
+        return obj
+
+    @property
+    def prefix(self) -> Optional[str]:
+        if (prefix := self._prefix) is _UNSET:
+            if self._prefix_end > 0:
+                prefix = self._raw[1: self._prefix_end].decode(
+                    self.encoding, "replace"
+                )
+            else:
+                prefix = None
+            self._prefix = prefix
+        return prefix
+
+    @property
+    def middle(self) -> Tuple[str, ...]:
+        if (middle := self._middle) is _UNSET:
+            if self._trailing_start == -1:
+                middle_end = self._end
+            else:
+                middle_end = self._trailing_start - 2
+            middle = tuple(
+                m.decode(self.encoding, "replace")
+                for m in self._raw[self._params_start: middle_end].split(b" ")
+                if len(m) > 0
+            )
+            self._middle = middle
+        return middle
+
+    @property
+    def trailing(self) -> Optional[str]:
+        if (trailing := self._trailing) is _UNSET:
+            if self._trailing_start != -1 and self._trailing_start < self._end:
+                trailing = self._raw[self._trailing_start: self._end].decode(
+                    self.encoding, "replace"
+                )
+            else:
+                trailing = None
+            self._trailing = trailing
+        return trailing
+
+
+def dispatch_only(msg) -> None:
+    msg.command.lower()
+
+
+def full_access(msg) -> None:
+    msg.command.lower()
+    msg.prefix
+    msg.middle
+    msg.trailing
+
+
+def log_raw(msg) -> None:
+    msg.raw[:-2].decode(msg.encoding)
+
+
+def with_tags(msg) -> None:
+    full_access(msg)
+    msg.tags.get("account")
+
+
+def measure(
+    name: str,
+    parse: Callable,
+    lines: List[bytes],
+    access: Callable,
+    repeat: int = 1,
+) -> None:
+    # Best of several runs, to filter out noise from other processes
+    elapsed = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            access(parse(line))
+        elapsed = min(elapsed, time.perf_counter() - start)
+
+    tracemalloc.start()
+    retained = [parse(line) for line in lines]
+    for msg in retained:
+        access(msg)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del retained
+
+    print(
+        f"{name:<28} {len(lines) / elapsed:>10.0f} msg/s "
+        f"{current / len(lines):>8.0f} B/msg retained"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with_crlf = generate_lines(args.count)
+    without_crlf = [line[:-2] for line in with_crlf]
+    tagged = generate_lines(args.count, tagged=True)
+
+    for access in (dispatch_only, full_access, log_raw):
+        print(f"-- {access.__name__}")
+        measure("legacy dataclass", LegacyIRCMessage.parse, without_crlf,
+                access, args.repeat)
+        measure("lazy slotted, before tags", PreTagIRCMessage.parse,
+                with_crlf, access, args.repeat)
+        measure("lazy slotted", IRCMessage.parse, with_crlf, access,
+                args.repeat)
+
+    for access in (dispatch_only, full_access, with_tags):
+        print(f"-- tagged, {access.__name__}")
+        measure("lazy slotted", IRCMessage.parse, tagged, access,
+                args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Measures messages per second through the Regex actions of TamaBot, comparing
+the loop running re.match for every pattern on every message with the
+RegexDispatcher prefiltering them by their required literals.
+
+The patterns are those of a bot with a few dozen URL expanders plus some
+patterns without a usable literal, which run on every message either way.
+Both ways are checked to match the same patterns before timing.
+
+Usage: python bench/bench_regex.py [--count N] [--patterns N] [--repeat N]
+"""
+import argparse
+import re
+import time
+from typing import Callable, List, Pattern, Tuple
+
+from corpus import generate_chat
+
+from tama.util.regex import RegexDispatcher
+
+_SITES = (
+    r"(?:www\.)?youtube\.com/watch\?v=([\w-]+)", r"youtu\.be/([\w-]+)",
+    r"twitter\.com/(\w+)/status/(\d+)", r"github\.com/([\w-]+)/([\w-]+)",
+    r"(?:www\.)?reddit\.com/r/(\w+)/comments/(\w+)",
+    r"mangadex\.org/title/([0-9]+)/", r"imgur\.com/(\w+)",
+    r"en\.wikipedia\.org/wiki/(\S+)", r"store\.steampowered\.com/app/(\d+)",
+    r"(?:www\.)?twitch\.tv/(\w+)", r"pastebin\.com/(\w+)",
+    r"soundcloud\.com/([\w-]+)/([\w-]+)", r"open\.spotify\.com/track/(\w+)",
+    r"bandcamp\.com/track/([\w-]+)", r"vimeo\.com/(\d+)",
+    r"(?:www\.)?amazon\.com/dp/(\w+)", r"stackoverflow\.com/questions/(\d+)",
+    r"news\.ycombinator\.com/item\?id=(\d+)", r"gitlab\.com/([\w-]+)/",
+    r"crates\.io/crates/([\w-]+)", r"pypi\.org/project/([\w-]+)",
+    r"www\.npmjs\.com/package/([\w-]+)", r"myanimelist\.net/anime/(\d+)",
+    r"anilist\.co/anime/(\d+)", r"(?:www\.)?imdb\.com/title/(tt\d+)",
+    r"gfycat\.com/(\w+)", r"streamable\.com/(\w+)",
+    r"(?:www\.)?instagram\.com/p/([\w-]+)", r"tiktok\.com/@(\w+)/video/(\d+)",
+    r"xkcd\.com/(\d+)", r"arxiv\.org/abs/([\d.]+)",
+    r"docs\.python\.org/3/library/(\w+)",
+)
+# Patterns no literal prefilter helps with
+_OTHERS = (r"(\w+)\+\+$", r"s/([^/]+)/([^/]*)/?$", r".*\b(\d+)\s?(?:km|mi)\b")
+
+
+def make_patterns(count: int) -> List[Pattern]:
+    sites = [rf".*\bhttps?://{site}" for site in _SITES]
+    while len(sites) < count - len(_OTHERS):
+        # More expanders for further sites
+        sites.append(rf".*\bhttps?://site{len(sites)}\.example/(\w+)")
+    sources = sites[:count - len(_OTHERS)] + list(_OTHERS)
+    return [re.compile(source) for source in sources]
+
+
+def legacy(patterns: List[Pattern]) -> Callable[[str], List[Pattern]]:
+    def match(text: str) -> List[Pattern]:
+        return [p for p in patterns if re.match(p, text)]
+    return match
+
+
+def dispatched(patterns: List[Pattern]) -> Callable[[str], List[Pattern]]:
+    dispatcher = RegexDispatcher((p, p) for p in patterns)
+
+    def match(text: str) -> List[Pattern]:
+        return [p for p, _ in dispatcher.match(text)]
+    return match
+
+
+def run(
+    match: Callable[[str], List[Pattern]], texts: List[str], repeat: int
+) -> Tuple[float, int]:
+    best = float("inf")
+    hits = 0
+    for _ in range(repeat):
+        hits = 0
+        start = time.perf_counter()
+        for text in texts:
+            hits += len(match(text))
+        best = min(best, time.perf_counter() - start)
+    return len(texts) / best, hits
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=50000)
+    parser.add_argument("--patterns", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    texts = generate_chat(args.count)
+    patterns = make_patterns(args.patterns)
+    plain, fast = legacy(patterns), dispatched(patterns)
+    for text in texts:
+        if plain(text) != fast(text):
+            raise AssertionError(f"Results differ for {text!r}")
+
+    print(f"-- {len(patterns)} patterns, {len(texts)} messages")
+    for name, match in (("re.match loop", plain), ("RegexDispatcher", fast)):
+        rate, hits = run(match, texts, args.repeat)
+        print(f"{name:<20} {rate:>10.0f} messages/s {hits:>8} matches")
+
+
+if __name__ == "__main__":
+    main()
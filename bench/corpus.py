@@ -0,0 +1,150 @@
+"""
+Synthetic raw IRC traffic shared by the benchmarks.
+
+The generated log mimics a busy network: chat in many channels, join/part
+churn, netsplit quit bursts and NAMES replies. A real raw log (one message per
+line) may be used instead by passing its path to load_log().
+"""
+import random
+from typing import List
+
+__all__ = ["generate_lines", "generate_log", "load_log", "generate_chat"]
+
+_WORDS = (
+    "the quick brown fox jumps over lazy dog anyone seen that new chapter "
+    "lol yes no maybe tomorrow tonight server bot please thanks hello "
+    "https://mangadex.org/title/1234/ check this out it broke again"
+).split()
+_TALK = [word for word in _WORDS if "://" not in word]
+
+# Links pasted in chat, most to sites a URL expander would handle
+_LINKS = (
+    "https://www.youtube.com/watch?v={id}", "https://youtu.be/{id}",
+    "https://twitter.com/someone/status/{num}",
+    "https://github.com/alex108/tama/issues/{num}",
+    "https://www.reddit.com/r/programming/comments/{id}/",
+    "https://mangadex.org/title/{num}/", "https://imgur.com/{id}",
+    "https://en.wikipedia.org/wiki/Internet_Relay_Chat",
+    "https://store.steampowered.com/app/{num}/",
+    "https://www.twitch.tv/{id}", "https://example.com/some/page?id={num}",
+    "http://pastebin.com/{id}",
+)
+
+
+def _user(rng: random.Random, i: int) -> str:
+    return f"nick{i}!~user{i}@host-{rng.randint(0, 255)}.example.net"
+
+
+def _tags(rng: random.Random, i: int) -> str:
+    return (
+        f"@time=2021-03-0{rng.randint(1, 9)}T12:{rng.randint(10, 59)}:00.000Z;"
+        f"msgid={rng.getrandbits(64):016x};account=user{i} "
+    )
+
+
+def generate_lines(
+    count: int,
+    seed: int = 108,
+    channels: int = 50,
+    users: int = 2000,
+    tagged: bool = False,
+) -> List[bytes]:
+    """
+    Generates raw IRC lines terminated by CRLF.
+
+    :param count: Number of lines.
+    :param seed: Random seed so runs are comparable.
+    :param channels: Number of distinct channels.
+    :param users: Number of distinct hostmasks.
+    :param tagged: Whether messages carry server-time, msgid and account
+                   tags as sent with the IRCv3 capabilities enabled.
+    :return: List of raw lines.
+    """
+    rng = random.Random(seed)
+    hostmasks = [_user(rng, i) for i in range(users)]
+    chans = [f"#channel{i}" for i in range(channels)]
+    lines = []
+    while len(lines) < count:
+        roll = rng.random()
+        user = rng.randrange(users)
+        who = hostmasks[user]
+        chan = rng.choice(chans)
+        tags = _tags(rng, user) if tagged else ""
+        if roll < 0.6:
+            text = " ".join(rng.choices(_WORDS, k=rng.randint(1, 20)))
+            lines.append(f"{tags}:{who} PRIVMSG {chan} :{text}")
+        elif roll < 0.7:
+            lines.append(f"{tags}:{who} JOIN :{chan}")
+        elif roll < 0.75:
+            lines.append(f":{who} PART {chan} :Leaving")
+        elif roll < 0.85:
+            # Netsplit burst
+            for mask in rng.sample(hostmasks, 20):
+                lines.append(f":{mask} QUIT :*.net *.split")
+        elif roll < 0.9:
+            nicks = " ".join(
+                m.split("!", 1)[0] for m in rng.sample(hostmasks, 40)
+            )
+            lines.append(f":irc.example.net 353 tama = {chan} :{nicks}")
+            lines.append(
+                f":irc.example.net 366 tama {chan} :End of /NAMES list."
+            )
+        elif roll < 0.95:
+            lines.append(f":{who} MODE {chan} +o {who.split('!', 1)[0]}")
+        else:
+            lines.append("PING :irc.example.net")
+    return [line.encode("utf-8") + b"\r\n" for line in lines[:count]]
+
+
+def generate_chat(count: int, seed: int = 108) -> List[str]:
+    """
+    Generates chat message texts: mostly plain talk, some with a link, some
+    commands and addressing other users.
+
+    :param count: Number of messages.
+    :param seed: Random seed so runs are comparable.
+    :return: List of message texts.
+    """
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(count):
+        words = rng.choices(_TALK, k=rng.randint(1, 20))
+        roll = rng.random()
+        if roll < 0.08:
+            link = rng.choice(_LINKS).format(
+                id=f"{rng.getrandbits(40):010x}", num=rng.randint(1, 99999)
+            )
+            words.insert(rng.randint(0, len(words)), link)
+        elif roll < 0.12:
+            words[0] = "." + words[0]
+        elif roll < 0.2:
+            words.insert(0, f"nick{rng.randint(0, 99)}:")
+        texts.append(" ".join(words))
+    return texts
+
+
+def generate_log(size: int, seed: int = 108) -> bytes:
+    """
+    Generates a raw log of at least the given size in bytes.
+
+    :param size: Minimum size in bytes.
+    :param seed: Random seed so runs are comparable.
+    :return: Raw log bytes.
+    """
+    data = bytearray()
+    while len(data) < size:
+        data += b"".join(generate_lines(10000, seed=seed))
+        seed += 1
+    return bytes(data)
+
+
+def load_log(path: str) -> bytes:
+    """
+    Loads a raw log with one message per line and normalises it to CRLF.
+
+    :param path: Path to the log file.
+    :return: Raw log bytes.
+    """
+    with open(path, "rb") as f:
+        lines = f.read().splitlines()
+    return b"".join(line + b"\r\n" for line in lines if line)
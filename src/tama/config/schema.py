@@ -12,15 +12,92 @@ class ServerServiceAuthConfig:
     password: str
 
 
+@dataclass
+class ServerSASLConfig:
+    # "PLAIN" or "EXTERNAL", defaults to PLAIN
+    mechanism: Optional[str]
+    # Account credentials for PLAIN
+    username: Optional[str]
+    password: Optional[str]
+    # Client certificate for EXTERNAL, the key may be in the same file
+    cert_file: Optional[str]
+    key_file: Optional[str]
+
+
+@dataclass
+class ServerFloodConfig:
+    # Disable to send without pacing
+    enabled: Optional[bool]
+    # Tokens available for a burst of messages
+    burst: Optional[float]
+    # Tokens refilled per second
+    rate: Optional[float]
+    # Message size that costs one extra token
+    bytes_per_token: Optional[int]
+    # Messages queued per channel or nickname before overflowing
+    target_limit: Optional[int]
+    # "drop" or "summarize" messages over target_limit
+    overflow: Optional[str]
+
+
+@dataclass
+class ServerReconnectConfig:
+    # Seconds the first retry may wait, doubled after each failure
+    base_delay: Optional[float]
+    # Upper bound for the retry delay
+    max_delay: Optional[float]
+    # Seconds a connection must stay up to reset the backoff
+    stable_after: Optional[float]
+    # Consecutive failures after which the network is parked
+    max_failures: Optional[int]
+    # Seconds a parked network waits before it is tried again
+    park_time: Optional[float]
+
+
 @dataclass
 class ServerConfig:
-    host: str
-    port: str
+    host: Optional[str]
+    port: Optional[str]
+    # Additional servers of the network as "host:port"
+    servers: Optional[List[str]]
     nick: str
     user: str
     realname: str
     channels: Optional[List[str]]
     service_auth: Optional[ServerServiceAuthConfig]
+    sasl: Optional[ServerSASLConfig]
+    # Bytes requested from the socket per read
+    read_size: Optional[int]
+    # Seconds to wait for the connection to be established
+    connect_timeout: Optional[float]
+    flood: Optional[ServerFloodConfig]
+    reconnect: Optional[ServerReconnectConfig]
+
+
+@dataclass
+class TLSConfig:
+    # Disable to skip certificate and hostname verification
+    verify: Optional[bool]
+    # CA bundle and directory used instead of the system certificates
+    ca_file: Optional[str]
+    ca_path: Optional[str]
+    # Oldest protocol version accepted, e.g. "TLSv1_2"
+    min_version: Optional[str]
+
+
+@dataclass
+class TasksConfig:
+    # Async handler tasks running at once per network
+    limit: Optional[int]
+    # Same, per plugin within a network
+    plugin_limit: Optional[int]
+    # Tasks waiting for a free slot before further ones are dropped
+    queue_limit: Optional[int]
+    # Tasks waiting behind the running one of a channel before further ones
+    # are dropped
+    channel_limit: Optional[int]
+    # Seconds running tasks get to finish on shutdown or reload
+    drain_timeout: Optional[float]
 
 
 @dataclass
@@ -29,6 +106,8 @@ class TamaConfig:
     log_folder: Optional[str]
     log_raw: Optional[bool]
     log_irc: Optional[bool]
+    tls: Optional[TLSConfig]
+    tasks: Optional[TasksConfig]
 
 
 @dataclass
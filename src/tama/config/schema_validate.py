@@ -44,6 +44,10 @@ def validate_map_schema(obj: Any, schema: Type[T], key: str = "") -> T:
                 f"Expected key {key} to be set. Found no value."
             )
 
+    # TOML integers are valid floats
+    if schema is float and type(obj) is int:
+        return float(obj)
+
     # If schema is a primitive type just validate said primitive
     if schema in PRIMITIVE_TYPES:
         if not isinstance(obj, schema):
@@ -1,25 +1,41 @@
 """
 
 """
-import re
 import asyncio as aio
 import logging
 import logging.handlers
-from typing import List, Dict, Optional, Union
+from time import perf_counter
+from typing import List, Dict, Optional, Union, Tuple, Set
 from pathlib import Path
 
-from tama.config import Config
+from tama.config import Config, ServerConfig
+from tama.util.regex import RegexDispatcher
 from tama.util.trie import Trie
 from tama.irc import IRCClient, IRCUser
+from tama.irc.servers import ServerPool
+from tama.irc.stream.tls import configure_tls
 from tama.irc.event import *
 from tama.core.plugins import *
 
 from .exit_status import ExitStatus
+from .reconnect import ReconnectPolicy
 from .client_proxy import ClientProxy
 from .exc import NameCollisionError
 
 __all__ = ["TamaBot"]
 
+# Seconds to wait for a connection to be established
+CONNECT_TIMEOUT = 30
+# Seconds handler tasks get to finish before the clients quit
+DRAIN_TIMEOUT = 10
+
+
+def _close_connected(task: aio.Task) -> None:
+    if task.cancelled() or task.exception() is not None:
+        return
+    if isinstance(client := task.result(), IRCClient):
+        client.stream.writer.close()
+
 
 class TamaBot:
     config: Config
@@ -27,13 +43,29 @@ class TamaBot:
     log_folder: str
     log_raw: bool
     log_irc: bool
+    # Name each buffer's log was first opened under, per network and folded
+    # buffer name
+    _irc_log_names: Dict[Tuple[str, str], str]
 
     clients: List[IRCClient]
     plugins: List[Plugin]
+    # Connection attempt history and backoff state per network
+    reconnect_policies: Dict[str, ReconnectPolicy]
+    # Servers of each network with their measured handshake times
+    server_pools: Dict[str, ServerPool]
+    # Networks that could not be connected on startup
+    _failed_connections: List[Tuple[str, ServerConfig]]
+    # Drains the handler tasks, then quits every client
+    _quit_task: Optional[aio.Task]
+    # Set on shutdown or reload, wakes run() while networks are reconnecting
+    _exit_requested: Optional[aio.Event]
 
     # Registered actions
     act_commands: Dict[str, Command]
     act_regex: List[Regex]
+    # Runs only the Regex actions whose required literal is in a message
+    act_regex_dispatcher: RegexDispatcher[Regex]
+    act_subscriptions: List[Subscription]
 
     act_commands_idx: Trie
 
@@ -56,8 +88,17 @@ class TamaBot:
         self.log_irc = (
             config.tama.log_irc if config.tama.log_irc is not None else True
         )
+        self._irc_log_names = {}
+        # Keeps cached TLS sessions across reloads unless the config changed
+        configure_tls(config.tama.tls)
         # Client bookkeeping
         self.clients = []
+        self.reconnect_policies = {}
+        self.server_pools = {}
+        self._failed_connections = []
+        self._quit_task = None
+        # Bound to the loop in run()
+        self._exit_requested = None
         # Load builtin plugins
         self.plugins = loader.load_builtins()
         # Load external plugins
@@ -65,6 +106,7 @@ class TamaBot:
         # For registered actions
         self.act_commands = {}
         self.act_regex = []
+        self.act_subscriptions = []
         self.act_commands_idx = Trie()
         # Only set exit status when exiting
         self._exit_status = None
@@ -73,14 +115,78 @@ class TamaBot:
 
     def connect(self, client: IRCClient):
         self.clients.append(client)
+        self._configure_supervisor(client)
         self._subscribe_client_events(client)
+        if self.log_raw:
+            self._setup_client_raw_logger(client)
 
     async def create_clients_from_config(self):
-        for name, srv in self.config.server.items():
-            client = await IRCClient.create(name, srv)
-            self.connect(client)
-            if self.log_raw:
-                self._setup_client_raw_logger(client)
+        # Connect to every network at once so one slow network doesn't hold
+        # up the others. Failed networks are reconnected once running.
+        results = await aio.gather(*(
+            self._create_client(name, srv)
+            for name, srv in self.config.server.items()
+        ))
+        for result in results:
+            if isinstance(result, IRCClient):
+                self.connect(result)
+            else:
+                self._failed_connections.append(result)
+
+    def _get_reconnect_policy(
+        self, name: str, cfg: ServerConfig
+    ) -> ReconnectPolicy:
+        if (policy := self.reconnect_policies.get(name)) is None:
+            policy = ReconnectPolicy.from_config(cfg.reconnect)
+            self.reconnect_policies[name] = policy
+        return policy
+
+    async def _create_client(
+        self, name: str, cfg: ServerConfig, delay: float = 0
+    ) -> Union[IRCClient, Tuple[str, ServerConfig]]:
+        """
+        Connects to a network. On failure the (name, config) pair is
+        returned, the same way a lost client reports itself for reconnection.
+        """
+        if delay > 0:
+            await aio.sleep(delay)
+        policy = self._get_reconnect_policy(name, cfg)
+        if (pool := self.server_pools.get(name)) is None:
+            pool = self.server_pools[name] = ServerPool.from_config(cfg)
+        timeout = cfg.connect_timeout or CONNECT_TIMEOUT
+        start = perf_counter()
+        try:
+            client = await aio.wait_for(
+                IRCClient.create(name, cfg, pool), timeout
+            )
+        except (OSError, aio.TimeoutError) as exc:
+            elapsed = perf_counter() - start
+            policy.failed(elapsed, repr(exc))
+            logging.getLogger(__name__).error(
+                "Connection to %s failed after %.3f s: %s",
+                name, elapsed, repr(exc),
+            )
+            return name, cfg
+        elapsed = perf_counter() - start
+        policy.connected(elapsed)
+        logging.getLogger(__name__).info(
+            "Connected to %s in %.3f s", name, elapsed
+        )
+        return client
+
+    def _schedule_reconnect(self, name: str, cfg: ServerConfig) -> aio.Task:
+        policy = self._get_reconnect_policy(name, cfg)
+        delay = policy.next_delay()
+        if policy.parked:
+            logging.getLogger(__name__).warning(
+                "Network %s failed %d times in a row, parking it for %.0f s",
+                name, policy.failures, delay,
+            )
+        else:
+            logging.getLogger(__name__).info(
+                "Reconnecting to %s in %.1f s", name, delay
+            )
+        return aio.create_task(self._create_client(name, cfg, delay))
 
     def _setup_plugins(self):
         for plug in self.plugins:
@@ -97,17 +203,45 @@ class TamaBot:
                     self.act_commands_idx.add(act.name)
                 elif isinstance(act, Regex):
                     self.act_regex.append(act)
+                elif isinstance(act, Subscription):
+                    self.act_subscriptions.append(act)
+        self.act_regex_dispatcher = RegexDispatcher(
+            (r.pattern, r) for r in self.act_regex
+        )
+
+    def _configure_supervisor(self, client: IRCClient) -> None:
+        tasks = self.config.tama.tasks
+        if tasks is None:
+            return
+        supervisor = client.bus.supervisor
+        if tasks.limit is not None:
+            supervisor.limit = tasks.limit
+        if tasks.plugin_limit is not None:
+            supervisor.owner_limit = tasks.plugin_limit
+        if tasks.queue_limit is not None:
+            supervisor.queue_limit = tasks.queue_limit
+        if tasks.channel_limit is not None:
+            supervisor.lane_limit = tasks.channel_limit
 
     def _subscribe_client_events(self, client: IRCClient) -> None:
+        # Logging and dispatch are sync so they happen as events arrive,
+        # only the async plugin actions they start are run as tasks
         client.bus.subscribe(InvitedEvent, self.on_invite)
         client.bus.subscribe(MessagedEvent, self.on_message)
         client.bus.subscribe(ClosedEvent, self.on_closed)
         client.bus.subscribe(BotJoinedEvent, self.on_join)
-        client.bus.subscribe(ChannelJoinedEvent, self.on_join)
+        # Netjoins and netsplits are logged as a whole by on_batch
+        client.bus.subscribe(ChannelJoinedEvent, self.on_join, batched=True)
         client.bus.subscribe(BotPartedEvent, self.on_part)
         client.bus.subscribe(ChannelPartedEvent, self.on_part)
         client.bus.subscribe(BotKickedEvent, self.on_kick)
         client.bus.subscribe(ChannelKickedEvent, self.on_kick)
+        client.bus.subscribe(QuitEvent, self.on_quit, batched=True)
+        client.bus.subscribe(BatchEvent, self.on_batch)
+        for sub in self.act_subscriptions:
+            client.bus.subscribe(
+                sub.event_type, sub.handler, filter=sub.filter
+            )
 
     def _unsubscribe_client_events(self, client: IRCClient) -> None:
         client.bus.unsubscribe(InvitedEvent, self.on_invite)
@@ -119,11 +253,19 @@ class TamaBot:
         client.bus.unsubscribe(ChannelPartedEvent, self.on_part)
         client.bus.unsubscribe(BotKickedEvent, self.on_kick)
         client.bus.unsubscribe(ChannelKickedEvent, self.on_kick)
+        client.bus.unsubscribe(QuitEvent, self.on_quit)
+        client.bus.unsubscribe(BatchEvent, self.on_batch)
+        for sub in self.act_subscriptions:
+            client.bus.unsubscribe(sub.event_type, sub.handler)
 
     def _setup_client_raw_logger(self, client: IRCClient) -> None:
         if not self.log_raw:
             return
 
+        # Loggers are shared between reconnections of the same network
+        if len(client.logger.handlers) > 0:
+            return
+
         log_dir = Path(self.log_folder)
         if not log_dir.is_dir():
             log_dir.mkdir(parents=True)
@@ -149,6 +291,19 @@ class TamaBot:
         if not log_dir.is_dir():
             log_dir.mkdir(parents=True)
 
+        # Differently cased names of a channel or user share a log, named
+        # as the buffer was first seen
+        fold = client.isupport.casemap.fold
+        key = (client.name, fold(buffer))
+        if (name := self._irc_log_names.get(key)) is None:
+            # Keep writing to an existing log, e.g. from before a restart
+            name = next((
+                path.stem for path in log_dir.glob("*.log")
+                if fold(path.stem) == key[1]
+            ), buffer)
+            self._irc_log_names[key] = name
+        buffer = name
+
         log = logging.getLogger(f"tama.server.{client.name}.irc.{buffer}")
         if len(log.handlers) == 0:
             hdl = logging.handlers.TimedRotatingFileHandler(
@@ -169,32 +324,59 @@ class TamaBot:
         pending = {
             aio.create_task(c.run()) for c in self.clients
         }
+        self._exit_requested = aio.Event()
+        exit_requested = aio.create_task(self._exit_requested.wait())
+        pending.add(exit_requested)
+        # Tasks which (re)connect a network
+        connecting: Set[aio.Task] = set()
+        for name, cfg in self._failed_connections:
+            connecting.add(self._schedule_reconnect(name, cfg))
+        self._failed_connections.clear()
+        pending.update(connecting)
+
         while self._exit_status is None:
             for task in done:
+                if task is exit_requested:
+                    continue
+                was_connecting = task in connecting
+                connecting.discard(task)
                 result = await task
                 # We only get a client when we queued recreating a lost one
                 if isinstance(result, IRCClient):
                     self.connect(result)
                     pending.add(aio.create_task(result.run()))
-                # We get (name, config) when we lost a client
+                # We get (name, config) when we lost a client or failed to
+                # connect
                 elif isinstance(result, tuple):
                     name, cfg = result
-                    pending.add(aio.create_task(IRCClient.create_after(
-                        name, cfg, 5
-                    )))
+                    if not was_connecting:
+                        self._get_reconnect_policy(name, cfg).disconnected()
+                    task = self._schedule_reconnect(name, cfg)
+                    connecting.add(task)
+                    pending.add(task)
             done, pending = await aio.wait(
                 pending, return_when=aio.FIRST_COMPLETED
             )
 
+        exit_requested.cancel()
+        pending.discard(exit_requested)
+        # Don't bring up networks which would never be shut down, and close
+        # the ones which connected meanwhile
+        for task in connecting:
+            task.cancel()
+            # Connections may complete before the cancellation reaches them
+            task.add_done_callback(_close_connected)
+        pending -= connecting
+
         if len(pending) > 0:
             await aio.wait(pending, return_when=aio.ALL_COMPLETED)
 
         return self._exit_status
 
-    async def on_invite(self, evt: InvitedEvent):
+    def on_invite(self, evt: InvitedEvent):
         evt.client.join(evt.to)
 
-    async def on_join(self, evt: Union[BotJoinedEvent, ChannelJoinedEvent]):
+    def on_join(self, evt: Union[BotJoinedEvent, ChannelJoinedEvent]):
         log = self._get_irc_logger(evt.client, evt.channel)
         if log:
             log.info(
@@ -202,7 +384,7 @@ class TamaBot:
                 evt.who.nick, evt.who.address, evt.channel,
             )
 
-    async def on_part(self, evt: Union[BotPartedEvent, ChannelPartedEvent]):
+    def on_part(self, evt: Union[BotPartedEvent, ChannelPartedEvent]):
         log = self._get_irc_logger(evt.client, evt.channel)
         if log:
             log.info(
@@ -210,7 +392,7 @@ class TamaBot:
                 evt.who.nick, evt.who.address, evt.channel, evt.message,
             )
 
-    async def on_kick(self, evt: Union[BotKickedEvent, ChannelKickedEvent]):
+    def on_kick(self, evt: Union[BotKickedEvent, ChannelKickedEvent]):
         log = self._get_irc_logger(evt.client, evt.channel)
         if log:
             log.info(
@@ -219,7 +401,53 @@ class TamaBot:
                 evt.target, evt.channel, evt.message,
             )
 
-    async def on_message(self, evt: MessagedEvent):
+    def on_quit(self, evt: QuitEvent):
+        for channel in evt.channels:
+            log = self._get_irc_logger(evt.client, channel)
+            if log:
+                log.info(
+                    "* %s (%s) has quit (%s)",
+                    evt.who.nick, evt.who.address, evt.message,
+                )
+
+    def on_batch(self, evt: BatchEvent):
+        if not self.log_irc:
+            return
+        # One line per channel for all the joins, and per channel and reason
+        # for the quits, instead of one per user
+        joins: Dict[str, List[ChannelJoinedEvent]] = {}
+        quits: Dict[Tuple[str, str], List[QuitEvent]] = {}
+        for event in evt.flatten():
+            if isinstance(event, ChannelJoinedEvent):
+                joins.setdefault(event.channel, []).append(event)
+            elif isinstance(event, QuitEvent):
+                for channel in event.channels:
+                    quits.setdefault((channel, event.message), []).append(
+                        event
+                    )
+
+        for channel, events in joins.items():
+            if len(events) == 1:
+                self.on_join(events[0])
+                continue
+            self._get_irc_logger(evt.client, channel).info(
+                "* %s have joined %s",
+                ", ".join(e.who.nick for e in events), channel,
+            )
+        for (channel, message), events in quits.items():
+            if len(events) == 1:
+                log = self._get_irc_logger(evt.client, channel)
+                log.info(
+                    "* %s (%s) has quit (%s)",
+                    events[0].who.nick, events[0].who.address, message,
+                )
+                continue
+            self._get_irc_logger(evt.client, channel).info(
+                "* %s have quit (%s)",
+                ", ".join(e.who.nick for e in events), message,
+            )
+
+    def on_message(self, evt: MessagedEvent):
         # Log message before parsing
         log = self._get_irc_logger(evt.client, evt.where)
         if log:
@@ -260,24 +488,47 @@ class TamaBot:
                     return
 
             if r.is_async:
-                result = await r.async_executor(text, **exec_kwargs)
+                self._spawn_action(r, r.async_executor, text, evt, exec_kwargs)
             else:
                 result = r.executor(text, **exec_kwargs)
+                if result:
+                    evt.client.privmsg(evt.where, f"{evt.who.nick}, {result}")
 
+        # Run regexp parsers
+        for r, match in self.act_regex_dispatcher.match(evt.message):
+            if r.is_async:
+                self._spawn_action(
+                    r, r.async_executor, match, evt, exec_kwargs
+                )
+                continue
+            result = r.executor(match, **exec_kwargs)
             if result:
                 evt.client.privmsg(evt.where, f"{evt.who.nick}, {result}")
 
-        # Run regexp parsers
-        for r in self.act_regex:
-            match = re.match(r.pattern, evt.message)
-            if match:
-                if r.is_async:
-                    result = await r.async_executor(match, **exec_kwargs)
-                else:
-                    result = r.executor(match, **exec_kwargs)
+    def _spawn_action(
+        self,
+        action: Action,
+        executor,
+        arg,
+        evt: MessagedEvent,
+        exec_kwargs: dict,
+    ) -> None:
+        # Async actions run as tasks of the network, attributed to their
+        # plugin. They run in the lane of the channel, so their replies keep
+        # the message order.
+        plugin = action.parent_plugin()
+        evt.client.bus.supervisor.spawn(
+            plugin.module_name, self._run_action,
+            executor, arg, evt, exec_kwargs,
+            lane=evt.client.bus.lane_of(evt),
+        )
 
-                if result:
-                    evt.client.privmsg(evt.where, f"{evt.who.nick}, {result}")
+    async def _run_action(
+        self, executor, arg, evt: MessagedEvent, exec_kwargs: dict
+    ) -> None:
+        result = await executor(arg, **exec_kwargs)
+        if result:
+            evt.client.privmsg(evt.where, f"{evt.who.nick}, {result}")
 
     async def on_closed(self, evt: ClosedEvent):
         # Stop listening for events as we are entering a shutdown state
@@ -285,10 +536,38 @@ class TamaBot:
 
     def shutdown(self, reason: str):
         self._exit_status = ExitStatus.QUIT
-        for client in self.clients:
-            client.quit(reason)
+        self._quit_clients(reason)
 
     def reload(self, reason: str):
         self._exit_status = ExitStatus.RELOAD
-        for client in self.clients:
-            client.quit(reason)
+        self._quit_clients(reason)
+
+    def _quit_clients(self, reason: str) -> None:
+        if self._exit_requested is not None:
+            self._exit_requested.set()
+        if self._quit_task is not None:
+            # Asked again while draining, don't wait any longer
+            self._quit_task.cancel()
+            for client in self.clients:
+                client.quit(reason)
+            return
+        self._quit_task = aio.ensure_future(self._drain_and_quit(reason))
+
+    async def _drain_and_quit(self, reason: str) -> None:
+        """
+        Gives the running handler tasks of every client time to finish, so
+        their replies are sent before the clients quit. Meanwhile only new
+        async plugin work is refused, events are still logged and sync
+        actions still run as the bot's handlers don't need the supervisor.
+        """
+        tasks = self.config.tama.tasks
+        timeout = DRAIN_TIMEOUT
+        if tasks is not None and tasks.drain_timeout is not None:
+            timeout = tasks.drain_timeout
+        clients = list(self.clients)
+        await aio.gather(*(
+            client.bus.supervisor.drain(timeout) for client in clients
+        ))
+        for client in clients:
+            # Replies of the drained tasks go out before the QUIT
+            client.quit(reason, after_queued=True)
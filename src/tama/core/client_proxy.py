@@ -1,7 +1,10 @@
 from logging import Logger
-from typing import Optional, TYPE_CHECKING
+from typing import Optional, Iterable, List, TYPE_CHECKING
 
 from tama.irc import IRCClient
+from tama.irc.client import RawHandler
+from tama.irc.state import ChannelState
+from tama.irc.stream import IRCMessage
 
 if TYPE_CHECKING:
     from tama.core.bot import TamaBot
@@ -19,6 +22,10 @@ class ClientProxy:
         self.client = client
         self.bot = bot
 
+    @property
+    def channels(self) -> ChannelState:
+        return self.client.channels
+
     def _get_irc_logger(self, target: str) -> Optional[Logger]:
         # Very intimate access
         return self.bot._get_irc_logger(self.client, target)  # noqa
@@ -34,3 +41,29 @@ class ClientProxy:
         if log:
             log.info("-%s- %s", self.client.nickname, message)
         self.client.notice(target, message)
+
+    def broadcast(self, targets: Iterable[str], message: str) -> None:
+        targets = list(targets)
+        for target in targets:
+            log = self._get_irc_logger(target)
+            if log:
+                log.info("<%s> %s", self.client.nickname, message)
+        self.client.broadcast(targets, message)
+
+    async def whois(self, nick: str) -> List[IRCMessage]:
+        return await self.client.whois(nick)
+
+    async def who(self, mask: str) -> List[IRCMessage]:
+        return await self.client.who(mask)
+
+    async def names(self, channel: str) -> List[IRCMessage]:
+        return await self.client.names(channel)
+
+    async def mode(self, target: str) -> List[IRCMessage]:
+        return await self.client.mode(target)
+
+    def add_raw_handler(self, command: str, handler: RawHandler) -> None:
+        self.client.add_raw_handler(command, handler)
+
+    def remove_raw_handler(self, command: str, handler: RawHandler) -> None:
+        self.client.remove_raw_handler(command, handler)
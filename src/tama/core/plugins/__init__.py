@@ -1,4 +1,5 @@
 from .plugin import Plugin
-from .api_internal import Action, Command, Regex
+from .api_internal import Action, Command, Regex, Subscription
 
-__all__ = ["api", "loader", "Plugin", "Action", "Command", "Regex"]
+__all__ = ["api", "loader", "Plugin", "Action", "Command", "Regex",
+           "Subscription"]
@@ -3,19 +3,34 @@ Defines functions available as the public plugin API.
 """
 import inspect
 import functools
+import asyncio as aio
 import logging
 import traceback
 import os.path
-from typing import List, Optional, Callable, cast
+from typing import List, Optional, Callable, Collection, Type, cast
+
+from tama.event import Event, EventFilter
 
 from .api_internal import *
 
-__all__ = ["command", "regex"]
+__all__ = ["command", "regex", "event"]
 
 
 def _wrap_kwargs(f: Callable) -> Callable:
     sig = inspect.signature(f)
 
+    if aio.iscoroutinefunction(f):
+        @functools.wraps(f)
+        async def async_wrapper(*args, **kwargs) -> Optional[str]:
+            w_kwargs = {
+                k: v for k, v in kwargs.items() if k in sig.parameters.keys()
+            }
+            # Exceptions are logged by the task supervisor, attributed to
+            # the plugin
+            return await f(*args, **w_kwargs)
+
+        return async_wrapper
+
     @functools.wraps(f)
     def wrapper(*args, **kwargs) -> Optional[str]:
         w_kwargs = {
@@ -67,3 +82,30 @@ def regex(pattern: str):
         )
         return wrapper
     return decorator
+
+
+def event(
+    event_type: Type[Event],
+    *,
+    channels: Collection[str] = None,
+    networks: Collection[str] = None,
+    senders: Collection[str] = None,
+    prefix: Collection[str] = None
+):
+    """
+    Subscribes the decorated function to an event on every network. Events
+    of channels, networks and senders not listed never reach it.
+    """
+    flt = None
+    if channels or networks or senders or prefix:
+        flt = EventFilter(channels, networks, senders, prefix)
+
+    def decorator(f: Callable[[Event], None]):
+        # Sync subscribers are called while the client reads, their
+        # exceptions must not reach it
+        wrapper = _wrap_kwargs(f)
+        setattr(
+            wrapper, "_tama_action", Subscription(wrapper, event_type, flt)
+        )
+        return wrapper
+    return decorator
@@ -4,13 +4,15 @@ Defines the plugin API internals.
 import re
 import asyncio as aio
 from typing import Protocol, Callable, Pattern, Match, Optional, Union, Any, \
-                   TYPE_CHECKING
+                   Type, TYPE_CHECKING
+
+from tama.event import Event, EventFilter
 
 if TYPE_CHECKING:
     from tama.core.bot import TamaBot
     from tama.core.plugins.plugin import Plugin
 
-__all__ = ["Action", "Command", "Regex"]
+__all__ = ["Action", "Command", "Regex", "Subscription"]
 
 
 class Action:
@@ -105,3 +107,25 @@ class Regex(Action):
     ):
         super().__init__(executor)
         self.pattern = re.compile(pattern)
+
+
+class Subscription(Action):
+    event_type: Type[Event]
+    # Criteria events must match to reach the executor, None for all events
+    filter: Optional[EventFilter]
+    executor: Optional[Callable[[Event], None]]
+    async_executor: Optional[Callable[[Event], Any]]
+
+    def __init__(
+        self,
+        executor: Callable[[Event], Any],
+        event_type: Type[Event],
+        filter: Optional[EventFilter] = None
+    ):
+        super().__init__(executor)
+        self.event_type = event_type
+        self.filter = filter
+
+    @property
+    def handler(self) -> Callable[[Event], Any]:
+        return self.async_executor if self.is_async else self.executor
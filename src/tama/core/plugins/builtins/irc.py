@@ -1,6 +1,7 @@
 from tama import api, TamaBot
+from tama.irc.stream.tls import get_session_caches
 
-__all__ = ["nick", "say", "message","quit_", "reload"]
+__all__ = ["nick", "say", "message","quit_", "reload", "networks"]
 
 
 @api.command(permissions=["bot_control"])
@@ -60,3 +61,75 @@ def quit_(text: str, bot: TamaBot = None) -> None:
 def reload(text: str, bot: TamaBot = None) -> None:
     reason = text.strip()
     bot.reload(reason)
+
+
+@api.command(permissions=["bot_control"])
+def networks(
+    text: str, sender: TamaBot.User = None,
+    bot: TamaBot = None, client: TamaBot.Client = None
+) -> None:
+    """[network] - shows recent connection attempts for each network"""
+    name = text.strip()
+    for net, policy in bot.reconnect_policies.items():
+        if name and net != name:
+            continue
+        if policy.is_connected:
+            state = "connected"
+        elif policy.parked:
+            state = "parked"
+        else:
+            state = "reconnecting"
+        client.notice(
+            sender.nick,
+            f"{net}: {state}, {policy.failures} consecutive failures",
+        )
+        for irc in bot.clients:
+            if irc.name == net:
+                client.notice(
+                    sender.nick,
+                    f"{net}: {len(irc.channels)} channels, "
+                    f"{len(irc.channels.members)} users, "
+                    f"{irc.channels.memory_usage() // 1024} KiB of state",
+                )
+                tasks = irc.bus.supervisor
+                client.notice(
+                    sender.nick,
+                    f"{net}: {len(tasks)} handler tasks running, "
+                    f"{tasks.queued} queued, "
+                    f"{sum(tasks.failed.values())} failed",
+                )
+                client.notice(
+                    sender.nick,
+                    f"{net}: {tasks.lanes} channels busy, "
+                    f"{tasks.backlog()} tasks waiting in them, "
+                    f"at most {tasks.max_backlog} in one",
+                )
+                if irc.ready_after is not None:
+                    client.notice(
+                        sender.nick,
+                        f"{net}: ready {irc.ready_after:.2f}s after "
+                        f"connecting, channels joined {irc.joined_after:.2f}s "
+                        f"after registration",
+                    )
+        for attempt in list(policy.history)[-5:]:
+            line = (
+                f"{net}: {attempt.at:%Y-%m-%d %H:%M:%S} "
+                f"took {attempt.duration:.2f}s, "
+            )
+            if attempt.error:
+                line += f"failed with {attempt.error}"
+            elif attempt.uptime is not None:
+                line += f"stayed up {attempt.uptime:.0f}s"
+            else:
+                line += "connected"
+            client.notice(sender.nick, line)
+
+    handshakes = resumed = 0
+    for cache in get_session_caches():
+        handshakes += cache.handshakes
+        resumed += cache.resumed
+    if handshakes:
+        client.notice(
+            sender.nick,
+            f"TLS: {handshakes} handshakes, {resumed / handshakes:.0%} resumed",
+        )
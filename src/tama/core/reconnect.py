@@ -0,0 +1,154 @@
+"""
+Decides when a lost or failed network connection is retried.
+
+Retries back off exponentially with full jitter. A connection that stays up
+for a while resets the backoff, while a network which keeps failing is parked
+for a longer period by a circuit breaker before a single new attempt is made.
+"""
+import random
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from time import monotonic
+from typing import Optional, Deque
+
+from tama.config.schema import ServerReconnectConfig
+
+__all__ = ["ConnectAttempt", "ReconnectPolicy"]
+
+# Defaults for ServerReconnectConfig
+BASE_DELAY = 5.0
+MAX_DELAY = 300.0
+STABLE_AFTER = 60.0
+MAX_FAILURES = 10
+PARK_TIME = 1800.0
+# Connect attempts remembered per network
+HISTORY_SIZE = 20
+
+
+@dataclass
+class ConnectAttempt:
+    """
+    Outcome of a single connection attempt.
+    """
+    at: datetime
+    # Seconds spent connecting
+    duration: float
+    # Reason the attempt failed, None if it connected
+    error: Optional[str] = None
+    # Seconds the connection stayed up, None while connected or on failure
+    uptime: Optional[float] = None
+
+
+class ReconnectPolicy:
+    __slots__ = (
+        "base_delay", "max_delay", "stable_after", "max_failures",
+        "park_time", "failures", "parked_until", "history", "_connected_at",
+    )
+
+    base_delay: float
+    max_delay: float
+    # Seconds a connection must stay up to reset the backoff
+    stable_after: float
+    # Consecutive failures after which the network is parked
+    max_failures: int
+    park_time: float
+
+    # Consecutive failed attempts or unstable connections
+    failures: int
+    # Monotonic time until which the network is parked, if parked
+    parked_until: Optional[float]
+    history: Deque[ConnectAttempt]
+    _connected_at: Optional[float]
+
+    def __init__(
+        self,
+        base_delay: float = BASE_DELAY,
+        max_delay: float = MAX_DELAY,
+        stable_after: float = STABLE_AFTER,
+        max_failures: int = MAX_FAILURES,
+        park_time: float = PARK_TIME,
+    ) -> None:
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stable_after = stable_after
+        self.max_failures = max_failures
+        self.park_time = park_time
+        self.failures = 0
+        self.parked_until = None
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self._connected_at = None
+
+    @classmethod
+    def from_config(
+        cls, cfg: Optional[ServerReconnectConfig]
+    ) -> "ReconnectPolicy":
+        if cfg is None:
+            return cls()
+        return cls(
+            base_delay=cfg.base_delay or BASE_DELAY,
+            max_delay=cfg.max_delay or MAX_DELAY,
+            stable_after=cfg.stable_after or STABLE_AFTER,
+            max_failures=cfg.max_failures or MAX_FAILURES,
+            park_time=cfg.park_time or PARK_TIME,
+        )
+
+    @property
+    def parked(self) -> bool:
+        if self.parked_until is None:
+            return False
+        return monotonic() < self.parked_until
+
+    @property
+    def is_connected(self) -> bool:
+        return self._connected_at is not None
+
+    def connected(self, duration: float) -> None:
+        """
+        Records a successful connection attempt.
+
+        :param duration: Seconds spent connecting.
+        """
+        self._connected_at = monotonic()
+        self.parked_until = None
+        self.history.append(ConnectAttempt(datetime.now(), duration))
+
+    def failed(self, duration: float, error: str) -> None:
+        """
+        Records a failed connection attempt.
+
+        :param duration: Seconds spent connecting.
+        :param error: Reason the attempt failed.
+        """
+        self.failures += 1
+        self.history.append(ConnectAttempt(datetime.now(), duration, error))
+
+    def disconnected(self) -> None:
+        """
+        Records the loss of an established connection. Connections that were
+        not stable count as failures.
+        """
+        if self._connected_at is None:
+            return
+        uptime = monotonic() - self._connected_at
+        self._connected_at = None
+        if self.history and self.history[-1].error is None:
+            self.history[-1].uptime = uptime
+        if uptime >= self.stable_after:
+            self.failures = 0
+        else:
+            self.failures += 1
+
+    def next_delay(self) -> float:
+        """
+        Seconds to wait before the next connection attempt.
+        """
+        if self.failures >= self.max_failures:
+            # Open the circuit, then allow a single attempt once parked
+            self.parked_until = monotonic() + self.park_time
+            return self.park_time
+        # Full jitter: anywhere between no wait and the exponential backoff
+        backoff = min(
+            self.max_delay, self.base_delay * 2 ** min(self.failures, 32)
+        )
+        return random.uniform(0, backoff)
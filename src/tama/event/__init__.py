@@ -5,5 +5,7 @@ event bus acting as an observable.
 """
 from .event import Event
 from .bus import EventBus
+from .filter import EventFilter
+from .supervisor import TaskSupervisor
 
-__all__ = ["Event", "EventBus"]
+__all__ = ["Event", "EventBus", "EventFilter", "TaskSupervisor"]
@@ -1,14 +1,36 @@
 """
 Defines an event bus that broadcasts a sequence of events to a series of
-subscribers. The event handlers may be coroutines, which will be executed
-within the current event loop.
+subscribers. The event handlers may be coroutines, which are run as tasks of
+the bus' TaskSupervisor within the current event loop.
+
+Subscribers of an event class also receive the events of its subclasses, e.g.
+a JoinedEvent subscriber receives BotJoinedEvent and ChannelJoinedEvent. The
+handlers of each concrete event class are resolved once along its MRO and
+cached until the subscriptions change, with each handler already classified
+as sync or async, so broadcasting is a dictionary lookup and a loop.
+
+Async handlers of an event concerning a single channel, or a private message,
+run in the supervisor lane of that channel, so they handle its events in the
+order they arrived while other channels go on in parallel.
+
+Subscriptions may be narrowed with an EventFilter. Filtered handlers are
+indexed by channel, or by network if they don't name channels, so an event
+only reaches the handlers of its own channel and network. Only filters naming
+neither are checked against every event.
+
+Events may also arrive grouped, e.g. every QUIT of a netsplit. The group is
+broadcast as a single event first, then its events are broadcast one by one
+to the subscribers which didn't say they handle the group themselves.
 """
 import asyncio as aio
 from typing import (
-    Type, TypeVar, Union, Callable, Awaitable, Dict, List, Collection
+    Type, TypeVar, Union, Callable, Awaitable, Dict, List, Set, Tuple,
+    Collection, Optional,
 )
 
 from .event import Event
+from .filter import EventFilter, channels_getter, network_getter
+from .supervisor import TaskSupervisor, owner_of
 
 __all__ = ["EventBus"]
 
@@ -16,60 +38,292 @@ T = TypeVar("T")
 E = TypeVar("E", bound=Event)
 
 RET = Union[None, Awaitable[None]]
+Handler = Callable[[E], RET]
+# Handler and the owner its tasks are attributed to, None if it is sync
+Target = Tuple[Handler, Optional[str]]
+# Same, with the filter of the subscription
+FilteredTarget = Tuple[Handler, Optional[str], EventFilter]
+
+
+class Dispatch:
+    """
+    Handlers resolved for a concrete event class.
+    """
+    __slots__ = (
+        "plain", "by_channel", "by_network", "scan", "filtered", "spawns",
+        "channels_of", "network_of",
+    )
+
+    # Handlers without a filter
+    plain: Tuple[Target, ...]
+    # Filtered handlers by folded channel name, then by network for filters
+    # without channels, then those naming neither
+    by_channel: Dict[str, List[FilteredTarget]]
+    by_network: Dict[str, List[FilteredTarget]]
+    scan: List[FilteredTarget]
+    # Whether there are any filtered handlers
+    filtered: bool
+    # Whether any handler is async, so the event's lane is needed
+    spawns: bool
+    # Get the channels and network of an event of the class
+    channels_of: Callable[[E], Tuple[str, ...]]
+    network_of: Callable[[E], Optional[str]]
+
+    def __init__(self, event_type: Type[E]) -> None:
+        self.plain = ()
+        self.by_channel = {}
+        self.by_network = {}
+        self.scan = []
+        self.filtered = False
+        self.spawns = False
+        self.channels_of = channels_getter(event_type)
+        self.network_of = network_getter(event_type)
 
 
 class EventBus:
-    event_handlers: Dict[Type[E], List[Callable[[E], RET]]]
+    __slots__ = (
+        "accept", "event_handlers", "batched_handlers", "supervisor", "fold",
+        "_owners", "_dispatch", "_dispatch_batched",
+    )
+
+    # Event classes which may be broadcast
+    accept: Tuple[Type[Event], ...]
+    # Handlers and their filter by the event class they subscribed to
+    event_handlers: Dict[Type[E], List[Tuple[Handler, Optional[EventFilter]]]]
+    # Handlers which receive grouped events through the group only
+    batched_handlers: Dict[Type[E], Set[Handler]]
+    # Runs the async handlers
+    supervisor: TaskSupervisor
+    # Case folding of the channel names filters are indexed by
+    fold: Callable[[str], str]
+    # Owner of each subscribed coroutine function, None for sync handlers
+    _owners: Dict[Handler, Optional[str]]
+    # Resolved handlers by concrete event class, for events broadcast alone
+    # and as part of a group
+    _dispatch: Dict[Type[E], Dispatch]
+    _dispatch_batched: Dict[Type[E], Dispatch]
 
-    def __init__(self, accept: Collection[Type[Event]] = ()) -> None:
+    def __init__(
+        self,
+        accept: Collection[Type[Event]] = (),
+        supervisor: Optional[TaskSupervisor] = None,
+    ) -> None:
         """
         Creates a new EventBus.
 
         :param accept: Collection of accepted Event subclasses.
+        :param supervisor: Runs the async handlers, a new one with the
+                           default limits if not given.
         """
         for event_type in accept:
             if not issubclass(event_type, Event):
                 raise TypeError
+        self.accept = tuple(accept)
         self.event_handlers = {
             event_type: [] for event_type in accept
         }
+        self.batched_handlers = {
+            event_type: set() for event_type in accept
+        }
+        if supervisor is None:
+            supervisor = TaskSupervisor()
+        self.supervisor = supervisor
+        self.fold = str.lower
+        self._owners = {}
+        self._dispatch = {}
+        self._dispatch_batched = {}
 
-    def subscribe(self, event_type: Type[E], handler: Callable[[E], RET]) -> None:
+    def subscribe(
+        self,
+        event_type: Type[E],
+        handler: Handler,
+        batched: bool = False,
+        filter: Optional[EventFilter] = None,
+    ) -> None:
         """
         Attach a new subscriber for the given event type. The handler function
-        will be called with an instance of the given event as argument.
+        will be called with an instance of the given event, or of any of its
+        subclasses, as argument.
 
-        :param event_type: Any accepted subclass of Event.
+        :param event_type: Any accepted subclass of Event, or a base class of
+                           one.
         :param handler: Function receiving the given Event as argument.
+        :param batched: Whether events of this type which arrive grouped are
+                        handled through a subscriber of the group instead, so
+                        handler only receives them when they arrive alone.
+        :param filter: Criteria events must match to reach handler.
         :return: None
         """
         if event_type not in self.event_handlers:
-            raise TypeError
-        self.event_handlers[event_type].append(handler)
+            if not any(issubclass(a, event_type) for a in self.accept):
+                raise TypeError
+            self.event_handlers[event_type] = []
+            self.batched_handlers[event_type] = set()
+        self.event_handlers[event_type].append((handler, filter))
+        if aio.iscoroutinefunction(handler):
+            self._owners[handler] = owner_of(handler)
+        else:
+            self._owners[handler] = None
+        if batched:
+            self.batched_handlers[event_type].add(handler)
+        self._invalidate()
 
-    def unsubscribe(self, event_type: Type[E], handler: Callable[[E], RET]) -> None:
+    def unsubscribe(self, event_type: Type[E], handler: Handler) -> None:
         """
-        Remove a subscriber for a given Event.
+        Remove a subscriber for a given Event. If it subscribed more than
+        once, the oldest subscription is removed.
 
-        :param event_type: Any accepted subclass of Event.
+        :param event_type: Event class the handler subscribed to.
         :param handler: Subscriber to remove.
         :return: None
         """
         if event_type not in self.event_handlers:
             raise TypeError
-        self.event_handlers[event_type].remove(handler)
+        subscriptions = self.event_handlers[event_type]
+        for i, (subscribed, _) in enumerate(subscriptions):
+            if subscribed == handler:
+                del subscriptions[i]
+                break
+        else:
+            raise ValueError("Handler is not subscribed")
+        if not any(h == handler for h, _ in subscriptions):
+            self.batched_handlers[event_type].discard(handler)
+        if not any(
+            h == handler
+            for subscriptions in self.event_handlers.values()
+            for h, _ in subscriptions
+        ):
+            del self._owners[handler]
+        self._invalidate()
+
+    def set_fold(self, fold: Callable[[str], str]) -> None:
+        """
+        Changes the case folding of channel names, e.g. when the server
+        announces its case mapping.
+        """
+        self.fold = fold
+        self._invalidate()
 
-    def broadcast(self, event: E) -> None:
+    def broadcast(self, event: E, batched: bool = False) -> None:
         """
         Broadcasts a Event to all relevant subscribers.
 
         :param event: Event that will be broadcast.
+        :param batched: Whether the event is part of a group which was already
+                        broadcast, subscribers handling the group are skipped.
         :return: None
         """
-        if (event_type := type(event)) not in self.event_handlers:
-            raise TypeError
-        for handler in self.event_handlers[event_type]:
-            if aio.iscoroutinefunction(handler):
-                aio.ensure_future(handler(event))
+        handlers = self._get_dispatch(type(event), batched)
+        lane = self._lane(handlers, event) if handlers.spawns else None
+        # Events are never dropped for a full lane, only plugin actions are
+        spawn = self.supervisor.spawn
+        for handler, owner in handlers.plain:
+            if owner is not None:
+                spawn(owner, handler, event, lane=lane, bounded=False)
             else:
                 handler(event)
+        if handlers.filtered:
+            for handler, owner in self._match(handlers, event):
+                if owner is not None:
+                    spawn(owner, handler, event, lane=lane, bounded=False)
+                else:
+                    handler(event)
+
+    def lane_of(self, event: E) -> Optional[str]:
+        """
+        Supervisor lane the async handlers of an event run in, the folded
+        name of its channel. None for events concerning no channel or
+        several, whose handlers run independently.
+
+        :param event: Event broadcast.
+        :return: Lane name.
+        """
+        return self._lane(self._get_dispatch(type(event), False), event)
+
+    def _lane(self, dispatch: Dispatch, event: E) -> Optional[str]:
+        channels = dispatch.channels_of(event)
+        if len(channels) != 1:
+            return None
+        return self.fold(channels[0])
+
+    def _get_dispatch(self, event_type: Type[E], batched: bool) -> Dispatch:
+        dispatch = self._dispatch_batched if batched else self._dispatch
+        if (handlers := dispatch.get(event_type)) is None:
+            handlers = dispatch[event_type] = self._resolve(
+                event_type, batched
+            )
+        return handlers
+
+    def _match(self, dispatch: Dispatch, event: E) -> List[Target]:
+        matched = []
+        if dispatch.by_channel:
+            by_channel = dispatch.by_channel
+            fold = self.fold
+            channels = dispatch.channels_of(event)
+            seen = set() if len(channels) > 1 else None
+            for channel in channels:
+                if (targets := by_channel.get(fold(channel))) is None:
+                    continue
+                network = dispatch.network_of(event)
+                for target in targets:
+                    handler, owner, flt = target
+                    if flt.networks is not None and network not in flt.networks:
+                        continue
+                    if not flt.matches_rest(event, fold):
+                        continue
+                    # Events may concern several of the filter channels
+                    if seen is not None:
+                        if id(target) in seen:
+                            continue
+                        seen.add(id(target))
+                    matched.append((handler, owner))
+        if dispatch.by_network:
+            targets = dispatch.by_network.get(dispatch.network_of(event), ())
+            for handler, owner, flt in targets:
+                if flt.matches_rest(event, self.fold):
+                    matched.append((handler, owner))
+        for handler, owner, flt in dispatch.scan:
+            if flt.matches_rest(event, self.fold):
+                matched.append((handler, owner))
+        return matched
+
+    def _resolve(self, event_type: Type[E], batched: bool) -> Dispatch:
+        if not issubclass(event_type, self.accept):
+            raise TypeError
+        dispatch = Dispatch(event_type)
+        plain = []
+        fold = self.fold
+        # Handlers of the most specific class first
+        for cls in event_type.__mro__:
+            if (subscribed := self.event_handlers.get(cls)) is None:
+                continue
+            skip = self.batched_handlers[cls] if batched else ()
+            for handler, flt in subscribed:
+                if handler in skip:
+                    continue
+                owner = self._owners[handler]
+                if owner is not None:
+                    dispatch.spawns = True
+                if flt is None:
+                    plain.append((handler, owner))
+                    continue
+                target = handler, owner, flt
+                dispatch.filtered = True
+                if flt.channels is not None:
+                    for channel in {fold(chan) for chan in flt.channels}:
+                        dispatch.by_channel.setdefault(channel, []).append(
+                            target
+                        )
+                elif flt.networks is not None:
+                    for network in flt.networks:
+                        dispatch.by_network.setdefault(network, []).append(
+                            target
+                        )
+                else:
+                    dispatch.scan.append(target)
+        dispatch.plain = tuple(plain)
+        return dispatch
+
+    def _invalidate(self) -> None:
+        self._dispatch.clear()
+        self._dispatch_batched.clear()
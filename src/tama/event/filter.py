@@ -0,0 +1,167 @@
+"""
+Declarative filters narrowing the events a subscriber receives.
+
+Filters look at the attributes IRC events carry: the network through
+event.client.name, the channel through event.channel or event.where (or
+event.channels for events concerning several), the sender through
+event.who.address and the text through event.message. Events lacking an
+attribute a filter constrains never match it.
+
+Channel and network filters are indexed by the EventBus, so events of other
+channels or networks never reach the subscriber. Sender masks and message
+prefixes are checked on the events which pass the index.
+
+Sender masks are IRC masks: * matches any run of characters, ? a single one,
+and everything else, [ and ] included, itself. Masks and addresses are
+compared folded with the server case mapping.
+"""
+import re
+from typing import (
+    Callable, Collection, FrozenSet, Optional, Pattern, Set, Tuple, Type,
+)
+
+from .event import Event
+
+__all__ = [
+    "EventFilter", "channels_of", "network_of",
+    "channels_getter", "network_getter", "mask_pattern",
+]
+
+
+def network_of(event: Event) -> Optional[str]:
+    client = getattr(event, "client", None)
+    return getattr(client, "name", None)
+
+
+def channels_of(event: Event) -> Tuple[str, ...]:
+    """
+    Channels an event concerns, for private messages the other party.
+    """
+    if (channel := getattr(event, "channel", None)) is not None:
+        return channel,
+    if (where := getattr(event, "where", None)) is not None:
+        return where,
+    return tuple(getattr(event, "channels", ()))
+
+
+def _fields(event_type: Type[Event]) -> Set[str]:
+    names = set()
+    for cls in event_type.__mro__:
+        names.update(getattr(cls, "__annotations__", {}))
+    return names
+
+
+def channels_getter(
+    event_type: Type[Event]
+) -> Callable[[Event], Tuple[str, ...]]:
+    """
+    Same as channels_of, specialised for an event class by its annotated
+    fields so that no attribute lookup has to fail.
+    """
+    fields = _fields(event_type)
+    if "channel" in fields:
+        return lambda event: (event.channel,)
+    if "where" in fields:
+        return lambda event: (event.where,)
+    if "channels" in fields:
+        return lambda event: tuple(event.channels)
+    return channels_of
+
+
+def network_getter(
+    event_type: Type[Event]
+) -> Callable[[Event], Optional[str]]:
+    """
+    Same as network_of, specialised for an event class.
+    """
+    if "client" in _fields(event_type):
+        return lambda event: event.client.name
+    return network_of
+
+
+def mask_pattern(
+    masks: Collection[str], fold: Callable[[str], str]
+) -> Pattern:
+    """
+    Compiles IRC masks into a single pattern matching folded addresses.
+
+    :param masks: Masks such as "*!*@host.example".
+    :param fold: Case folding of the server.
+    :return: Pattern to fullmatch against folded nick!user@host.
+    """
+    return re.compile("|".join(
+        re.escape(fold(mask)).replace(r"\*", ".*").replace(r"\?", ".")
+        for mask in masks
+    ), re.DOTALL)
+
+
+class EventFilter:
+    __slots__ = ("channels", "networks", "senders", "prefix", "_senders")
+
+    # Channel names or nicknames of private messages, any if None
+    channels: Optional[FrozenSet[str]]
+    # Network names, any if None
+    networks: Optional[FrozenSet[str]]
+    # Sender masks such as "*!*@host.example", any if None
+    senders: Optional[Tuple[str, ...]]
+    # Prefixes of the message text, any if None
+    prefix: Optional[Tuple[str, ...]]
+    # Fold the sender masks were compiled with and their combined pattern
+    _senders: Optional[Tuple[Callable[[str], str], Pattern]]
+
+    def __init__(
+        self,
+        channels: Optional[Collection[str]] = None,
+        networks: Optional[Collection[str]] = None,
+        senders: Optional[Collection[str]] = None,
+        prefix: Optional[Collection[str]] = None,
+    ) -> None:
+        """
+        Creates a new EventFilter. An event matches if it matches every
+        criterion given, and any of the values of each criterion.
+
+        :param channels: Channel names or nicknames of private messages.
+        :param networks: Network names.
+        :param senders: Glob masks matched against nick!user@host.
+        :param prefix: Prefixes the message text starts with.
+        """
+        self.channels = frozenset(channels) if channels else None
+        self.networks = frozenset(networks) if networks else None
+        self.senders = tuple(senders) if senders else None
+        self.prefix = tuple(prefix) if prefix else None
+        self._senders = None
+
+    def matches_rest(self, event: Event, fold: Callable[[str], str]) -> bool:
+        """
+        Whether an event passes the sender and prefix criteria, the ones the
+        EventBus can't index.
+
+        :param event: Event broadcast.
+        :param fold: Case folding of the server.
+        :return: Result.
+        """
+        if self.senders is not None:
+            who = getattr(event, "who", None)
+            address = getattr(who, "address", None)
+            if address is None:
+                return False
+            if self._senders is None or self._senders[0] is not fold:
+                # Compiled again when the server changes its case mapping
+                self._senders = fold, mask_pattern(self.senders, fold)
+            if self._senders[1].fullmatch(fold(address)) is None:
+                return False
+        if self.prefix is not None:
+            message = getattr(event, "message", None)
+            if not isinstance(message, str):
+                return False
+            if not message.startswith(self.prefix):
+                return False
+        return True
+
+    def __repr__(self) -> str:
+        fields = ", ".join(
+            f"{name}={getattr(self, name)!r}"
+            for name in ("channels", "networks", "senders", "prefix")
+            if getattr(self, name) is not None
+        )
+        return f"EventFilter({fields})"
@@ -0,0 +1,383 @@
+"""
+Owns the tasks started for async event handlers.
+
+Every task is attributed to an owner, the module of the handler, which for
+plugins is the plugin module. Concurrency is capped per supervisor and per
+owner, work over either cap waits in a queue and is started as running tasks
+finish. Exceptions are logged with their owner instead of being left to the
+event loop's exception handler.
+
+Work may also be given a lane, e.g. the channel of the event it handles. The
+work of a lane runs one at a time in the order it was submitted, while
+different lanes run in parallel, so the replies to a channel keep the order of
+its messages and a slow handler only holds up its own channel. Work a lane's
+running task submits to the same lane runs right after it, before the work
+already waiting. Each lane's backlog is bounded, further work submitted to it
+from elsewhere is dropped unless the caller says it mustn't be.
+
+On shutdown or reload the supervisor is drained: no new work is accepted, the
+tasks running and queued get a deadline to finish, and whatever is left is
+cancelled. Sync handlers, such as the bot's channel logging, are called by the
+EventBus directly and keep running meanwhile.
+"""
+import asyncio as aio
+from collections import deque
+from logging import getLogger
+from time import monotonic
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+__all__ = ["TaskSupervisor", "Lane", "owner_of"]
+
+# Tasks running at once per supervisor, and per owner within it
+TASK_LIMIT = 256
+OWNER_LIMIT = 32
+# Work waiting for a free slot, further work is dropped
+QUEUE_LIMIT = 4096
+# Work waiting behind the running task of a lane, further work is dropped
+LANE_LIMIT = 64
+# Seconds tasks may take to finish once draining starts
+DRAIN_TIMEOUT = 10
+
+Work = Tuple[
+    str, Callable[..., Awaitable[Any]], Tuple[Any, ...], Optional[str]
+]
+
+
+def owner_of(handler: Callable) -> str:
+    """
+    Name tasks started from handler are attributed to, the module the handler
+    was defined in.
+    """
+    module = getattr(handler, "__module__", None)
+    if module is None:
+        module = type(handler).__module__
+    return module
+
+
+class Lane:
+    """
+    Work of a lane, which runs one at a time.
+    """
+    __slots__ = ("name", "active", "waiting", "continuations")
+
+    name: str
+    # Task running the lane's work, None while it waits for a free slot
+    active: Optional[aio.Task]
+    # Work submitted behind it, in order
+    waiting: Deque[Work]
+    # Work the active task submitted itself, at the front of waiting
+    continuations: int
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.active = None
+        self.waiting = deque()
+        self.continuations = 0
+
+    def __repr__(self) -> str:
+        return f"Lane(name={self.name!r}, waiting={len(self.waiting)})"
+
+
+class TaskSupervisor:
+    __slots__ = (
+        "name", "limit", "owner_limit", "queue_limit", "lane_limit",
+        "_tasks", "_running", "_queue", "_lanes", "_closed", "_finished",
+        "failed", "dropped", "cancelled", "max_backlog",
+    )
+
+    # Name used in log messages, e.g. the network
+    name: str
+    limit: Optional[int]
+    owner_limit: Optional[int]
+    queue_limit: int
+    lane_limit: int
+    # Running tasks with their owner and lane
+    _tasks: Dict[aio.Task, Tuple[str, Optional[str]]]
+    # Running tasks per owner
+    _running: Dict[str, int]
+    # Work over the limits, in the order it was submitted
+    _queue: Deque[Work]
+    # Lanes with work running or waiting, by name
+    _lanes: Dict[str, Lane]
+    # Whether the supervisor is draining and refuses new work
+    _closed: bool
+    # Set when a task finishes while draining
+    _finished: Optional[aio.Event]
+    # Tasks which raised per owner, and work dropped or cancelled in total
+    failed: Dict[str, int]
+    dropped: int
+    cancelled: int
+    # Most work seen waiting in a single lane
+    max_backlog: int
+
+    def __init__(
+        self,
+        name: str = "",
+        limit: Optional[int] = TASK_LIMIT,
+        owner_limit: Optional[int] = OWNER_LIMIT,
+        queue_limit: int = QUEUE_LIMIT,
+        lane_limit: int = LANE_LIMIT,
+    ) -> None:
+        self.name = name
+        self.limit = limit
+        self.owner_limit = owner_limit
+        self.queue_limit = queue_limit
+        self.lane_limit = lane_limit
+        self._tasks = {}
+        self._running = {}
+        self._queue = deque()
+        self._lanes = {}
+        self._closed = False
+        self._finished = None
+        self.failed = {}
+        self.dropped = 0
+        self.cancelled = 0
+        self.max_backlog = 0
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def in_flight(self, owner: Optional[str] = None) -> int:
+        """
+        Tasks running, in total or of an owner.
+        """
+        if owner is None:
+            return len(self._tasks)
+        return self._running.get(owner, 0)
+
+    def by_owner(self) -> Dict[str, int]:
+        """
+        Tasks running per owner.
+        """
+        return dict(self._running)
+
+    @property
+    def lanes(self) -> int:
+        """
+        Lanes with work running or waiting.
+        """
+        return len(self._lanes)
+
+    def backlog(self, lane: Optional[str] = None) -> int:
+        """
+        Work waiting behind the running task of a lane, or of every lane.
+        """
+        if lane is None:
+            return sum(len(each.waiting) for each in self._lanes.values())
+        if (current := self._lanes.get(lane)) is None:
+            return 0
+        return len(current.waiting)
+
+    def backlog_by_lane(self) -> Dict[str, int]:
+        """
+        Work waiting per lane, for the lanes which have any.
+        """
+        return {
+            name: len(lane.waiting)
+            for name, lane in self._lanes.items() if lane.waiting
+        }
+
+    def spawn(
+        self,
+        owner: str,
+        func: Callable[..., Awaitable[Any]],
+        *args: Any,
+        lane: Optional[str] = None,
+        bounded: bool = True,
+    ) -> bool:
+        """
+        Runs func(*args) as a supervised task, or queues it if a limit is
+        reached. The coroutine is only created once the task starts.
+
+        :param owner: Module the work is attributed to.
+        :param func: Coroutine function.
+        :param args: Arguments for func.
+        :param lane: Lane the work runs in, after the work submitted to it
+                     before. Runs independently if None.
+        :param bounded: Whether the work is dropped if the lane is full.
+                        Work already accepted elsewhere, like events the bus
+                        delivers, shouldn't be.
+        :return: False if the work was refused, because the supervisor is
+                 draining or the queue or lane is full.
+        """
+        if self._closed:
+            getLogger(__name__).debug(
+                "%s: Refused work of %s while draining", self.name, owner
+            )
+            return False
+        work = owner, func, args, lane
+        if lane is None:
+            return self._submit(work)
+        if (current := self._lanes.get(lane)) is None:
+            self._lanes[lane] = Lane(lane)
+            if not self._submit(work):
+                del self._lanes[lane]
+                return False
+            return True
+        waiting = current.waiting
+        task = current.active
+        if task is not None and task is aio.current_task():
+            # Part of handling work the lane already accepted, not limited
+            waiting.insert(current.continuations, work)
+            current.continuations += 1
+        elif bounded and len(waiting) >= self.lane_limit:
+            self.dropped += 1
+            getLogger(__name__).warning(
+                "%s: Dropped work of %s, %d tasks already waiting in %s",
+                self.name, owner, len(waiting), lane,
+            )
+            return False
+        else:
+            waiting.append(work)
+        if len(waiting) > self.max_backlog:
+            self.max_backlog = len(waiting)
+        return True
+
+    async def drain(self, timeout: float = DRAIN_TIMEOUT) -> int:
+        """
+        Refuses new work and waits for running and queued tasks to finish,
+        cancelling those left when the timeout expires. The task calling
+        drain is not waited for, if it is supervised itself.
+
+        :param timeout: Seconds to wait.
+        :return: Amount of tasks cancelled or queued work dropped.
+        """
+        self._closed = True
+        current = aio.current_task()
+        deadline = monotonic() + timeout
+        while self._pending_besides(current):
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+            self._finished = aio.Event()
+            try:
+                await aio.wait_for(self._finished.wait(), remaining)
+            except aio.TimeoutError:
+                break
+            finally:
+                self._finished = None
+
+        left = len(self._queue) + self.backlog()
+        self._queue.clear()
+        self._lanes.clear()
+        tasks = [task for task in self._tasks if task is not current]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await aio.wait(tasks)
+        left += len(tasks)
+        self.cancelled += left
+        if left:
+            getLogger(__name__).warning(
+                "%s: Cancelled %d handler tasks still running after %g s",
+                self.name, left, timeout,
+            )
+        return left
+
+    def _pending_besides(self, current: Optional[aio.Task]) -> bool:
+        # Work waiting behind the current task can't run before it returns
+        return bool(self._queue) or any(
+            task is not current for task in self._tasks
+        ) or any(
+            lane.waiting and lane.active is not current
+            for lane in self._lanes.values()
+        )
+
+    def _has_slot(self, owner: str) -> bool:
+        if self.limit is not None and len(self._tasks) >= self.limit:
+            return False
+        if self.owner_limit is not None:
+            return self._running.get(owner, 0) < self.owner_limit
+        return True
+
+    def _submit(self, work: Work) -> bool:
+        owner = work[0]
+        if self._has_slot(owner):
+            self._start(work)
+            return True
+        if len(self._queue) >= self.queue_limit:
+            self.dropped += 1
+            getLogger(__name__).warning(
+                "%s: Dropped work of %s, %d tasks already queued",
+                self.name, owner, len(self._queue),
+            )
+            return False
+        self._queue.append(work)
+        return True
+
+    def _start(self, work: Work) -> None:
+        owner, func, args, lane = work
+        task = aio.ensure_future(func(*args))
+        self._tasks[task] = owner, lane
+        self._running[owner] = self._running.get(owner, 0) + 1
+        if lane is not None and (current := self._lanes.get(lane)):
+            current.active = task
+            current.continuations = 0
+        task.add_done_callback(self._done)
+
+    def _advance(self, lane: str) -> None:
+        # The lane's task finished, its next work takes its place
+        if (current := self._lanes.get(lane)) is None:
+            return
+        current.active = None
+        current.continuations = 0
+        if not current.waiting:
+            del self._lanes[lane]
+            return
+        work = current.waiting.popleft()
+        if self._has_slot(work[0]):
+            self._start(work)
+        else:
+            # Already accepted, so it isn't subject to the queue limit
+            self._queue.append(work)
+
+    def _done(self, task: aio.Task) -> None:
+        owner, lane = self._tasks.pop(task)
+        if (running := self._running[owner] - 1) > 0:
+            self._running[owner] = running
+        else:
+            del self._running[owner]
+
+        if not task.cancelled() and (exc := task.exception()) is not None:
+            self.failed[owner] = self.failed.get(owner, 0) + 1
+            getLogger(__name__).error(
+                "%s: Handler of %s threw unhandled %s",
+                self.name, owner, type(exc).__name__,
+                exc_info=(type(exc), exc, exc.__traceback__),
+            )
+
+        if lane is not None:
+            self._advance(lane)
+        self._start_queued()
+        if self._finished is not None:
+            self._finished.set()
+
+    def _start_queued(self) -> None:
+        # Start the oldest work whose owner is under its limit, so one busy
+        # owner doesn't hold up the others
+        queue = self._queue
+        waiting: Deque[Work] = deque()
+        while queue:
+            if self.limit is not None and len(self._tasks) >= self.limit:
+                break
+            work = queue.popleft()
+            if self._has_slot(work[0]):
+                self._start(work)
+            else:
+                waiting.append(work)
+        waiting.extend(queue)
+        self._queue = waiting
+
+    def __repr__(self) -> str:
+        return (
+            f"TaskSupervisor(name={self.name!r}, running={len(self._tasks)}, "
+            f"queued={len(self._queue)}, lanes={len(self._lanes)})"
+        )
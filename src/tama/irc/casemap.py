@@ -0,0 +1,129 @@
+"""
+Case insensitive comparison of nicknames and channel names.
+
+Servers announce through the CASEMAPPING token of RPL_ISUPPORT which
+characters are considered equal. Names are folded with a translation table,
+and mappings keyed by name store the folded key, so the fold happens once per
+lookup and never per comparison.
+"""
+import string
+from typing import (
+    Dict, Generic, Iterator, Mapping, MutableMapping, Optional, Tuple, TypeVar,
+)
+
+__all__ = ["CaseMapping", "CASEMAPPINGS", "DEFAULT_CASEMAPPING", "IRCDict"]
+
+
+class CaseMapping:
+    __slots__ = ("name", "_table", "_ascii_table")
+
+    name: str
+    _table: Dict[int, int]
+    # Same as _table for ASCII names, bytes.translate is several times faster
+    # than str.translate with a dict
+    _ascii_table: bytes
+
+    def __init__(self, name: str, upper: str, lower: str) -> None:
+        self.name = name
+        self._table = str.maketrans(upper, lower)
+        self._ascii_table = bytes.maketrans(
+            upper.encode("ascii"), lower.encode("ascii")
+        )
+
+    def fold(self, name: str) -> str:
+        if name.isascii():
+            return name.encode("ascii").translate(
+                self._ascii_table
+            ).decode("ascii")
+        return name.translate(self._table)
+
+    def equals(self, a: str, b: str) -> bool:
+        return self.fold(a) == self.fold(b)
+
+    def __repr__(self) -> str:
+        return f"CaseMapping({self.name!r})"
+
+
+CASEMAPPINGS: Dict[str, CaseMapping] = {
+    mapping.name: mapping for mapping in (
+        CaseMapping(
+            "ascii", string.ascii_uppercase, string.ascii_lowercase,
+        ),
+        CaseMapping(
+            "rfc1459",
+            string.ascii_uppercase + "[]\\~",
+            string.ascii_lowercase + "{}|^",
+        ),
+        CaseMapping(
+            "strict-rfc1459",
+            string.ascii_uppercase + "[]\\",
+            string.ascii_lowercase + "{}|",
+        ),
+    )
+}
+# Assumed until the server says otherwise, as RFC1459 requires
+DEFAULT_CASEMAPPING = CASEMAPPINGS["rfc1459"]
+
+V = TypeVar("V")
+
+
+class IRCDict(MutableMapping[str, V], Generic[V]):
+    """
+    Dictionary with case insensitive names as keys. The name a key was first
+    stored with is preserved for iteration.
+    """
+    __slots__ = ("casemap", "_data")
+
+    casemap: CaseMapping
+    # Folded key to the original key and its value
+    _data: Dict[str, Tuple[str, V]]
+
+    def __init__(
+        self,
+        casemap: CaseMapping = DEFAULT_CASEMAPPING,
+        items: Optional[Mapping[str, V]] = None,
+    ) -> None:
+        self.casemap = casemap
+        self._data = {}
+        if items:
+            self.update(items)
+
+    def __getitem__(self, key: str) -> V:
+        return self._data[self.casemap.fold(key)][1]
+
+    def __setitem__(self, key: str, value: V) -> None:
+        folded = self.casemap.fold(key)
+        if (entry := self._data.get(folded)) is not None:
+            key = entry[0]
+        self._data[folded] = key, value
+
+    def __delitem__(self, key: str) -> None:
+        del self._data[self.casemap.fold(key)]
+
+    def __contains__(self, key: object) -> bool:
+        if not isinstance(key, str):
+            return False
+        return self.casemap.fold(key) in self._data
+
+    def __iter__(self) -> Iterator[str]:
+        return (key for key, _ in self._data.values())
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self) -> str:
+        return f"IRCDict({dict(self.items())!r})"
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def set_casemap(self, casemap: CaseMapping) -> None:
+        """
+        Changes the case mapping, folding the existing keys again. Keys which
+        become equal are merged, the last one wins.
+        """
+        self.casemap = casemap
+        self._data = {
+            casemap.fold(key): (key, value)
+            for key, value in self._data.values()
+        }
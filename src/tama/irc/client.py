@@ -3,29 +3,193 @@ Handles the interpretation of parsed IRC messages and converts them to an
 observable event stream.
 """
 import asyncio as aio
-from collections import deque
-from time import time
-from typing import Tuple, List, Deque, Optional
-from logging import Logger, getLogger
+from time import time, monotonic
+from typing import (
+    Tuple, List, Optional, Dict, Callable, ClassVar, Set, Iterable, Mapping,
+)
+from logging import Logger, getLogger, INFO
 
 from tama.config import ServerConfig
-from tama.event import EventBus
-from tama.irc.stream import IRCStream, IRCMessage
+from tama.event import Event, EventBus, TaskSupervisor
+from tama.event.supervisor import owner_of
+from tama.irc.command import REPLY_CODES
+from tama.irc.exc import InvalidIRCCommandError
+from tama.irc.stream import IRCStream, IRCMessage, DEFAULT_READ_SIZE
+from tama.irc.servers import ServerPool
+from tama.irc.user import user_cache
+from tama.irc.casemap import IRCDict
+from tama.irc.state import ChannelState
+from tama.irc.isupport import ISupport
+from tama.irc.sasl import sasl_mechanism, authenticate_payloads
+from tama.irc.queries import QueryTracker, QUERY_REPLIES, QUERY_TIMEOUT
+from tama.irc.outbound import (
+    OutboundQueue, TokenBucket, OverflowPolicy, Priority,
+)
 
 from .event import *
 
+# Seconds between keepalive PINGs. A PING left unanswered for this long times
+# out the connection.
+PING_INTERVAL = 30
+# Bytes after which no more queued messages are added to an outbound batch
+WRITE_BATCH_SIZE = 16 * 1024
+# Flood control defaults
+FLOOD_BURST = 5.0
+FLOOD_RATE = 1.0
+FLOOD_BYTES_PER_TOKEN = 512
+# Outbound fair queuing defaults
+TARGET_QUEUE_LIMIT = 20
+# Seconds joins are collected before they are sent, so invites arriving close
+# together share JOIN lines
+JOIN_COALESCE_DELAY = 0.5
+# Seconds after RPL_WELCOME the joins of registration wait for the end of the
+# MOTD, by which the server announced its limits through RPL_ISUPPORT
+REGISTRATION_JOIN_TIMEOUT = 5
+# Capabilities requested when the server offers them, besides sasl
+WANTED_CAPS = (
+    "multi-prefix", "message-tags", "server-time", "account-tag", "batch",
+)
+
+ServerHandler = Callable[["IRCClient", IRCMessage], None]
+RawHandler = Callable[[IRCMessage], None]
+
+
+def pack_joins(
+    channels: Mapping[str, Optional[str]],
+    max_length: int = 512,
+    max_targets: Optional[int] = None,
+    encoding: str = "utf-8",
+) -> List[IRCMessage]:
+    """
+    Packs channels into as few JOIN messages as the line length and target
+    limit allow, e.g. "JOIN #a,#b,#c key".
+
+    :param channels: Channel names and their keys, None if keyless.
+    :param max_length: Maximum message length in bytes, including CRLF.
+    :param max_targets: Maximum channels per message, unlimited if None.
+    :param encoding: Encoding used to measure the message length.
+    :return: JOIN messages.
+    """
+    # Keys are matched to channels by position, keyed channels go first
+    ordered = sorted(channels.items(), key=lambda c: c[1] is None)
+    messages = []
+    names: List[str] = []
+    keys: List[str] = []
+    # Length of "JOIN " and CRLF, then of the names and keys with separators
+    base = len("JOIN \r\n")
+    names_length = keys_length = 0
+
+    def flush() -> None:
+        middle = (",".join(names), ",".join(keys)) if keys else (
+            ",".join(names),
+        )
+        messages.append(IRCMessage(command="JOIN", middle=middle))
+        names.clear()
+        keys.clear()
+
+    for name, key in ordered:
+        name_length = len(name.encode(encoding)) + (1 if names else 0)
+        key_length = 0
+        if key is not None:
+            key_length = len(key.encode(encoding)) + 1
+        length = base + names_length + name_length + keys_length + key_length
+        full = max_targets is not None and len(names) >= max_targets
+        if names and (length > max_length or full):
+            flush()
+            names_length = keys_length = 0
+            name_length -= 1
+        names.append(name)
+        names_length += name_length
+        if key is not None:
+            keys.append(key)
+            keys_length += key_length
+    if names:
+        flush()
+    return messages
+
+
+def pack_targets(
+    command: str,
+    targets: Iterable[str],
+    trailing: str,
+    max_length: int = 512,
+    max_targets: Optional[int] = None,
+    encoding: str = "utf-8",
+) -> List[IRCMessage]:
+    """
+    Packs the same message to many targets into as few multi-target messages
+    as the line length and target limit allow, e.g. "PRIVMSG #a,#b :text".
+
+    :param command: PRIVMSG or NOTICE.
+    :param targets: Channels or nicknames.
+    :param trailing: Message text.
+    :param max_length: Maximum message length in bytes, including CRLF.
+    :param max_targets: Maximum targets per message, unlimited if None.
+    :param encoding: Encoding used to measure the message length.
+    :return: Messages to send.
+    """
+    messages = []
+    group: List[str] = []
+    # Length of "<command> " and " :<trailing>\r\n"
+    base = len(command) + len(trailing.encode(encoding)) + 5
+    length = base
+
+    def flush() -> None:
+        messages.append(IRCMessage(
+            command=command,
+            middle=(",".join(group),),
+            trailing=trailing,
+        ))
+        group.clear()
+
+    for target in targets:
+        target_length = len(target.encode(encoding)) + (1 if group else 0)
+        full = max_targets is not None and len(group) >= max_targets
+        if group and (length + target_length > max_length or full):
+            flush()
+            length = base
+            target_length -= 1
+        group.append(target)
+        length += target_length
+    if group:
+        flush()
+    return messages
+
+
+def command_key(command: str) -> str:
+    """
+    Normalises a command name or a numeric to the command an IRCMessage
+    carries, e.g. "privmsg" to "PRIVMSG" and "353" to "RPL_NAMREPLY".
+
+    :param command: Command name or three digit numeric.
+    :return: Command name.
+    """
+    if len(command) == 3 and command.isdigit():
+        if (name := REPLY_CODES.get(command)) is None:
+            raise InvalidIRCCommandError(command)
+        return name
+    return command.upper()
+
 
 class IRCClient:
     __slots__ = (
         "name", "startup_config", "stream", "bus",
-        "nickname", "username", "realname",
-        "_channel_list",
+        "_nickname", "_nick_key", "username", "realname",
+        "isupport", "channels", "caps", "account", "queries",
         "logger_name", "logger",
-        "_starting_up", "_shutting_down", "_inbound_queue", "_outbound_queue",
-        "_on_register",
+        "_starting_up", "_shutting_down", "_outbound_queue",
         "_waiting_for_pong",
+        "_raw_handlers",
+        "_caps_available", "_cap_negotiating", "_sasl_mechanism",
+        "_pending_joins", "_join_timer", "_welcome_at", "_awaiting_joins",
+        "_connected_at", "joined_after", "ready_after",
+        "_batches",
     )
 
+    # Server message handlers keyed by command, resolved once per class from
+    # the handle_server_* methods.
+    _server_handlers: ClassVar[Dict[str, ServerHandler]]
+
     # Client data
     name: str
     startup_config: ServerConfig
@@ -35,12 +199,21 @@ class IRCClient:
     bus: EventBus
 
     # User data
-    nickname: str
+    _nickname: str
+    # Nickname folded with the server case mapping
+    _nick_key: str
     username: str
     realname: str
 
     # State keeping
-    _channel_list: List[str]
+    isupport: ISupport
+    channels: ChannelState
+    # Enabled IRCv3 capabilities
+    caps: Set[str]
+    # Account logged in to through SASL, None if not logged in
+    account: Optional[str]
+    # WHOIS, WHO, NAMES and MODE queries waiting for their replies
+    queries: QueryTracker
 
     # Raw IRC protocol logger
     logger_name: str
@@ -49,14 +222,33 @@ class IRCClient:
     # Internals
     _starting_up: bool
     _shutting_down: bool
-    _inbound_queue: Deque[IRCMessage]
-    _outbound_queue: "aio.Queue[IRCMessage]"
-    # Actions to perform once the IRC connection is registered.
-    # These are not immediately queued on create as the connection is not
-    # registered yet.
-    _on_register: Deque[IRCMessage]
+    _outbound_queue: OutboundQueue
     # Handles wait for server PONG
     _waiting_for_pong: Optional[str]
+    # Extra handlers registered on this client, keyed by command
+    _raw_handlers: Dict[str, List[RawHandler]]
+    # Capabilities offered by the server with their values
+    _caps_available: Dict[str, Optional[str]]
+    # Whether registration is held by capability negotiation
+    _cap_negotiating: bool
+    # SASL mechanism to authenticate with, None if SASL is not used
+    _sasl_mechanism: Optional[str]
+    # Channels to join with their keys, sent together once the timer fires
+    _pending_joins: IRCDict[Optional[str]]
+    _join_timer: Optional[aio.TimerHandle]
+    # Monotonic time RPL_WELCOME was received
+    _welcome_at: Optional[float]
+    # Channels joined on registration not settled yet, with their keys
+    _awaiting_joins: IRCDict[Optional[str]]
+    # Monotonic time the connection was established
+    _connected_at: float
+    # Seconds from RPL_WELCOME until the channels joined on registration were
+    # either joined or refused, None until then
+    joined_after: Optional[float]
+    # Same as joined_after, but measured from the connection
+    ready_after: Optional[float]
+    # Open IRCv3 batches keyed by reference, collecting their events
+    _batches: Dict[str, BatchEvent]
 
     def __init__(
         self, name: str, startup_config: ServerConfig, stream: IRCStream
@@ -65,149 +257,313 @@ class IRCClient:
         self.startup_config = startup_config
 
         self.stream = stream
-        self.bus = EventBus(accept=[
+        self.bus = EventBus(supervisor=TaskSupervisor(name), accept=[
             InvitedEvent,
             BotJoinedEvent, ChannelJoinedEvent,
             BotPartedEvent, ChannelPartedEvent,
             BotKickedEvent, ChannelKickedEvent,
+            QuitEvent,
             MessagedEvent, NoticedEvent,
+            BatchEvent,
             ClosedEvent,
         ])
 
         self._starting_up = True
         self._shutting_down = False
-        self._inbound_queue = deque()
-        self._outbound_queue = aio.Queue()
-        self._on_register = deque()
+        self._outbound_queue = self._create_outbound_queue(startup_config)
         self._waiting_for_pong = None
+        self._raw_handlers = {}
+        self._caps_available = {}
+        self._cap_negotiating = False
+        self._sasl_mechanism = sasl_mechanism(startup_config.sasl)
+        self._pending_joins = IRCDict()
+        self._join_timer = None
+        self._welcome_at = None
+        self._awaiting_joins = IRCDict()
+        self._connected_at = monotonic()
+        self.joined_after = None
+        self.ready_after = None
+        self._batches = {}
+
+        self.isupport = ISupport()
+        self.channels = ChannelState(self.isupport.casemap)
+        self.caps = set()
+        self.account = None
+        self.queries = QueryTracker(self.isupport.casemap.fold)
+        self.bus.set_fold(self.isupport.casemap.fold)
 
         self.nickname = startup_config.nick
         self.username = startup_config.user
         self.realname = startup_config.realname
 
-        self._channel_list = []
-
         self.logger_name = f"tama.server.{name}.raw"
         self.logger = getLogger(self.logger_name)
 
-    @classmethod
-    async def create(cls, name: str, config: ServerConfig) -> "IRCClient":
-        if config.port.startswith("+"):
-            secure = True
-            port = int(config.port)
+    @property
+    def nickname(self) -> str:
+        return self._nickname
+
+    @nickname.setter
+    def nickname(self, nickname: str) -> None:
+        self._nickname = nickname
+        self._nick_key = self.isupport.casemap.fold(nickname)
+
+    def is_me(self, nick: str) -> bool:
+        """
+        Whether nick is the nickname of this client, per server case mapping.
+        """
+        return self.isupport.casemap.fold(nick) == self._nick_key
+
+    @staticmethod
+    def _create_outbound_queue(config: ServerConfig) -> OutboundQueue:
+        flood = config.flood
+        if flood is None:
+            return OutboundQueue(
+                TokenBucket(FLOOD_BURST, FLOOD_RATE, FLOOD_BYTES_PER_TOKEN),
+                target_limit=TARGET_QUEUE_LIMIT,
+            )
+
+        if flood.enabled is False:
+            bucket = None
         else:
-            secure = False
-            port = int(config.port)
-        stream = await IRCStream.create(config.host, port, secure)
+            bucket = TokenBucket(
+                flood.burst or FLOOD_BURST,
+                flood.rate or FLOOD_RATE,
+                flood.bytes_per_token or FLOOD_BYTES_PER_TOKEN,
+            )
+        return OutboundQueue(
+            bucket,
+            target_limit=flood.target_limit or TARGET_QUEUE_LIMIT,
+            overflow=OverflowPolicy(flood.overflow or "summarize"),
+        )
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        cls._build_server_handlers()
+
+    @classmethod
+    def _build_server_handlers(cls) -> None:
+        # Start from the table of the parent class so handlers registered
+        # there are kept, then apply the methods defined on this class.
+        handlers = dict(getattr(cls, "_server_handlers", {}))
+        for attr, value in cls.__dict__.items():
+            if not attr.startswith("handle_server_"):
+                continue
+            if attr == "handle_server_default":
+                continue
+            # Numerics may be handled either by name or by number, e.g.
+            # handle_server_rpl_namreply or handle_server_353.
+            handlers[command_key(attr[14:])] = value
+        cls._server_handlers = handlers
+
+    @classmethod
+    def add_server_handler(cls, command: str, handler: ServerHandler) -> None:
+        """
+        Registers a handler for a server command on this class and its future
+        subclasses, replacing any existing handle_server_* method for it.
+
+        :param command: Command name or three digit numeric.
+        :param handler: Function receiving the client and the message.
+        :return: None
+        """
+        # Don't mutate a table inherited from a parent class
+        if "_server_handlers" not in cls.__dict__:
+            cls._server_handlers = dict(cls._server_handlers)
+        cls._server_handlers[command_key(command)] = handler
+
+    def add_raw_handler(self, command: str, handler: RawHandler) -> None:
+        """
+        Registers an extra handler for a server command on this client. Raw
+        handlers run after the builtin handler for the command, if any.
+
+        :param command: Command name or three digit numeric.
+        :param handler: Function receiving the message.
+        :return: None
+        """
+        self._raw_handlers.setdefault(command_key(command), []).append(handler)
+
+    def remove_raw_handler(self, command: str, handler: RawHandler) -> None:
+        """
+        Removes a handler registered with add_raw_handler.
+
+        :param command: Command name or three digit numeric.
+        :param handler: Handler to remove.
+        :return: None
+        """
+        key = command_key(command)
+        handlers = self._raw_handlers[key]
+        handlers.remove(handler)
+        if len(handlers) == 0:
+            del self._raw_handlers[key]
+
+    @classmethod
+    async def create(
+        cls, name: str, config: ServerConfig, pool: ServerPool = None
+    ) -> "IRCClient":
+        """
+        Connects to a network and queues its registration.
+
+        :param name: Network name.
+        :param config: Network configuration.
+        :param pool: Servers of the network, kept between reconnects to reuse
+                     their measured handshake times. Created from config if
+                     not given.
+        :return: Connected client.
+        """
+        if pool is None:
+            pool = ServerPool.from_config(config)
+        stream = await pool.connect(config.read_size or DEFAULT_READ_SIZE)
         obj = cls(name, config, stream)
+        # Registration is held until CAP END, servers without capability
+        # negotiation ignore it.
+        obj.cap("LS", "302")
+        obj._cap_negotiating = True
         obj.nick(config.nick)
         obj.user(config.user, config.realname)
-        if config.service_auth:
-            cmd = config.service_auth.command or "IDENTIFY "
-            if config.service_auth.username:
-                cmd += config.service_auth.username + " "
-            cmd += config.service_auth.password
-            obj._on_register.append(IRCMessage(
-                command="PRIVMSG",
-                middle=(config.service_auth.service or "NickServ",),
-                trailing=cmd,
-            ))
-        if config.channels:
-            obj._on_register.extend([IRCMessage(
-                command="JOIN",
-                middle=(chan,)
-            ) for chan in config.channels])
+        for entry in config.channels or ():
+            # Channels may be followed by their key, e.g. "#secret hunter2"
+            chan, _, key = entry.strip().partition(" ")
+            obj.join(chan, key.strip() or None)
         return obj
 
     @classmethod
     async def create_after(
-        cls, name: str, config: ServerConfig, seconds: int
+        cls,
+        name: str,
+        config: ServerConfig,
+        seconds: int,
+        pool: ServerPool = None,
     ) -> "IRCClient":
         await aio.sleep(seconds)
-        return await cls.create(name, config)
+        return await cls.create(name, config, pool)
 
     async def run(self) -> Tuple[str, ServerConfig]:
-        inbound = aio.create_task(self._inbound())
-        outbound = aio.create_task(self._outbound())
-        timeout = aio.create_task(self._timeout())
-        while not self._shutting_down:
-            done, pending = await aio.wait(
-                [inbound, outbound, timeout], return_when=aio.FIRST_COMPLETED
-            )
-            # Getting the result from the future will raise exceptions
-            if inbound in done:
-                inbound.result()
-                inbound = aio.create_task(self._inbound())
-            if outbound in done:
-                outbound.result()
-                outbound = aio.create_task(self._outbound())
-            # Cancel timeout future if not done
-            if timeout not in done:
-                timeout.cancel()
-            else:
-                timeout.result()
-            timeout = aio.create_task(self._timeout())
-        # Entered shutdown state, which means the inbound queue reached EOF or
-        # the connection has timed out.
-        # Don't await any further because nothing can be sent/received anymore.
-        inbound.cancel()
-        outbound.cancel()
-        timeout.cancel()
+        tasks = {
+            aio.create_task(self._reader()),
+            aio.create_task(self._writer()),
+            aio.create_task(self._keepalive()),
+        }
+        try:
+            # Each task loops until the client enters shutdown state, which
+            # means the inbound stream reached EOF or the connection has timed
+            # out, so the first one to return ends the connection.
+            done, _ = await aio.wait(tasks, return_when=aio.FIRST_COMPLETED)
+        finally:
+            # Don't await any further because nothing can be sent/received
+            # anymore.
+            for task in tasks:
+                task.cancel()
+            if self._join_timer is not None:
+                self._join_timer.cancel()
+            # Batches cut short by the disconnection won't be closed
+            for batch in tuple(self._batches.values()):
+                self._end_batch(batch)
+            self.queries.cancel_all(ConnectionError("IRC connection closed"))
+        self._shutting_down = True
+        # Getting the result from the future will raise exceptions
+        for task in done:
+            task.result()
         # Return startup config when connection dies for easy reconnection
         return self.name, self.startup_config
 
-    async def _inbound(self) -> None:
-        # Block if we have nothing to process
-        if len(self._inbound_queue) == 0:
+    async def _reader(self) -> None:
+        while not self._shutting_down:
             try:
-                new_messages = await self.stream.read_messages()
+                messages = await self.stream.read_messages()
             except ConnectionError:
                 # Connection failed, shut down
                 getLogger(__name__).exception("IRC connection error")
                 self._shutting_down = True
                 return
             # Connection done, shut down
-            if new_messages is None:
+            if messages is None:
                 getLogger(__name__).info("IRC connection closed")
                 self._shutting_down = True
                 return
-            # Queue parsed messages
-            self._inbound_queue.extend(new_messages)
-
-        msg = self._inbound_queue.popleft()
-        self.logger.info(">> %s", msg.raw[:-2].decode("utf-8"))
-        # NOTE: Due to the fact all IRC commands are uppercase we turn them
-        # to lower for nicer function dispatching.
-        srv_handler = getattr(
-            self,
-            "handle_server_" + msg.command.lower(),
-            self.handle_server_default,
+
+            for msg in messages:
+                self._inbound(msg)
+
+    def _inbound(self, msg: IRCMessage) -> None:
+        if self.logger.isEnabledFor(INFO):
+            self.logger.info(
+                ">> %s", msg.raw[:-2].decode(msg.encoding, "replace")
             )
-        srv_handler(msg)
+        raw_handlers = self._raw_handlers.get(msg.command)
+        if (srv_handler := self._server_handlers.get(msg.command)) is not None:
+            srv_handler(self, msg)
+        elif not raw_handlers:
+            self.handle_server_default(msg)
+        if raw_handlers:
+            # Copy so handlers may unregister themselves
+            for handler in tuple(raw_handlers):
+                # Registered by plugins, their bugs mustn't end the connection
+                try:
+                    handler(msg)
+                except Exception as exc:
+                    getLogger(__name__).error(
+                        "%s: Raw %s handler of %s threw unhandled %s",
+                        self.name, msg.command, owner_of(handler),
+                        type(exc).__name__, exc_info=True,
+                    )
+        if msg.command in QUERY_REPLIES:
+            self.queries.feed(msg)
 
-    async def _outbound(self) -> None:
-        # Block until we have a new message to send
-        msg = await self._outbound_queue.get()
-        self.logger.info("<< %s", msg.raw[:-2].decode("utf-8"))
-        try:
-            await self.stream.send_message(msg)
-        except ConnectionError:
-            # Connection failed, shut down
-            getLogger(__name__).exception("IRC connection error")
-            self._shutting_down = True
-
-    async def _timeout(self) -> None:
-        # 30 second PING interval
-        await aio.sleep(30)
-        if self._waiting_for_pong:
-            # If we timeout and already pinged, die
-            getLogger(__name__).error("IRC connection timed out")
-            self._shutting_down = True
-        else:
+    async def _writer(self) -> None:
+        while not self._shutting_down:
+            # Block until we have a new message to send, then take everything
+            # else flood control allows so the batch is written and drained
+            # once.
+            batch = await self._outbound_queue.get_batch(WRITE_BATCH_SIZE)
+
+            if self.logger.isEnabledFor(INFO):
+                for msg in batch:
+                    self.logger.info(
+                        "<< %s", msg.raw[:-2].decode(msg.encoding, "replace")
+                    )
+            try:
+                await self.stream.send_messages(batch)
+            except ConnectionError:
+                # Connection failed, shut down
+                getLogger(__name__).exception("IRC connection error")
+                self._shutting_down = True
+                return
+
+    async def _keepalive(self) -> None:
+        while not self._shutting_down:
+            await aio.sleep(PING_INTERVAL)
+            if self._waiting_for_pong:
+                # If we timeout and already pinged, die
+                getLogger(__name__).error("IRC connection timed out")
+                self._shutting_down = True
+                return
             msg = str(int(time()))
             self.ping(msg)
             self._waiting_for_pong = msg
 
+    def _emit(self, msg: IRCMessage, event: Event) -> None:
+        """
+        Broadcasts the event of a message, or adds it to the batch the message
+        belongs to.
+        """
+        # Tags aren't looked at unless a batch is open
+        if self._batches and (
+            batch := self._batches.get(msg.tags.get("batch"))
+        ) is not None:
+            batch.events.append(event)
+        else:
+            self.bus.broadcast(event)
+
+    def _end_batch(self, batch: BatchEvent) -> None:
+        del self._batches[batch.reference]
+        # Nested batches are delivered as part of their outer batch
+        if (outer := self._batches.get(batch.tags.get("batch"))) is not None:
+            outer.events.append(batch)
+            return
+        self.bus.broadcast(batch)
+        for event in batch.flatten():
+            self.bus.broadcast(event, batched=True)
+
     # Upstream command handlers
     def handle_server_default(self, msg: IRCMessage) -> None:
         getLogger(__name__).debug("Unhandled IRC message: %s", msg.command)
@@ -223,75 +579,85 @@ class IRCClient:
 
     def handle_server_nick(self, msg: IRCMessage) -> None:
         who = msg.parse_prefix_as_user()
-        if who.nick == self.nickname:
-            self.nickname = msg.trailing
+        # The old prefix won't be seen again
+        user_cache.invalidate(who.address)
+        new_nick = msg.trailing or msg.middle[0]
+        self.channels.renamed(who.nick, new_nick)
+        if self.is_me(who.nick):
+            self.nickname = new_nick
 
     def handle_server_privmsg(self, msg: IRCMessage) -> None:
         # If command param is the client nick, set the user as the location
         who = msg.parse_prefix_as_user()
         where = msg.middle[0]
-        if where == self.nickname:
+        if self.is_me(where):
             where = who.nick
-        self.bus.broadcast(MessagedEvent(
+        self._emit(msg, MessagedEvent(
             client=self,
             who=who,
             where=where,
             message=msg.trailing,
+            irc_message=msg,
         ))
 
     def handle_server_notice(self, msg: IRCMessage) -> None:
         # If command param is the client nick, set the user as the location
         who = msg.parse_prefix_as_user()
         where = msg.middle[0]
-        if where == self.nickname:
+        if self.is_me(where):
             where = who.nick
-        self.bus.broadcast(NoticedEvent(
+        self._emit(msg, NoticedEvent(
             client=self,
             who=who,
             where=where,
             message=msg.trailing,
+            irc_message=msg,
         ))
 
     def handle_server_invite(self, msg: IRCMessage) -> None:
-        self.bus.broadcast(InvitedEvent(
+        self._emit(msg, InvitedEvent(
             client=self,
             who=msg.parse_prefix_as_user(),
-            to=msg.trailing,
+            # Servers send the channel either as a middle or a trailing param
+            to=msg.trailing or msg.middle[-1],
         ))
 
     def handle_server_join(self, msg: IRCMessage) -> None:
         who = msg.parse_prefix_as_user()
-        if who.nick == self.nickname:
-            self._channel_list.append(msg.trailing)
-            self.bus.broadcast(BotJoinedEvent(
+        # Servers send the channel either as a middle or a trailing param
+        channel = msg.middle[0] if msg.middle else msg.trailing
+        self.channels.joined(channel, who.nick)
+        if self.is_me(who.nick):
+            self._join_settled(channel)
+            self._emit(msg, BotJoinedEvent(
                 client=self,
-                channel=msg.trailing,
+                channel=channel,
                 who=who,
             ))
         else:
-            self.bus.broadcast(ChannelJoinedEvent(
+            self._emit(msg, ChannelJoinedEvent(
                 client=self,
-                channel=msg.trailing,
+                channel=channel,
                 who=who,
             ))
 
     def handle_server_part(self, msg: IRCMessage) -> None:
         who = msg.parse_prefix_as_user()
-        if who.nick == self.nickname:
-            try:
-                self._channel_list.remove(msg.trailing)
-            except ValueError:
+        if self.is_me(who.nick):
+            if msg.middle[0] not in self.channels:
                 getLogger(__name__).error(
                     "Parted a channel that was never joined."
                 )
-            self.bus.broadcast(BotPartedEvent(
+            self.channels.left(msg.middle[0])
+            self._emit(msg, BotPartedEvent(
                 client=self,
                 channel=msg.middle[0],
                 who=who,
                 message=msg.trailing,
             ))
         else:
-            self.bus.broadcast(ChannelPartedEvent(
+            self.channels.parted(msg.middle[0], who.nick)
+            self._emit(msg, ChannelPartedEvent(
                 client=self,
                 channel=msg.middle[0],
                 who=who,
@@ -301,14 +667,13 @@ class IRCClient:
     def handle_server_kick(self, msg: IRCMessage) -> None:
         who = msg.parse_prefix_as_user()
         chan, target, *_ = msg.middle
-        if target == self.nickname:
-            try:
-                self._channel_list.remove(msg.trailing)
-            except ValueError:
+        if self.is_me(target):
+            if chan not in self.channels:
                 getLogger(__name__).error(
                     "Kicked from a channel that was never joined."
                 )
-            self.bus.broadcast(BotKickedEvent(
+            self.channels.left(chan)
+            self._emit(msg, BotKickedEvent(
                 client=self,
                 channel=chan,
                 who=who,
@@ -316,7 +681,8 @@ class IRCClient:
                 message=msg.trailing,
             ))
         else:
-            self.bus.broadcast(ChannelKickedEvent(
+            self.channels.parted(chan, target)
+            self._emit(msg, ChannelKickedEvent(
                 client=self,
                 channel=chan,
                 who=who,
@@ -324,18 +690,209 @@ class IRCClient:
                 message=msg.trailing,
             ))
 
+    def handle_server_quit(self, msg: IRCMessage) -> None:
+        who = msg.parse_prefix_as_user()
+        channels = self.channels.channels_of(who.nick)
+        self.channels.quit(who.nick)
+        self._emit(msg, QuitEvent(
+            client=self,
+            who=who,
+            channels=channels,
+            message=msg.trailing,
+        ))
+
+    def handle_server_batch(self, msg: IRCMessage) -> None:
+        # +<reference> <type> [<params>...] opens, -<reference> closes
+        reference = msg.middle[0]
+        if reference.startswith("+"):
+            self._batches[reference[1:]] = BatchEvent(
+                client=self,
+                reference=reference[1:],
+                type=msg.middle[1] if len(msg.middle) > 1 else "",
+                params=msg.middle[2:],
+                irc_message=msg,
+            )
+        elif (batch := self._batches.get(reference[1:])) is not None:
+            self._end_batch(batch)
+
     def handle_server_error(self, msg: IRCMessage) -> None:
         self.bus.broadcast(ClosedEvent(
             client=self,
             message=msg.trailing,
         ))
 
+    def handle_server_cap(self, msg: IRCMessage) -> None:
+        # <client> <subcommand> [*] :<capabilities>
+        subcommand = msg.middle[1].upper()
+        caps = (msg.trailing or "").split()
+        if subcommand in ("LS", "NEW"):
+            for cap in caps:
+                name, _, value = cap.partition("=")
+                self._caps_available[name] = value or None
+            # A * marks a reply continued on the next line
+            if subcommand == "LS" and msg.middle[-1] != "*":
+                self._request_caps()
+        elif subcommand == "ACK":
+            for cap in caps:
+                if cap.startswith("-"):
+                    self.caps.discard(cap[1:])
+                else:
+                    self.caps.add(cap)
+            if self._cap_negotiating and "sasl" in caps:
+                self.authenticate(self._sasl_mechanism)
+            else:
+                self._end_cap()
+        elif subcommand == "NAK":
+            getLogger(__name__).warning(
+                "%s: Server refused capabilities %s", self.name, caps
+            )
+            self._end_cap()
+        elif subcommand == "DEL":
+            for cap in caps:
+                self._caps_available.pop(cap, None)
+                self.caps.discard(cap)
+
+    def _request_caps(self) -> None:
+        if not self._cap_negotiating:
+            return
+        available = self._caps_available
+        wanted = [cap for cap in WANTED_CAPS if cap in available]
+        if self._sasl_mechanism is not None:
+            # The sasl value lists the mechanisms, if the server sends it
+            mechanisms = available.get("sasl")
+            if "sasl" not in available:
+                getLogger(__name__).warning(
+                    "%s: Server does not support SASL", self.name
+                )
+            elif mechanisms and (
+                self._sasl_mechanism not in mechanisms.upper().split(",")
+            ):
+                getLogger(__name__).warning(
+                    "%s: Server does not support SASL %s",
+                    self.name, self._sasl_mechanism,
+                )
+            else:
+                wanted.append("sasl")
+        if wanted:
+            self.cap("REQ", " ".join(wanted))
+        else:
+            self._end_cap()
+
+    def _end_cap(self) -> None:
+        if self._cap_negotiating:
+            self._cap_negotiating = False
+            self.cap("END")
+
+    def handle_server_authenticate(self, msg: IRCMessage) -> None:
+        # The server sends an empty challenge, "+", for PLAIN and EXTERNAL
+        if (msg.trailing or msg.middle[0]) != "+":
+            return
+        for payload in authenticate_payloads(
+            self._sasl_mechanism, self.startup_config.sasl
+        ):
+            self.authenticate(payload)
+
+    def handle_server_rpl_loggedin(self, msg: IRCMessage) -> None:
+        # <client> <nick>!<user>@<host> <account> :<message>
+        self.account = msg.middle[2]
+        getLogger(__name__).info(
+            "%s: Logged in as %s", self.name, self.account
+        )
+
+    def handle_server_rpl_loggedout(self, msg: IRCMessage) -> None:
+        self.account = None
+
+    def handle_server_rpl_saslsuccess(self, msg: IRCMessage) -> None:
+        self._end_cap()
+
+    def _sasl_error(self, msg: IRCMessage) -> None:
+        getLogger(__name__).warning(
+            "%s: SASL authentication failed: %s", self.name, msg.trailing
+        )
+        # Registration continues, service_auth is used as a fallback
+        self._end_cap()
+
+    handle_server_err_nicklocked = _sasl_error
+    handle_server_err_saslfail = _sasl_error
+    handle_server_err_sasltoolong = _sasl_error
+    handle_server_err_saslaborted = _sasl_error
+
+    def handle_server_err_saslalready(self, msg: IRCMessage) -> None:
+        self._end_cap()
+
     # Upstream reply code handlers
     def handle_server_rpl_welcome(self, msg: IRCMessage) -> None:
         self._starting_up = False
-        while self._on_register:
-            m = self._on_register.popleft()
-            self._outbound_queue.put_nowait(m)
+        self._cap_negotiating = False
+        self._welcome_at = monotonic()
+        auth = self.startup_config.service_auth
+        if auth is not None and self.account is None:
+            cmd = auth.command or "IDENTIFY "
+            if auth.username:
+                cmd += auth.username + " "
+            cmd += auth.password
+            # Identify before the joins go out
+            self._outbound_queue.put_nowait(IRCMessage(
+                command="PRIVMSG",
+                middle=(auth.service or "NickServ",),
+                trailing=cmd,
+            ), Priority.CONTROL)
+        self._awaiting_joins = IRCDict(
+            self.isupport.casemap, self._pending_joins
+        )
+        if not self._awaiting_joins:
+            self._joins_settled()
+        # RPL_ISUPPORT follows, joins are packed once its TARGMAX and LINELEN
+        # are known
+        self._join_timer = aio.get_event_loop().call_later(
+            REGISTRATION_JOIN_TIMEOUT, self._flush_joins
+        )
+
+    def _end_of_motd(self, msg: IRCMessage) -> None:
+        if self._join_timer is not None:
+            self._join_timer.cancel()
+            self._flush_joins()
+
+    handle_server_rpl_endofmotd = _end_of_motd
+    handle_server_err_nomotd = _end_of_motd
+
+    def _join_error(self, msg: IRCMessage) -> None:
+        # <client> <channel> :<reason>
+        if len(msg.middle) >= 2:
+            getLogger(__name__).warning(
+                "Could not join %s: %s", msg.middle[1], msg.trailing
+            )
+            self._join_settled(msg.middle[1])
+
+    handle_server_err_nosuchchannel = _join_error
+    handle_server_err_toomanychannels = _join_error
+    handle_server_err_channelisfull = _join_error
+    handle_server_err_inviteonlychan = _join_error
+    handle_server_err_bannedfromchan = _join_error
+    handle_server_err_badchannelkey = _join_error
+    handle_server_err_badchanmask = _join_error
+
+    def handle_server_rpl_isupport(self, msg: IRCMessage) -> None:
+        # <client> <tokens> :are supported by this server
+        isupport = self.isupport
+        isupport.update(msg.middle[1:])
+        casemap = isupport.casemap
+        if casemap is not self.channels.casemap:
+            self.channels.set_casemap(casemap)
+            self._outbound_queue.set_fold(casemap.fold)
+            self.queries.set_fold(casemap.fold)
+            self.bus.set_fold(casemap.fold)
+            self._pending_joins.set_casemap(casemap)
+            self._awaiting_joins.set_casemap(casemap)
+            self._nick_key = casemap.fold(self._nickname)
+        self.channels.prefixes = isupport.prefixes
+
+    def handle_server_rpl_namreply(self, msg: IRCMessage) -> None:
+        # <client> <symbol> <channel> :<nicks>
+        self.channels.names(msg.middle[-1], (msg.trailing or "").split())
+
+    def handle_server_rpl_endofnames(self, msg: IRCMessage) -> None:
+        self.channels.end_of_names(msg.middle[-1])
 
     def handle_server_err_nicknameinuse(self, msg: IRCMessage) -> None:
         # If we are still starting up, then retry with an underscore
@@ -344,6 +901,22 @@ class IRCClient:
             self.nick(self.nickname)
 
     # Command executors
+    def cap(self, subcommand: str, *params: str) -> None:
+        # Capability lists are sent as a trailing parameter
+        if subcommand == "REQ":
+            msg = IRCMessage(
+                command="CAP", middle=(subcommand,), trailing=params[0]
+            )
+        else:
+            msg = IRCMessage(command="CAP", middle=(subcommand, *params))
+        self._outbound_queue.put_nowait(msg)
+
+    def authenticate(self, payload: str) -> None:
+        self._outbound_queue.put_nowait(IRCMessage(
+            command="AUTHENTICATE",
+            middle=(payload,),
+        ))
+
     def user(self, username: str, realname: str) -> None:
         self._outbound_queue.put_nowait(IRCMessage(
             command="USER",
@@ -369,28 +942,193 @@ class IRCClient:
             trailing=payload,
         ))
 
-    def join(self, channel: str) -> None:
-        self._outbound_queue.put_nowait(IRCMessage(
-            command="JOIN",
-            middle=(channel,)
-        ))
+    def join(self, channel: str, key: Optional[str] = None) -> None:
+        """
+        Queues a channel to be joined. Joins are held until registration and
+        afterwards collected for a moment, then sent packed in JOIN lines.
 
-    def notice(self, target: str, message: str) -> None:
+        :param channel: Channel name.
+        :param key: Channel key, if any.
+        :return: None
+        """
+        self._pending_joins[channel] = key
+        if self._starting_up or self._join_timer is not None:
+            return
+        self._join_timer = aio.get_event_loop().call_later(
+            JOIN_COALESCE_DELAY, self._flush_joins
+        )
+
+    def _flush_joins(self) -> None:
+        self._join_timer = None
+        if not self._pending_joins:
+            return
+        isupport = self.isupport
+        for msg in pack_joins(
+            self._pending_joins,
+            isupport.linelen,
+            isupport.max_targets("JOIN"),
+            self.stream.encoding,
+        ):
+            self._outbound_queue.put_nowait(msg)
+        self._pending_joins.clear()
+
+    def _join_settled(self, channel: str) -> None:
+        if not self._awaiting_joins:
+            return
+        self._awaiting_joins.pop(channel, None)
+        if not self._awaiting_joins:
+            self._joins_settled()
+
+    def _joins_settled(self) -> None:
+        now = monotonic()
+        self.joined_after = now - self._welcome_at
+        self.ready_after = now - self._connected_at
+        getLogger(__name__).info(
+            "%s: Ready %.2f s after connecting, channels joined %.2f s after "
+            "registration", self.name, self.ready_after, self.joined_after,
+        )
+
+    def _client_tags(
+        self, tags: Optional[Dict[str, str]]
+    ) -> Optional[Dict[str, str]]:
+        # Servers without message-tags would reject tagged messages
+        if tags and "message-tags" in self.caps:
+            return tags
+        return None
+
+    def notice(
+        self, target: str, message: str, tags: Dict[str, str] = None
+    ) -> None:
         self._outbound_queue.put_nowait(IRCMessage(
             command="NOTICE",
             middle=(target,),
             trailing=message,
+            tags=self._client_tags(tags),
         ))
 
-    def privmsg(self, target: str, message: str) -> None:
+    def privmsg(
+        self, target: str, message: str, tags: Dict[str, str] = None
+    ) -> None:
         self._outbound_queue.put_nowait(IRCMessage(
             command="PRIVMSG",
             middle=(target,),
             trailing=message,
+            tags=self._client_tags(tags),
         ))
 
-    def quit(self, reason: str) -> None:
-        self._outbound_queue.put_nowait(IRCMessage(
-            command="QUIT",
-            trailing=reason,
-        ))
+    def broadcast(
+        self, targets: Iterable[str], message: str, command: str = "PRIVMSG"
+    ) -> None:
+        """
+        Sends the same message to many targets, several per line when the
+        server advertises a TARGMAX or MAXTARGETS limit for the command and
+        one per line otherwise.
+
+        :param targets: Channels or nicknames, duplicates are sent once.
+        :param message: Message text.
+        :param command: PRIVMSG or NOTICE.
+        :return: None
+        """
+        command = command.upper()
+        if command not in ("PRIVMSG", "NOTICE"):
+            raise ValueError(f"Cannot broadcast {command}")
+        fold = self.isupport.casemap.fold
+        unique: Dict[str, str] = {}
+        for target in targets:
+            unique.setdefault(fold(target), target)
+        for msg in pack_targets(
+            command,
+            unique.values(),
+            message,
+            self.isupport.linelen,
+            self.isupport.max_targets(command, default=1),
+            self.stream.encoding,
+        ):
+            self._outbound_queue.put_nowait(msg)
+
+    # Queries awaiting replies
+    async def whois(
+        self, nick: str, timeout: float = QUERY_TIMEOUT
+    ) -> List[IRCMessage]:
+        """
+        Sends a WHOIS and waits for its replies. Replies are shared with any
+        identical query in flight, so they must not be modified.
+
+        :param nick: Nickname.
+        :param timeout: Seconds until a TimeoutError is raised.
+        :return: Replies, RPL_ENDOFWHOIS last.
+        :raises QueryError: If the nickname doesn't exist.
+        """
+        return await self._query("WHOIS", nick, timeout)
+
+    async def who(
+        self, mask: str, timeout: float = QUERY_TIMEOUT
+    ) -> List[IRCMessage]:
+        """
+        Sends a WHO and waits for its replies.
+
+        :param mask: Channel, nickname or mask.
+        :param timeout: Seconds until a TimeoutError is raised.
+        :return: Replies, RPL_ENDOFWHO last.
+        """
+        return await self._query("WHO", mask, timeout)
+
+    async def names(
+        self, channel: str, timeout: float = QUERY_TIMEOUT
+    ) -> List[IRCMessage]:
+        """
+        Sends a NAMES and waits for its replies. The member list of a joined
+        channel is updated with them as well.
+
+        :param channel: Channel name.
+        :param timeout: Seconds until a TimeoutError is raised.
+        :return: Replies, RPL_ENDOFNAMES last.
+        """
+        return await self._query("NAMES", channel, timeout)
+
+    async def mode(
+        self, target: str, timeout: float = QUERY_TIMEOUT
+    ) -> List[IRCMessage]:
+        """
+        Queries the modes of a channel, or of the client's own nickname.
+
+        :param target: Channel name or own nickname.
+        :param timeout: Seconds until a TimeoutError is raised.
+        :return: RPL_CHANNELMODEIS or RPL_UMODEIS.
+        :raises QueryError: If the channel doesn't exist or can't be queried.
+        """
+        return await self._query("MODE", target, timeout)
+
+    async def _query(
+        self, command: str, target: str, timeout: float
+    ) -> List[IRCMessage]:
+        future = self.queries.query(
+            command,
+            target,
+            lambda: self._outbound_queue.put_nowait(IRCMessage(
+                command=command,
+                middle=(target,),
+            )),
+            timeout,
+        )
+        # A cancelled caller must not cancel the query for the others
+        return await aio.shield(future)
+
+    def quit(self, reason: str, after_queued: bool = False) -> None:
+        """
+        Quits the network.
+
+        :param reason: Quit message.
+        :param after_queued: Send QUIT once everything queued was sent
+                             instead of ahead of everything, so pending
+                             replies aren't cut off.
+        :return: None
+        """
+        msg = IRCMessage(command="QUIT", trailing=reason)
+        if after_queued:
+            self._outbound_queue.put_last(msg)
+        else:
+            self._outbound_queue.put_nowait(msg)
+
+
+IRCClient._build_server_handlers()
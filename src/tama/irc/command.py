@@ -8,7 +8,10 @@ See: https://tools.ietf.org/html/rfc2812
 
 COMMANDS = {
     "ADMIN",
+    "AUTHENTICATE",
     "AWAY",
+    "BATCH",
+    "CAP",
     "CONNECT",
     "DIE",
     "ERROR",
@@ -44,6 +47,7 @@ COMMANDS = {
     "SQUIT",
     "STATS",
     "SUMMON",
+    "TAGMSG",
     "TIME",
     "TOPIC",
     "TRACE",
@@ -204,4 +208,26 @@ REPLY_CODES = {
     "491": "ERR_NOOPERHOST",         # ":No O-lines for your host"
     "501": "ERR_UMODEUNKNOWNFLAG",   # ":Unknown MODE flag"
     "502": "ERR_USERSDONTMATCH",     # ":Cannot change mode for other users"
+
+    # IRCv3 capability negotiation and SASL
+    "410": "ERR_INVALIDCAPCMD",      # "<client> <command> :Invalid CAP command"
+    "900": "RPL_LOGGEDIN",           # "<client> <nick>!<user>@<host> <account> :You are now logged in as <username>"
+    "901": "RPL_LOGGEDOUT",          # "<client> <nick>!<user>@<host> :You are now logged out"
+    "902": "ERR_NICKLOCKED",         # "<client> :You must use a nick assigned to you"
+    "903": "RPL_SASLSUCCESS",        # "<client> :SASL authentication successful"
+    "904": "ERR_SASLFAIL",           # "<client> :SASL authentication failed"
+    "905": "ERR_SASLTOOLONG",        # "<client> :SASL message too long"
+    "906": "ERR_SASLABORTED",        # "<client> :SASL authentication aborted"
+    "907": "ERR_SASLALREADY",        # "<client> :You have already authenticated using SASL"
+    "908": "RPL_SASLMECHS",          # "<client> <mechanisms> :are available SASL mechanisms"
+
+    # Common WHOIS and WHOX extensions
+    "307": "RPL_WHOISREGNICK",       # NON-RFC: "<client> <nick> :has identified for this nick"
+    "320": "RPL_WHOISSPECIAL",       # NON-RFC: "<client> <nick> :<text>"
+    "330": "RPL_WHOISACCOUNT",       # NON-RFC: "<client> <nick> <account> :is logged in as"
+    "338": "RPL_WHOISACTUALLY",      # NON-RFC: "<client> <nick> [<host|ip>] :Is actually using host"
+    "354": "RPL_WHOSPCRPL",          # NON-RFC: "<client> [<token>] <fields...>"
+    "378": "RPL_WHOISHOST",          # NON-RFC: "<client> <nick> :is connecting from *@localhost 127.0.0.1"
+    "379": "RPL_WHOISMODES",         # NON-RFC: "<client> <nick> :is using modes +ailosw"
+    "671": "RPL_WHOISSECURE",        # NON-RFC: "<client> <nick> :is using a secure connection"
 }
@@ -1,23 +1,42 @@
-from typing import TYPE_CHECKING
-from dataclasses import dataclass
+from typing import (
+    TYPE_CHECKING, Dict, List, Tuple, FrozenSet, Iterator, Optional,
+)
+from dataclasses import dataclass, field
 
 from tama.event import Event
 from tama.irc.user import IRCUser
 
 if TYPE_CHECKING:
     from tama.irc.client import IRCClient
+    from tama.irc.stream import IRCMessage
 
 __all__ = [
     "InvitedEvent",
     "JoinedEvent", "BotJoinedEvent", "ChannelJoinedEvent",
     "PartedEvent", "BotPartedEvent", "ChannelPartedEvent",
     "KickedEvent", "BotKickedEvent", "ChannelKickedEvent",
+    "QuitEvent",
     "MessagedEvent",
     "NoticedEvent",
+    "BatchEvent",
     "ClosedEvent"
 ]
 
 
+class Tagged:
+    """
+    Gives events of a message its IRCv3 tags, e.g. account, msgid or time.
+    They are only decoded when accessed, most handlers never look at them.
+    """
+    irc_message: Optional["IRCMessage"]
+
+    @property
+    def tags(self) -> Dict[str, str]:
+        if self.irc_message is None:
+            return {}
+        return self.irc_message.tags
+
+
 @dataclass
 class InvitedEvent(Event):
     """
@@ -104,7 +123,19 @@ class ChannelKickedEvent(KickedEvent):
 
 
 @dataclass
-class MessagedEvent(Event):
+class QuitEvent(Event):
+    """
+    Another nickname quit IRC.
+    """
+    client: "IRCClient"
+    who: IRCUser
+    # Channels the nickname was seen in
+    channels: FrozenSet[str]
+    message: str
+
+
+@dataclass
+class MessagedEvent(Tagged, Event):
     """
     Received an IRC message.
     """
@@ -112,10 +143,14 @@ class MessagedEvent(Event):
     who: IRCUser
     where: str
     message: str
+    # Message received, the source of the tags
+    irc_message: Optional["IRCMessage"] = field(
+        default=None, repr=False, compare=False
+    )
 
 
 @dataclass
-class NoticedEvent(Event):
+class NoticedEvent(Tagged, Event):
     """
     Received an IRC notice.
     """
@@ -123,6 +158,40 @@ class NoticedEvent(Event):
     who: IRCUser
     where: str
     message: str
+    # Message received, the source of the tags
+    irc_message: Optional["IRCMessage"] = field(
+        default=None, repr=False, compare=False
+    )
+
+
+@dataclass
+class BatchEvent(Tagged, Event):
+    """
+    Received an IRCv3 batch of messages, e.g. the QUITs of a netsplit. The
+    events of the batch are broadcast on their own afterwards too, except to
+    the subscribers which asked not to receive batched events.
+    """
+    client: "IRCClient"
+    reference: str
+    # Batch type, e.g. netsplit, netjoin or chathistory
+    type: str
+    params: Tuple[str, ...]
+    # Events of the batch in the order received, nested batches included
+    events: List[Event] = field(default_factory=list)
+    # BATCH message opening the batch, the source of the tags
+    irc_message: Optional["IRCMessage"] = field(
+        default=None, repr=False, compare=False
+    )
+
+    def flatten(self) -> Iterator[Event]:
+        """
+        Iterates over the events of the batch and of its nested batches.
+        """
+        for event in self.events:
+            if isinstance(event, BatchEvent):
+                yield from event.flatten()
+            else:
+                yield event
 
 
 @dataclass
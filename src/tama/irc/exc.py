@@ -1,4 +1,4 @@
-__all__ = ["InvalidIRCCommandError"]
+__all__ = ["InvalidIRCCommandError", "QueryError"]
 
 
 class InvalidIRCCommandError(Exception):
@@ -10,3 +10,19 @@ class InvalidIRCCommandError(Exception):
 
     def __init__(self, command: str) -> None:
         self.command = command
+
+
+class QueryError(Exception):
+    """
+    The server answered a query such as WHOIS or MODE with an error numeric.
+    """
+
+    command: str
+    target: str
+    reason: str
+
+    def __init__(self, command: str, target: str, reason: str) -> None:
+        super().__init__(f"{command} {target}: {reason}")
+        self.command = command
+        self.target = target
+        self.reason = reason
@@ -0,0 +1,138 @@
+"""
+Parses the RPL_ISUPPORT (005) tokens a server announces after registration.
+
+Tokens are parsed once as they arrive and kept in typed attributes, so lookups
+don't need to touch the raw token strings again. Attributes hold the defaults
+of RFC1459 until the server announces otherwise.
+
+See also: https://modern.ircdocs.horse/#rplisupport-005
+"""
+import re
+from typing import Dict, Optional, Sequence
+
+from tama.irc.casemap import CaseMapping, CASEMAPPINGS, DEFAULT_CASEMAPPING
+
+__all__ = ["ISupport"]
+
+DEFAULT_CHANTYPES = "#&"
+DEFAULT_PREFIX_MODES = "ov"
+DEFAULT_PREFIXES = "@+"
+DEFAULT_LINELEN = 512
+
+_ESCAPE = re.compile(r"\\x([0-9A-Fa-f]{2})")
+_PREFIX = re.compile(r"^\((\w*)\)(.*)$")
+
+
+def _unescape(value: str) -> str:
+    return _ESCAPE.sub(lambda m: chr(int(m.group(1), 16)), value)
+
+
+def _to_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+class ISupport:
+    __slots__ = (
+        "tokens", "casemap", "chantypes", "prefix_modes", "prefixes",
+        "targmax", "maxtargets", "nicklen", "linelen",
+    )
+
+    # Every announced token with its unescaped value, None if valueless
+    tokens: Dict[str, Optional[str]]
+    # CASEMAPPING, unknown mappings fall back to ascii
+    casemap: CaseMapping
+    # CHANTYPES, characters channel names start with
+    chantypes: str
+    # PREFIX, channel membership modes and their prefixes in the same order
+    prefix_modes: str
+    prefixes: str
+    # TARGMAX, maximum targets per command, None if unlimited
+    targmax: Dict[str, Optional[int]]
+    # MAXTARGETS, older limit for PRIVMSG and NOTICE superseded by TARGMAX
+    maxtargets: Optional[int]
+    # NICKLEN
+    nicklen: Optional[int]
+    # LINELEN, maximum message length in bytes including CRLF
+    linelen: int
+
+    def __init__(self) -> None:
+        self.tokens = {}
+        self.casemap = DEFAULT_CASEMAPPING
+        self.chantypes = DEFAULT_CHANTYPES
+        self.prefix_modes = DEFAULT_PREFIX_MODES
+        self.prefixes = DEFAULT_PREFIXES
+        self.targmax = {}
+        self.maxtargets = None
+        self.nicklen = None
+        self.linelen = DEFAULT_LINELEN
+
+    def update(self, params: Sequence[str]) -> None:
+        """
+        Applies the tokens of a RPL_ISUPPORT message. A token prefixed by -
+        is withdrawn and returns to its default.
+
+        :param params: Tokens, without the client and trailing parameters.
+        :return: None
+        """
+        for param in params:
+            if param.startswith("-"):
+                self.tokens.pop(param[1:].upper(), None)
+                continue
+            name, sep, value = param.partition("=")
+            self.tokens[name.upper()] = _unescape(value) if sep else None
+        self._parse()
+
+    def _parse(self) -> None:
+        tokens = self.tokens
+
+        casemapping = (tokens.get("CASEMAPPING") or "rfc1459").lower()
+        self.casemap = CASEMAPPINGS.get(casemapping, CASEMAPPINGS["ascii"])
+
+        chantypes = tokens.get("CHANTYPES", DEFAULT_CHANTYPES)
+        self.chantypes = chantypes or ""
+
+        prefix = _PREFIX.match(tokens.get("PREFIX") or "")
+        if "PREFIX" not in tokens:
+            self.prefix_modes = DEFAULT_PREFIX_MODES
+            self.prefixes = DEFAULT_PREFIXES
+        elif prefix is not None:
+            self.prefix_modes, self.prefixes = prefix.groups()
+        else:
+            # Empty PREFIX: no membership prefixes at all
+            self.prefix_modes = self.prefixes = ""
+
+        self.targmax = {}
+        for entry in (tokens.get("TARGMAX") or "").split(","):
+            command, sep, limit = entry.partition(":")
+            if sep:
+                self.targmax[command.upper()] = _to_int(limit)
+
+        self.maxtargets = _to_int(tokens.get("MAXTARGETS"))
+        self.nicklen = _to_int(tokens.get("NICKLEN"))
+        self.linelen = _to_int(tokens.get("LINELEN")) or DEFAULT_LINELEN
+
+    def is_channel(self, name: str) -> bool:
+        return bool(name) and name[0] in self.chantypes
+
+    def max_targets(
+        self, command: str, default: Optional[int] = None
+    ) -> Optional[int]:
+        """
+        Maximum amount of targets a command accepts, None if unlimited.
+
+        :param command: Command name.
+        :param default: Limit assumed if the server doesn't advertise one.
+        :return: Target limit.
+        """
+        command = command.upper()
+        if command in self.targmax:
+            return self.targmax[command]
+        if command in ("PRIVMSG", "NOTICE") and self.maxtargets is not None:
+            return self.maxtargets
+        return default
+
+    def __repr__(self) -> str:
+        return f"ISupport({self.tokens!r})"
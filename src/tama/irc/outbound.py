@@ -0,0 +1,377 @@
+"""
+Paces outbound IRC messages to stay under the flood limits of a server.
+
+Messages are queued in priority lanes so protocol traffic is never held behind
+bulk text, and a token bucket decides how many of them may be written at a
+time. Each message costs one token plus a share proportional to its size, the
+bucket refills at a fixed rate up to its burst size.
+
+Within a lane every target (channel or nickname) has its own sub-queue and
+targets are served by deficit round-robin, so a long reply in one channel does
+not hold back the others. Sub-queues are capped and their overflow is either
+dropped or summarised in a single line.
+
+Messages may also be queued last, e.g. a QUIT that must not cut off pending
+replies. They are only sent once every lane is empty.
+"""
+import asyncio as aio
+from collections import deque
+from enum import IntEnum, Enum
+from time import monotonic
+from typing import Optional, List, Deque, Dict, Tuple, Callable
+
+from tama.irc.casemap import DEFAULT_CASEMAPPING
+from tama.irc.stream import IRCMessage
+
+__all__ = [
+    "Priority", "OverflowPolicy", "TokenBucket", "FairLane", "OutboundQueue"
+]
+
+
+class Priority(IntEnum):
+    # Protocol traffic, never delayed by the token bucket
+    CONTROL = 0
+    # Replies and any other command
+    NORMAL = 1
+    # Channel and private messages
+    BULK = 2
+
+
+class OverflowPolicy(Enum):
+    # Discard messages queued for a target over its limit
+    DROP = "drop"
+    # Replace them with a single line telling how many were omitted
+    SUMMARIZE = "summarize"
+
+
+COMMAND_PRIORITIES: Dict[str, Priority] = {
+    "PING": Priority.CONTROL,
+    "PONG": Priority.CONTROL,
+    "QUIT": Priority.CONTROL,
+    "PASS": Priority.CONTROL,
+    "NICK": Priority.CONTROL,
+    "USER": Priority.CONTROL,
+    "CAP": Priority.CONTROL,
+    "AUTHENTICATE": Priority.CONTROL,
+    "NOTICE": Priority.NORMAL,
+    "PRIVMSG": Priority.BULK,
+}
+
+
+class TokenBucket:
+    __slots__ = ("burst", "rate", "bytes_per_token", "tokens", "_updated")
+
+    # Maximum amount of tokens held
+    burst: float
+    # Tokens refilled per second
+    rate: float
+    # Message size that costs one extra token
+    bytes_per_token: int
+    # Currently available tokens, may be negative after control traffic
+    tokens: float
+    _updated: float
+
+    def __init__(
+        self, burst: float, rate: float, bytes_per_token: int
+    ) -> None:
+        # A full bucket must always afford a message
+        if burst < 1:
+            raise ValueError(f"Flood burst must be at least 1, got {burst}")
+        if rate <= 0:
+            raise ValueError(f"Flood rate must be positive, got {rate}")
+        if bytes_per_token <= 0:
+            raise ValueError(
+                f"Flood bytes_per_token must be positive, got "
+                f"{bytes_per_token}"
+            )
+        self.burst = burst
+        self.rate = rate
+        self.bytes_per_token = bytes_per_token
+        self.tokens = burst
+        self._updated = monotonic()
+
+    def cost(self, size: int) -> float:
+        # Capped, otherwise a long message could never be afforded and would
+        # hold up the queue for good
+        return min(self.burst, 1 + size / self.bytes_per_token)
+
+    def refill(self) -> None:
+        now = monotonic()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def delay(self, cost: float) -> float:
+        """
+        Seconds until the bucket holds enough tokens for the given cost.
+        """
+        return max(0.0, (cost - self.tokens) / self.rate)
+
+
+class FairLane:
+    """
+    Queue of messages with one sub-queue per target, served by deficit
+    round-robin over the size of the messages.
+    """
+    __slots__ = (
+        "quantum", "limit", "policy", "fold", "dropped",
+        "_queues", "_deficits", "_summaries", "_active", "_credited",
+        "_size",
+    )
+
+    # Bytes a target may send per round
+    quantum: int
+    # Maximum messages queued per target, unlimited if None
+    limit: Optional[int]
+    policy: OverflowPolicy
+    # Case folding of targets, so differently cased names share a queue
+    fold: Callable[[str], str]
+    # Total messages discarded due to the limit
+    dropped: int
+
+    _queues: Dict[str, Deque[IRCMessage]]
+    _deficits: Dict[str, int]
+    # Summary line queued last for a target and the messages it accounts for
+    _summaries: Dict[str, Tuple[int, IRCMessage]]
+    # Targets with queued messages in service order
+    _active: Deque[str]
+    # Whether the target in front already received its quantum this round
+    _credited: bool
+    _size: int
+
+    def __init__(
+        self,
+        quantum: int,
+        limit: Optional[int] = None,
+        policy: OverflowPolicy = OverflowPolicy.SUMMARIZE,
+        fold: Callable[[str], str] = DEFAULT_CASEMAPPING.fold,
+    ) -> None:
+        self.quantum = quantum
+        self.limit = limit
+        self.policy = policy
+        self.fold = fold
+        self.dropped = 0
+        self._queues = {}
+        self._deficits = {}
+        self._summaries = {}
+        self._active = deque()
+        self._credited = False
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def target_of(self, msg: IRCMessage) -> str:
+        # Only messages have a meaningful target, everything else shares one
+        # sub-queue so its relative order is kept.
+        if msg.command in ("PRIVMSG", "NOTICE") and msg.middle:
+            return self.fold(msg.middle[0])
+        return ""
+
+    def append(self, msg: IRCMessage) -> None:
+        target = self.target_of(msg)
+        if (queue := self._queues.get(target)) is None:
+            queue = self._queues[target] = deque()
+            self._deficits[target] = 0
+            self._active.append(target)
+
+        if self.limit is not None and target and len(queue) >= self.limit:
+            self._overflow(target, queue, msg)
+            return
+
+        queue.append(msg)
+        self._size += 1
+
+    def _overflow(
+        self, target: str, queue: Deque[IRCMessage], msg: IRCMessage
+    ) -> None:
+        self.dropped += 1
+        if self.policy == OverflowPolicy.DROP:
+            return
+        # The summary takes the place of the last queued message, or of the
+        # previous summary if it is still at the end of the queue.
+        omitted, summary = self._summaries.get(target, (0, None))
+        if queue[-1] is summary:
+            omitted += 1
+        else:
+            # Both the replaced message and the new one are omitted
+            omitted = 2
+            self.dropped += 1
+        queue.pop()
+        summary = IRCMessage(
+            command=msg.command,
+            middle=msg.middle,
+            trailing=f"(... {omitted} more lines omitted)",
+            encoding=msg.encoding,
+        )
+        self._summaries[target] = omitted, summary
+        queue.append(summary)
+
+    def peek(self) -> IRCMessage:
+        """
+        Returns the message that popleft would return next.
+        """
+        active = self._active
+        while True:
+            target = active[0]
+            if not self._credited:
+                self._deficits[target] += self.quantum
+                self._credited = True
+            head = self._queues[target][0]
+            if self._deficits[target] >= len(head.raw):
+                return head
+            active.rotate(-1)
+            self._credited = False
+
+    def popleft(self) -> IRCMessage:
+        msg = self.peek()
+        target = self._active[0]
+        queue = self._queues[target]
+        queue.popleft()
+        self._size -= 1
+        self._deficits[target] -= len(msg.raw)
+        if not queue:
+            # Idle targets don't keep their deficit
+            del self._queues[target]
+            del self._deficits[target]
+            self._summaries.pop(target, None)
+            self._active.popleft()
+            self._credited = False
+        return msg
+
+
+class OutboundQueue:
+    """
+    Priority queue of outbound messages paced by an optional token bucket.
+    """
+    __slots__ = ("bucket", "_lanes", "_last", "_size", "_wakeup")
+
+    bucket: Optional[TokenBucket]
+    _lanes: Tuple[FairLane, ...]
+    # Messages sent only once every lane is empty, in order
+    _last: Deque[IRCMessage]
+    _size: int
+    # Set whenever a message is queued
+    _wakeup: aio.Event
+
+    def __init__(
+        self,
+        bucket: Optional[TokenBucket] = None,
+        quantum: int = 512,
+        target_limit: Optional[int] = None,
+        overflow: OverflowPolicy = OverflowPolicy.SUMMARIZE,
+    ) -> None:
+        """
+        Creates a new OutboundQueue.
+
+        :param bucket: Token bucket pacing the queue, unpaced if None.
+        :param quantum: Bytes each target may send per round-robin round.
+        :param target_limit: Messages queued per target before overflow.
+        :param overflow: What to do with messages over target_limit.
+        """
+        self.bucket = bucket
+        self._lanes = tuple(
+            # Control traffic is never discarded
+            FairLane(quantum) if priority == Priority.CONTROL
+            else FairLane(quantum, target_limit, overflow)
+            for priority in Priority
+        )
+        self._last = deque()
+        self._size = 0
+        self._wakeup = aio.Event()
+
+    @property
+    def dropped(self) -> int:
+        return sum(lane.dropped for lane in self._lanes)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def empty(self) -> bool:
+        return self._size == 0
+
+    def set_fold(self, fold: Callable[[str], str]) -> None:
+        """
+        Changes the case folding of targets. Messages already queued keep
+        their sub-queue.
+        """
+        for lane in self._lanes:
+            lane.fold = fold
+
+    def put_nowait(
+        self, msg: IRCMessage, priority: Optional[Priority] = None
+    ) -> None:
+        if priority is None:
+            priority = COMMAND_PRIORITIES.get(msg.command, Priority.NORMAL)
+        lane = self._lanes[priority]
+        before = len(lane)
+        lane.append(msg)
+        self._size += len(lane) - before
+        self._wakeup.set()
+
+    def put_last(self, msg: IRCMessage) -> None:
+        """
+        Queues a message to be sent after everything else queued, including
+        the messages queued after it in any lane.
+        """
+        self._last.append(msg)
+        self._size += 1
+        self._wakeup.set()
+
+    def _peek(self) -> Tuple[Optional[FairLane], Priority]:
+        for priority, lane in zip(Priority, self._lanes):
+            if lane:
+                return lane, priority
+        return None, Priority.BULK
+
+    async def get_batch(self, max_bytes: int) -> List[IRCMessage]:
+        """
+        Waits for queued messages and takes as many as the token bucket
+        allows, highest priority first, up to max_bytes. At least one message
+        is always returned.
+
+        :param max_bytes: Size after which no more messages are taken.
+        :return: Messages to send, in order.
+        """
+        batch = []
+        size = 0
+        while True:
+            lane, priority = self._peek()
+            if lane is None:
+                if self._last:
+                    # Not paced, everything before it already was
+                    batch.append(self._last.popleft())
+                    self._size -= 1
+                    continue
+                if batch:
+                    return batch
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            msg_size = len(lane.peek().raw)
+            if (bucket := self.bucket) is not None:
+                bucket.refill()
+                cost = bucket.cost(msg_size)
+                if priority != Priority.CONTROL and bucket.tokens < cost:
+                    if batch:
+                        return batch
+                    # Sleep until enough tokens are available, but wake up
+                    # early if something else is queued since it could be
+                    # control traffic.
+                    self._wakeup.clear()
+                    try:
+                        await aio.wait_for(
+                            self._wakeup.wait(), bucket.delay(cost)
+                        )
+                    except aio.TimeoutError:
+                        pass
+                    continue
+                bucket.tokens -= cost
+
+            batch.append(lane.popleft())
+            self._size -= 1
+            size += msg_size
+            if size >= max_bytes:
+                return batch
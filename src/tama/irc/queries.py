@@ -0,0 +1,241 @@
+"""
+Correlates the numerics a server answers queries with to the query that asked
+for them, so WHOIS, WHO, NAMES and MODE can be awaited.
+
+Pending queries are keyed by command and folded target. Most replies carry
+the target they describe and are matched by it, the ones which don't are given
+to the oldest pending query of their command as servers answer in order. The
+end numeric resolves the query with the replies gathered and an error numeric
+fails it. Identical queries in flight share a single future and are sent once.
+"""
+import asyncio as aio
+from typing import Callable, Dict, List, Optional, Tuple
+
+from tama.irc.exc import QueryError
+from tama.irc.stream import IRCMessage
+
+__all__ = ["QUERY_TIMEOUT", "QUERY_REPLIES", "PendingQuery", "QueryTracker"]
+
+# Seconds a query waits for its end numeric
+QUERY_TIMEOUT = 30
+
+# Roles of a reply within a query
+REPLY, END, ERROR = range(3)
+
+TargetsOf = Callable[[IRCMessage], Tuple[str, ...]]
+
+
+def _target(msg: IRCMessage) -> Tuple[str, ...]:
+    # <client> <target> ...
+    return msg.middle[1:2]
+
+
+def _last(msg: IRCMessage) -> Tuple[str, ...]:
+    # RPL_NAMREPLY: <client> <symbol> <channel> :<nicks>
+    return msg.middle[-1:]
+
+
+def _client(msg: IRCMessage) -> Tuple[str, ...]:
+    # RPL_UMODEIS: <client> <modes>
+    return msg.middle[:1]
+
+
+def _who_reply(msg: IRCMessage) -> Tuple[str, ...]:
+    # <client> <channel> <user> <host> <server> <nick> <flags> :<hops> <name>
+    middle = msg.middle
+    return (middle[1], middle[5]) if len(middle) > 5 else ()
+
+
+def _none(msg: IRCMessage) -> Tuple[str, ...]:
+    return ()
+
+
+# Replies keyed by command, each with the query it belongs to, its role, how
+# to get the targets it may describe, and whether it goes to the oldest query
+# when no target matches
+QUERY_REPLIES: Dict[str, Tuple[Tuple[str, int, TargetsOf, bool], ...]] = {
+    **{
+        command: (("WHOIS", REPLY, _target, False),)
+        for command in (
+            "RPL_WHOISUSER", "RPL_WHOISSERVER", "RPL_WHOISOPERATOR",
+            "RPL_WHOISIDLE", "RPL_WHOISCHANNELS", "RPL_WHOISCERTFP",
+            "RPL_WHOISREGNICK", "RPL_WHOISSPECIAL", "RPL_WHOISACCOUNT",
+            "RPL_WHOISACTUALLY", "RPL_WHOISHOST", "RPL_WHOISMODES",
+            "RPL_WHOISSECURE", "RPL_AWAY",
+        )
+    },
+    "RPL_ENDOFWHOIS": (("WHOIS", END, _target, False),),
+    "ERR_NOSUCHSERVER": (("WHOIS", ERROR, _target, False),),
+    "ERR_NOSUCHNICK": (
+        ("WHOIS", ERROR, _target, False),
+        ("MODE", ERROR, _target, False),
+    ),
+    # WHO masks may be wildcards, which no reply carries
+    "RPL_WHOREPLY": (("WHO", REPLY, _who_reply, True),),
+    "RPL_WHOSPCRPL": (("WHO", REPLY, _none, True),),
+    "RPL_ENDOFWHO": (("WHO", END, _target, False),),
+    "RPL_NAMREPLY": (("NAMES", REPLY, _last, False),),
+    "RPL_ENDOFNAMES": (("NAMES", END, _target, False),),
+    "RPL_CHANNELMODEIS": (("MODE", END, _target, False),),
+    "RPL_UMODEIS": (("MODE", END, _client, False),),
+    "ERR_NOSUCHCHANNEL": (("MODE", ERROR, _target, False),),
+    "ERR_NOTONCHANNEL": (("MODE", ERROR, _target, False),),
+    "ERR_USERSDONTMATCH": (("MODE", ERROR, _none, True),),
+}
+
+
+class PendingQuery:
+    __slots__ = ("command", "target", "future", "replies", "timer")
+
+    command: str
+    target: str
+    # Resolved with the replies, the end numeric last
+    future: aio.Future
+    replies: List[IRCMessage]
+    timer: Optional[aio.TimerHandle]
+
+    def __init__(self, command: str, target: str, future: aio.Future) -> None:
+        self.command = command
+        self.target = target
+        self.future = future
+        self.replies = []
+        self.timer = None
+
+    def __repr__(self) -> str:
+        return (
+            f"PendingQuery(command={self.command!r}, "
+            f"target={self.target!r}, replies={len(self.replies)})"
+        )
+
+
+class QueryTracker:
+    """
+    Queries of a client waiting for their replies.
+    """
+    __slots__ = ("fold", "_pending", "sent", "coalesced", "timed_out")
+
+    fold: Callable[[str], str]
+    # Pending queries by command, then by folded target in the order sent
+    _pending: Dict[str, Dict[str, PendingQuery]]
+    # Counters of queries sent, answered by a query already in flight and
+    # given up on
+    sent: int
+    coalesced: int
+    timed_out: int
+
+    def __init__(self, fold: Callable[[str], str] = str.lower) -> None:
+        self.fold = fold
+        self._pending = {
+            command: {} for command in ("WHOIS", "WHO", "NAMES", "MODE")
+        }
+        self.sent = 0
+        self.coalesced = 0
+        self.timed_out = 0
+
+    def __len__(self) -> int:
+        return sum(len(pending) for pending in self._pending.values())
+
+    def query(
+        self,
+        command: str,
+        target: str,
+        send: Callable[[], None],
+        timeout: float = QUERY_TIMEOUT,
+    ) -> aio.Future:
+        """
+        Returns the future of a query, sending it unless the same query is
+        already in flight.
+
+        :param command: WHOIS, WHO, NAMES or MODE.
+        :param target: Nickname, mask or channel queried.
+        :param send: Sends the query.
+        :param timeout: Seconds until the future fails with a TimeoutError.
+        :return: Future resolved with the replies.
+        """
+        pending = self._pending[command]
+        key = self.fold(target)
+        if (query := pending.get(key)) is not None:
+            self.coalesced += 1
+            return query.future
+        loop = aio.get_event_loop()
+        query = pending[key] = PendingQuery(
+            command, target, loop.create_future()
+        )
+        query.timer = loop.call_later(timeout, self._expire, query)
+        self.sent += 1
+        send()
+        return query.future
+
+    def feed(self, msg: IRCMessage) -> None:
+        """
+        Gives a server message to the pending query it answers, if any.
+
+        :param msg: Message received.
+        :return: None
+        """
+        if (routes := QUERY_REPLIES.get(msg.command)) is None:
+            return
+        fold = self.fold
+        for command, role, targets_of, oldest in routes:
+            if not (pending := self._pending[command]):
+                continue
+            query = None
+            targets = targets_of(msg)
+            for target in targets:
+                if (query := pending.get(fold(target))) is not None:
+                    break
+            if query is None and (oldest or not targets):
+                query = next(iter(pending.values()))
+            if query is None:
+                continue
+            if role == REPLY:
+                query.replies.append(msg)
+            elif role == END:
+                query.replies.append(msg)
+                self._finish(query)
+                query.future.set_result(query.replies)
+            else:
+                self._finish(query)
+                query.future.set_exception(QueryError(
+                    command, query.target, msg.trailing or msg.command
+                ))
+            return
+
+    def cancel_all(self, exc: Exception) -> None:
+        """
+        Fails every pending query, e.g. when the connection is lost.
+        """
+        for pending in self._pending.values():
+            for query in tuple(pending.values()):
+                self._finish(query)
+                query.future.set_exception(exc)
+
+    def set_fold(self, fold: Callable[[str], str]) -> None:
+        """
+        Changes the fold function, folding the pending targets again.
+        """
+        self.fold = fold
+        for command, pending in self._pending.items():
+            self._pending[command] = {
+                fold(query.target): query for query in pending.values()
+            }
+
+    def _finish(self, query: PendingQuery) -> None:
+        pending = self._pending[query.command]
+        key = self.fold(query.target)
+        if pending.get(key) is query:
+            del pending[key]
+        if query.timer is not None:
+            query.timer.cancel()
+            query.timer = None
+
+    def _expire(self, query: PendingQuery) -> None:
+        query.timer = None
+        self._finish(query)
+        self.timed_out += 1
+        query.future.set_exception(aio.TimeoutError(
+            f"{query.command} {query.target} timed out"
+        ))
+
+    def __repr__(self) -> str:
+        return f"QueryTracker(pending={len(self)}, sent={self.sent})"
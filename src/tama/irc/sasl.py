@@ -0,0 +1,67 @@
+"""
+Builds SASL payloads for the AUTHENTICATE command.
+
+PLAIN sends the account name and password, EXTERNAL relies on the client
+certificate presented during the TLS handshake. Payloads are base64 encoded
+and split in chunks of 400 bytes, a chunk of exactly 400 bytes is followed by
+an empty one ("+").
+
+See also: https://ircv3.net/specs/extensions/sasl-3.1
+"""
+import base64
+from logging import getLogger
+from typing import List, Optional
+
+from tama.config.schema import ServerSASLConfig
+
+__all__ = ["MECHANISMS", "sasl_mechanism", "authenticate_payloads"]
+
+MECHANISMS = ("PLAIN", "EXTERNAL")
+# Maximum length of a single AUTHENTICATE payload
+CHUNK_SIZE = 400
+
+
+def sasl_mechanism(cfg: Optional[ServerSASLConfig]) -> Optional[str]:
+    """
+    Returns the mechanism to authenticate with, None if SASL is not
+    configured or the configuration is unusable.
+    """
+    if cfg is None:
+        return None
+    mechanism = (cfg.mechanism or "PLAIN").upper()
+    if mechanism not in MECHANISMS:
+        getLogger(__name__).error("Unsupported SASL mechanism %s", mechanism)
+        return None
+    if mechanism == "PLAIN" and not (cfg.username and cfg.password):
+        getLogger(__name__).error("SASL PLAIN needs a username and password")
+        return None
+    if mechanism == "EXTERNAL" and not cfg.cert_file:
+        getLogger(__name__).error("SASL EXTERNAL needs a client certificate")
+        return None
+    return mechanism
+
+
+def authenticate_payloads(
+    mechanism: str, cfg: ServerSASLConfig
+) -> List[str]:
+    """
+    Returns the AUTHENTICATE parameters answering the server's empty
+    challenge.
+
+    :param mechanism: PLAIN or EXTERNAL.
+    :param cfg: SASL configuration.
+    :return: Payload chunks, in order.
+    """
+    if mechanism == "PLAIN":
+        data = f"{cfg.username}\0{cfg.username}\0{cfg.password}"
+    else:
+        # EXTERNAL takes the identity from the certificate
+        data = ""
+    encoded = base64.b64encode(data.encode("utf-8")).decode("ascii")
+    chunks = [
+        encoded[i: i + CHUNK_SIZE]
+        for i in range(0, len(encoded), CHUNK_SIZE)
+    ]
+    if len(encoded) % CHUNK_SIZE == 0:
+        chunks.append("+")
+    return chunks
@@ -0,0 +1,196 @@
+"""
+Keeps the list of servers of a network and connects to the best of them.
+
+Connection attempts are raced in the style of Happy Eyeballs. The first time a
+network is connected every server is tried at once and the one finishing its
+TCP/TLS handshake first wins. Afterwards servers are ranked by their measured
+handshake time and attempts are staggered, so the preferred server gets a head
+start but a slow or dead one never holds up the others. The server which was
+used last is tried last on reconnect.
+"""
+import asyncio as aio
+from dataclasses import dataclass
+from logging import getLogger
+from time import perf_counter
+from typing import List, Optional, Tuple, Set
+
+from tama.config import ServerConfig
+from tama.util.dns import get_resolver
+from tama.irc.stream import IRCStream, DEFAULT_READ_SIZE
+from tama.irc.stream.tls import ClientCert
+
+__all__ = ["ServerAddress", "ServerPool"]
+
+# Seconds between staggered connection attempts
+STAGGER_DELAY = 0.25
+
+
+def _close_attempt(task: aio.Task) -> None:
+    if task.cancelled() or task.exception() is not None:
+        return
+    _, stream, _ = task.result()
+    stream.writer.close()
+
+
+@dataclass
+class ServerAddress:
+    host: str
+    port: int
+    secure: bool
+    # Handshake time of the last connection, None if never connected
+    latency: Optional[float] = None
+
+    @classmethod
+    def parse(cls, spec: str) -> "ServerAddress":
+        """
+        Parses a server given as host:port. A + before the port indicates a
+        secure connection. IPv6 addresses must be enclosed in brackets.
+
+        :param spec: Server specification, e.g. "irc.rizon.net:+6697".
+        :return: Parsed address.
+        """
+        host, sep, port = spec.rpartition(":")
+        if not sep or not host:
+            raise ValueError(f"Expected host:port, got '{spec}'")
+        return cls.from_host_port(host.strip("[]"), port)
+
+    @classmethod
+    def from_host_port(cls, host: str, port: str) -> "ServerAddress":
+        return cls(host=host, port=int(port), secure=port.startswith("+"))
+
+    def __str__(self) -> str:
+        scheme = "ircs" if self.secure else "irc"
+        return f"{scheme}://{self.host}:{self.port}"
+
+
+class ServerPool:
+    __slots__ = ("servers", "current", "client_cert")
+
+    # Servers in configuration order
+    servers: List[ServerAddress]
+    # Server of the last successful connection
+    current: Optional[ServerAddress]
+    # Client certificate presented to secure servers
+    client_cert: Optional[ClientCert]
+
+    def __init__(
+        self,
+        servers: List[ServerAddress],
+        client_cert: Optional[ClientCert] = None,
+    ) -> None:
+        if len(servers) == 0:
+            raise ValueError("At least one server is required")
+        self.servers = servers
+        self.current = None
+        self.client_cert = client_cert
+
+    @classmethod
+    def from_config(cls, config: ServerConfig) -> "ServerPool":
+        servers = []
+        if config.host and config.port:
+            servers.append(
+                ServerAddress.from_host_port(config.host, config.port)
+            )
+        servers.extend(ServerAddress.parse(s) for s in config.servers or ())
+        client_cert = None
+        if config.sasl is not None and config.sasl.cert_file:
+            client_cert = config.sasl.cert_file, config.sasl.key_file
+        return cls(servers, client_cert)
+
+    def candidates(self) -> List[ServerAddress]:
+        """
+        Returns the servers in the order they should be tried.
+        """
+        measured = sorted(
+            (s for s in self.servers if s.latency is not None),
+            key=lambda s: s.latency,
+        )
+        ranked = measured + [s for s in self.servers if s.latency is None]
+        if self.current is not None and len(ranked) > 1:
+            # Likely the server we just lost, try the others first
+            ranked.remove(self.current)
+            ranked.append(self.current)
+        return ranked
+
+    async def connect(self, read_size: int = DEFAULT_READ_SIZE) -> IRCStream:
+        """
+        Connects to the first server to complete its handshake.
+
+        :param read_size: Bytes requested from the socket per read.
+        :return: Connected stream.
+        """
+        candidates = self.candidates()
+        # Probe every server at once until something has been measured
+        if any(s.latency is not None for s in candidates):
+            stagger = STAGGER_DELAY
+        else:
+            stagger = 0
+
+        pending: Set[aio.Task] = set()
+        errors = []
+        try:
+            while True:
+                if candidates:
+                    pending.add(aio.create_task(
+                        self._attempt(candidates.pop(0), read_size)
+                    ))
+                    if stagger == 0 and candidates:
+                        continue
+                elif not pending:
+                    raise ConnectionError(
+                        "Could not connect to any server: " + ", ".join(errors)
+                    )
+
+                done, pending = await aio.wait(
+                    pending,
+                    timeout=stagger if candidates else None,
+                    return_when=aio.FIRST_COMPLETED,
+                )
+                connected = []
+                for task in done:
+                    if (exc := task.exception()) is not None:
+                        errors.append(repr(exc))
+                    else:
+                        connected.append(task.result())
+                if connected:
+                    return self._select(connected)
+        finally:
+            for task in pending:
+                task.cancel()
+                # An attempt may complete before the cancellation reaches it
+                task.add_done_callback(_close_attempt)
+
+    def _select(
+        self, connected: List[Tuple[ServerAddress, IRCStream, float]]
+    ) -> IRCStream:
+        connected.sort(key=lambda c: c[2])
+        for server, stream, latency in connected:
+            server.latency = latency
+        # Several attempts may finish at once, keep the fastest
+        for _, stream, _ in connected[1:]:
+            stream.writer.close()
+        server, stream, latency = connected[0]
+        self.current = server
+        getLogger(__name__).info(
+            "Selected %s, handshake took %.3f s", server, latency
+        )
+        return stream
+
+    async def _attempt(
+        self, server: ServerAddress, read_size: int
+    ) -> Tuple[ServerAddress, IRCStream, float]:
+        addresses = await get_resolver().resolve(server.host)
+        error = OSError(f"No addresses found for {server.host}")
+        for address in addresses:
+            start = perf_counter()
+            try:
+                stream = await IRCStream.create(
+                    server.host, server.port, server.secure,
+                    read_size=read_size, address=address,
+                    client_cert=self.client_cert,
+                )
+            except OSError as exc:
+                error = exc
+                continue
+            return server, stream, perf_counter() - start
+        raise error
@@ -0,0 +1,264 @@
+"""
+Tracks which users are in which channels of a network.
+
+Every nickname is interned as a single Member object, no matter how many
+channels it shares with the bot, and channels hold sets of members while
+members hold sets of channels. This keeps both directions of the lookup O(1)
+and stores each user once.
+
+State is fed by JOIN, PART, KICK, QUIT and NICK, and by RPL_NAMREPLY and
+RPL_ENDOFNAMES which replace the member list of a channel as a whole.
+"""
+import sys
+from typing import Callable, Dict, Set, FrozenSet, Iterable, Optional
+
+from tama.irc.casemap import CaseMapping, DEFAULT_CASEMAPPING
+
+__all__ = ["Member", "Channel", "ChannelState", "NAMES_PREFIXES"]
+
+# Channel membership prefixes that may precede a nickname in RPL_NAMREPLY
+NAMES_PREFIXES = "~&@%+"
+
+
+class Member:
+    __slots__ = ("nick", "channels")
+
+    nick: str
+    channels: Set["Channel"]
+
+    def __init__(self, nick: str) -> None:
+        self.nick = sys.intern(nick)
+        self.channels = set()
+
+    def __repr__(self) -> str:
+        return f"Member(nick={self.nick!r}, channels={len(self.channels)})"
+
+
+class Channel:
+    __slots__ = ("name", "members")
+
+    name: str
+    members: Set[Member]
+
+    def __init__(self, name: str) -> None:
+        self.name = sys.intern(name)
+        self.members = set()
+
+    def __repr__(self) -> str:
+        return f"Channel(name={self.name!r}, members={len(self.members)})"
+
+
+class ChannelState:
+    """
+    Channel membership of the users visible to a client.
+    """
+    __slots__ = (
+        "casemap", "fold", "prefixes", "channels", "members", "_names",
+    )
+
+    # Case mapping of channel names and nicknames, and its fold function
+    casemap: CaseMapping
+    fold: Callable[[str], str]
+    # Membership prefixes stripped from RPL_NAMREPLY nicknames
+    prefixes: str
+    # Joined channels keyed by folded name
+    channels: Dict[str, Channel]
+    # Known users keyed by folded nickname
+    members: Dict[str, Member]
+    # Member lists being received through RPL_NAMREPLY, keyed by folded name
+    _names: Dict[str, Set[Member]]
+
+    def __init__(
+        self,
+        casemap: CaseMapping = DEFAULT_CASEMAPPING,
+        prefixes: str = NAMES_PREFIXES,
+    ) -> None:
+        self.casemap = casemap
+        self.fold = casemap.fold
+        self.prefixes = prefixes
+        self.channels = {}
+        self.members = {}
+        self._names = {}
+
+    def __len__(self) -> int:
+        return len(self.channels)
+
+    def __contains__(self, channel: str) -> bool:
+        return self.fold(channel) in self.channels
+
+    # Lookups
+    def is_in(self, channel: str, nick: str) -> bool:
+        """
+        Whether nick is in channel.
+        """
+        chan = self.channels.get(self.fold(channel))
+        member = self.members.get(self.fold(nick))
+        if chan is None or member is None:
+            return False
+        return member in chan.members
+
+    def channels_of(self, nick: str) -> FrozenSet[str]:
+        """
+        Names of the joined channels nick is in.
+        """
+        member = self.members.get(self.fold(nick))
+        if member is None:
+            return frozenset()
+        return frozenset(chan.name for chan in member.channels)
+
+    def members_of(self, channel: str) -> FrozenSet[str]:
+        """
+        Nicknames in channel, empty if the channel isn't joined.
+        """
+        chan = self.channels.get(self.fold(channel))
+        if chan is None:
+            return frozenset()
+        return frozenset(member.nick for member in chan.members)
+
+    def get_channel(self, channel: str) -> Optional[Channel]:
+        return self.channels.get(self.fold(channel))
+
+    # Updates
+    def joined(self, channel: str, nick: str) -> None:
+        key = self.fold(channel)
+        if (chan := self.channels.get(key)) is None:
+            chan = self.channels[key] = Channel(channel)
+        self._link(chan, self._intern(nick))
+
+    def parted(self, channel: str, nick: str) -> None:
+        chan = self.channels.get(self.fold(channel))
+        member = self.members.get(self.fold(nick))
+        if chan is None or member is None:
+            return
+        self._unlink(chan, member)
+
+    def left(self, channel: str) -> None:
+        """
+        Forgets a channel the client itself is no longer in.
+        """
+        key = self.fold(channel)
+        chan = self.channels.pop(key, None)
+        self._names.pop(key, None)
+        if chan is None:
+            return
+        for member in chan.members:
+            member.channels.discard(chan)
+            if not member.channels:
+                self._forget(member)
+        chan.members.clear()
+
+    def quit(self, nick: str) -> None:
+        member = self.members.get(self.fold(nick))
+        if member is None:
+            return
+        for chan in member.channels:
+            chan.members.discard(member)
+        member.channels.clear()
+        self._forget(member)
+
+    def renamed(self, old: str, new: str) -> None:
+        member = self.members.pop(self.fold(old), None)
+        if member is None:
+            return
+        member.nick = sys.intern(new)
+        self.members[self.fold(new)] = member
+
+    def names(self, channel: str, nicks: Iterable[str]) -> None:
+        """
+        Adds a RPL_NAMREPLY batch to the member list being received.
+        """
+        key = self.fold(channel)
+        if (pending := self._names.get(key)) is None:
+            pending = self._names[key] = set()
+        prefixes = self.prefixes
+        for nick in nicks:
+            # userhost-in-names sends full addresses
+            nick = nick.lstrip(prefixes).split("!", 1)[0]
+            if nick:
+                pending.add(self._intern(nick))
+
+    def end_of_names(self, channel: str) -> None:
+        """
+        Replaces the member list of a channel with the one just received.
+        """
+        key = self.fold(channel)
+        pending = self._names.pop(key, set())
+        chan = self.channels.get(key)
+        if chan is None:
+            # NAMES of a channel that isn't joined
+            for member in pending:
+                if not member.channels:
+                    self._forget(member)
+            return
+        for member in chan.members - pending:
+            self._unlink(chan, member)
+        for member in pending:
+            self._link(chan, member)
+
+    def set_casemap(self, casemap: CaseMapping) -> None:
+        """
+        Changes the case mapping, folding the existing keys again.
+        """
+        self.casemap = casemap
+        self.fold = fold = casemap.fold
+        self.channels = {
+            fold(chan.name): chan for chan in self.channels.values()
+        }
+        self.members = {
+            fold(member.nick): member for member in self.members.values()
+        }
+        self._names = {}
+
+    def clear(self) -> None:
+        self.channels.clear()
+        self.members.clear()
+        self._names.clear()
+
+    # Reporting
+    def memory_usage(self) -> int:
+        """
+        Approximate bytes used by the state, including nickname and channel
+        name strings.
+        """
+        getsizeof = sys.getsizeof
+        total = getsizeof(self.channels) + getsizeof(self.members)
+        for key, chan in self.channels.items():
+            total += getsizeof(chan) + getsizeof(chan.members)
+            total += getsizeof(chan.name)
+            if key is not chan.name:
+                total += getsizeof(key)
+        for key, member in self.members.items():
+            total += getsizeof(member) + getsizeof(member.channels)
+            total += getsizeof(member.nick)
+            if key is not member.nick:
+                total += getsizeof(key)
+        return total
+
+    def __repr__(self) -> str:
+        return (
+            f"ChannelState(channels={len(self.channels)}, "
+            f"members={len(self.members)})"
+        )
+
+    # Internals
+    def _intern(self, nick: str) -> Member:
+        key = self.fold(nick)
+        if (member := self.members.get(key)) is None:
+            member = self.members[sys.intern(key)] = Member(nick)
+        return member
+
+    def _forget(self, member: Member) -> None:
+        key = self.fold(member.nick)
+        if self.members.get(key) is member:
+            del self.members[key]
+
+    @staticmethod
+    def _link(chan: Channel, member: Member) -> None:
+        chan.members.add(member)
+        member.channels.add(chan)
+
+    def _unlink(self, chan: Channel, member: Member) -> None:
+        chan.members.discard(member)
+        member.channels.discard(chan)
+        if not member.channels:
+            self._forget(member)
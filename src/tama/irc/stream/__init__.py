@@ -21,13 +21,41 @@ See also: https://tools.ietf.org/html/rfc1459
 
 """
 import asyncio as aio
-import ssl
-from logging import getLogger
-from typing import List, Optional
+from logging import getLogger, DEBUG
+from time import perf_counter
+from typing import List, Optional, Sequence, Tuple
 
+from tama.util.stats import RunningStats
+from tama.irc.exc import InvalidIRCCommandError
+from tama.irc.stream.framing import LineFramer
 from tama.irc.stream.payloads import IRCMessage
+from tama.irc.stream.tls import TLSSessionCache, ClientCert, get_ssl_context
 
-__all__ = ["IRCStream", "IRCMessage"]
+__all__ = [
+    "IRCStream", "IRCMessage", "LineFramer", "WriteStats", "DEFAULT_READ_SIZE"
+]
+
+# Maximum amount of bytes requested from the socket per read
+DEFAULT_READ_SIZE = 64 * 1024
+
+
+class WriteStats:
+    """
+    Per-batch statistics of the outbound side of a stream.
+    """
+    __slots__ = ("messages", "bytes", "latency")
+
+    # Messages per batch
+    messages: RunningStats
+    # Bytes per batch
+    bytes: RunningStats
+    # Seconds spent writing and draining each batch
+    latency: RunningStats
+
+    def __init__(self) -> None:
+        self.messages = RunningStats()
+        self.bytes = RunningStats()
+        self.latency = RunningStats()
 
 
 class IRCStream:
@@ -35,28 +63,86 @@ class IRCStream:
 
     reader: aio.StreamReader
     writer: aio.StreamWriter
+    framer: LineFramer
+    read_size: int
+    write_stats: WriteStats
+    # Server hostname and session cache of a TLS connection whose session
+    # is not stored yet
+    _tls_pending: Optional[Tuple[str, TLSSessionCache]]
 
     def __init__(
         self,
         reader: aio.StreamReader,
         writer: aio.StreamWriter,
+        read_size: int = DEFAULT_READ_SIZE,
     ) -> None:
         super().__init__()
         self.reader = reader
         self.writer = writer
-        self.buffer = bytearray()
+        self.framer = LineFramer()
+        self.read_size = read_size
+        self.write_stats = WriteStats()
+        self._tls_pending = None
 
     @classmethod
-    async def create(cls, host: str, port: int, secure: bool = False):
+    async def create(
+        cls,
+        host: str,
+        port: int,
+        secure: bool = False,
+        read_size: int = DEFAULT_READ_SIZE,
+        address: Optional[str] = None,
+        client_cert: Optional[ClientCert] = None,
+    ):
+        """
+        Opens a connection to an IRC server.
+
+        :param host: Server hostname, also used to verify its certificate.
+        :param port: Server port.
+        :param secure: Whether to use TLS.
+        :param read_size: Bytes requested from the socket per read.
+        :param address: Already resolved address of the host, if any.
+        :param client_cert: Client certificate presented on TLS connections.
+        :return: Connected stream.
+        """
         if not secure:
             getLogger(__name__).info(f"Connecting to irc://{host}:{port}")
         else:
             getLogger(__name__).info(f"Connecting to ircs://{host}:{port}")
         ssl_ctx = None
+        server_hostname = None
         if secure:
-            ssl_ctx = ssl.create_default_context()
-        reader, writer = await aio.open_connection(host, port, ssl=ssl_ctx)
-        return cls(reader, writer)
+            ssl_ctx = get_ssl_context(client_cert)
+            if address is not None:
+                server_hostname = host
+        reader, writer = await aio.open_connection(
+            address or host, port,
+            ssl=ssl_ctx, server_hostname=server_hostname,
+        )
+        stream = cls(reader, writer, read_size)
+        if secure:
+            stream._tls_handshake_done(host, ssl_ctx.session_cache)
+        return stream
+
+    def _tls_handshake_done(self, host: str, cache: TLSSessionCache) -> None:
+        ssl_object = self.writer.get_extra_info("ssl_object")
+        if ssl_object is None:
+            return
+        cache.record_handshake(ssl_object.session_reused)
+        getLogger(__name__).info(
+            "TLS handshake with %s using %s, session %s",
+            host, ssl_object.version(),
+            "resumed" if ssl_object.session_reused else "not resumed",
+        )
+        cache.store(host, ssl_object.session)
+        # TLS 1.3 servers send their session tickets after the handshake, the
+        # session is stored again once the first data arrives.
+        self._tls_pending = host, cache
+
+    def _store_tls_session(self) -> None:
+        host, cache = self._tls_pending
+        cache.store(host, self.writer.get_extra_info("ssl_object").session)
+        self._tls_pending = None
 
     async def read_messages(self) -> Optional[List[IRCMessage]]:
         """
@@ -66,35 +152,51 @@ class IRCStream:
 
         :return: List of IRC messages or None.
         """
-        messages = []
-        data = await self.reader.read(1024)
+        data = await self.reader.read(self.read_size)
 
         if len(data) == 0:
             # Connection closed
             return None
+        if self._tls_pending is not None:
+            self._store_tls_session()
 
-        if (lim := data.find(b"\r\n")) == -1:
-            # If there is no delimiter assume the message is incomplete
-            self.buffer.extend(data)
-            return messages
-
-        # Get buffered message
-        if len(self.buffer) > 0:
-            msg, data = self.buffer + data[: lim], data[lim + 2:]
-            messages.append(IRCMessage.parse(msg, encoding=self.encoding))
-            self.buffer.clear()
-
-        # Get all other messages
-        while (lim := data.find(b"\r\n")) != -1:
-            msg, data = data[: lim], data[lim + 2:]
-            messages.append(IRCMessage.parse(msg, encoding=self.encoding))
-
-        # Buffer remaining data for next read
-        if len(data) > 0:
-            self.buffer = bytearray(data)
+        messages = []
+        for line in self.framer.feed(data):
+            if len(line) == 2:
+                # Empty messages are silently ignored
+                continue
+            try:
+                messages.append(IRCMessage.parse(line, encoding=self.encoding))
+            except InvalidIRCCommandError as exc:
+                # Drop the line instead of losing the rest of the read
+                getLogger(__name__).warning(
+                    "Discarding message with unknown command %s", exc.command
+                )
 
         return messages
 
     async def send_message(self, msg: IRCMessage) -> None:
-        self.writer.write(msg.raw)
+        await self.send_messages((msg,))
+
+    async def send_messages(self, messages: Sequence[IRCMessage]) -> None:
+        """
+        Sends a batch of IRC messages with a single write and a single drain.
+
+        :param messages: Messages to send, in order.
+        :return: None
+        """
+        start = perf_counter()
+        data = b"".join([msg.raw for msg in messages])
+        self.writer.write(data)
         await self.writer.drain()
+        elapsed = perf_counter() - start
+
+        stats = self.write_stats
+        stats.messages.add(len(messages))
+        stats.bytes.add(len(data))
+        stats.latency.add(elapsed)
+        if getLogger(__name__).isEnabledFor(DEBUG):
+            getLogger(__name__).debug(
+                "Sent batch of %d messages (%d bytes) in %.3f ms",
+                len(messages), len(data), elapsed * 1000,
+            )
@@ -0,0 +1,54 @@
+"""
+Splits an inbound byte stream into CRLF delimited IRC lines.
+
+The framer keeps a single growable receive buffer. Each read is appended to
+it, scanned by offset for delimiters and compacted once, so the unterminated
+tail is never copied per line and framing stays linear in the amount of data
+received.
+"""
+from typing import List
+
+__all__ = ["LineFramer"]
+
+
+class LineFramer:
+    __slots__ = ("buffer", "_scan_from")
+
+    # Receive buffer holding the unterminated tail of the stream
+    buffer: bytearray
+    # Offset from which the buffer has not been scanned for delimiters yet
+    _scan_from: int
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        self._scan_from = 0
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """
+        Appends data to the receive buffer and extracts every complete line.
+        The returned lines keep their CRLF delimiter so they can be used as
+        the raw form of the parsed message without another copy.
+
+        :param data: Bytes read from the stream.
+        :return: List of complete lines, possibly empty.
+        """
+        buf = self.buffer
+        buf += data
+
+        lines = []
+        start = 0
+        find = buf.find
+        lim = find(b"\r\n", self._scan_from)
+        if lim != -1:
+            with memoryview(buf) as view:
+                while lim != -1:
+                    end = lim + 2
+                    lines.append(bytes(view[start: end]))
+                    start = end
+                    lim = find(b"\r\n", start)
+            # Compact once per read
+            del buf[: start]
+
+        # A CR at the end of the buffer may be completed by the next read
+        self._scan_from = max(len(buf) - 1, 0)
+        return lines
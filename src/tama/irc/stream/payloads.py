@@ -1,5 +1,4 @@
-from dataclasses import dataclass
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Dict
 
 from tama.irc.command import COMMANDS, REPLY_CODES
 from tama.irc.user import IRCUser
@@ -9,101 +8,275 @@ __all__ = ["IRCMessage"]
 
 UNKNOWN_USER = IRCUser(nick="<unknown>", user="<unknown>", host="<unknown>")
 
+# Maps the raw command bytes of a line to its (command, numeric) pair, so
+# resolving a command is a single lookup instead of a decode and two checks.
+_COMMAND_TABLE: Dict[bytes, Tuple[str, Optional[str]]] = {
+    **{cmd.encode("ascii"): (cmd, None) for cmd in COMMANDS},
+    **{num.encode("ascii"): (cmd, num) for num, cmd in REPLY_CODES.items()},
+}
+
+# Marks lazily decoded fields which have not been accessed yet
+_UNSET = object()
+
+# Escape sequences of tag values
+# See: https://ircv3.net/specs/extensions/message-tags
+_TAG_UNESCAPES = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+_TAG_ESCAPES = str.maketrans({
+    ";": "\\:", " ": "\\s", "\\": "\\\\", "\r": "\\r", "\n": "\\n",
+})
+
+
+def _unescape_tag(value: str) -> str:
+    if "\\" not in value:
+        return value
+    out = []
+    chars = iter(value)
+    for char in chars:
+        if char == "\\":
+            # A lone backslash at the end is dropped, unknown escapes keep
+            # the escaped character
+            escaped = next(chars, "")
+            out.append(_TAG_UNESCAPES.get(escaped, escaped))
+        else:
+            out.append(char)
+    return "".join(out)
+
+
+def _escape_tag(value: str) -> str:
+    return value.translate(_TAG_ESCAPES)
+
 
-@dataclass
 class IRCMessage:
-    command: str
-    prefix: Optional[str] = None
-    middle: Tuple[str, ...] = ()
-    trailing: Optional[str] = None
+    """
+    An IRC message.
 
-    # Keep the original numeric for raw access
-    numeric: Optional[str] = None
+    Messages parsed from the stream keep the original line and only record the
+    offsets of each field. The tags, prefix, middle params and trailing text
+    are decoded the first time they are accessed, as most inbound messages
+    are dispatched on their command alone and then thrown away.
+    """
+    __slots__ = (
+        "command", "numeric", "encoding",
+        "_raw", "_prefix_end", "_params_start", "_end",
+        "_tags", "_prefix", "_middle", "_trailing",
+    )
 
+    command: str
+    # Keep the original numeric for raw access
+    numeric: Optional[str]
     # UTF-8 assumed unless specified otherwise
-    encoding: str = "utf-8"
+    encoding: str
+
+    # Original line including CRLF, or the serialised line once requested
+    _raw: Optional[bytes]
+    # Field offsets into _raw, _prefix_end is 0 without a prefix
+    _prefix_end: int
+    _params_start: int
+    _end: int
+    # Decoded fields, _UNSET until accessed
+    _tags: Optional[Dict[str, str]]
+    _prefix: Optional[str]
+    _middle: Tuple[str, ...]
+    _trailing: Optional[str]
+
+    def __init__(
+        self,
+        command: str,
+        prefix: Optional[str] = None,
+        middle: Tuple[str, ...] = (),
+        trailing: Optional[str] = None,
+        numeric: Optional[str] = None,
+        encoding: str = "utf-8",
+        tags: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.command = command
+        self.numeric = numeric
+        self.encoding = encoding
+        self._raw = None
+        self._tags = tags
+        self._prefix = prefix
+        self._middle = middle
+        self._trailing = trailing
 
     @classmethod
     def parse(cls, msg: bytes, encoding: str = "utf-8") -> "IRCMessage":
+        """
+        Parses a line received from the stream. Only the command is decoded,
+        the remaining fields are decoded on access.
+
+        :param msg: Raw line, with or without the trailing CRLF.
+        :param encoding: Encoding used to decode the message fields.
+        :return: Parsed message.
+        """
+        if msg.endswith(b"\r\n"):
+            end = len(msg) - 2
+        else:
+            end = len(msg)
+            msg = msg + b"\r\n"
+
+        prefix_end = pos = 0
+        first = msg[0]
+        # IRCv3 tags are skipped, they are found again if accessed
+        if first == 0x40:  # '@'
+            if (tags_end := msg.find(b" ", 0, end)) == -1:
+                tags_end = end
+            pos = tags_end + 1
+            first = msg[pos]
+
         # Deal with prefixed messages
-        prefix = None
-        if msg[0] == 0x3a:  # ':'
-            sep = msg.find(b" ")
-            prefix, msg = (
-                msg[1: sep].decode(encoding), msg[sep+1:]
-            )
-
-        if (sep := msg.find(b" ")) == -1:
+        if first == 0x3a:  # ':'
+            if (prefix_end := msg.find(b" ", pos, end)) == -1:
+                prefix_end = end
+            pos = prefix_end + 1
+
+        if (sep := msg.find(b" ", pos, end)) == -1:
             # We can only get here with either a message of the form
             # MESSAGE\r\n or with garbage
-            sep = len(msg)
-        command, msg = msg[: sep].decode(encoding), msg[sep+1:]
+            sep = end
 
-        if (sep := msg.find(b":")) == -1:
-            # No trailing, but we may have a middle
-            middle_b, trailing_b = msg, None
-        else:
-            middle_b, trailing_b = msg[: sep], msg[sep+1:]
+        try:
+            command, numeric = _COMMAND_TABLE[msg[pos: sep]]
+        except KeyError:
+            # Unknown reply code or bad command
+            raise InvalidIRCCommandError(
+                msg[pos: sep].decode(encoding, "replace")
+            ) from None
 
-        if len(middle_b) > 0:
-            middle = tuple(
-                m.decode(encoding)
-                for m in middle_b.split(b" ") if len(m) > 0
-            )
-        else:
-            middle = tuple()
+        obj = cls.__new__(cls)
+        obj.command = command
+        obj.numeric = numeric
+        obj.encoding = encoding
+        obj._raw = msg
+        obj._prefix_end = prefix_end
+        obj._params_start = sep
+        obj._end = end
+        obj._tags = _UNSET
+        obj._prefix = _UNSET
+        obj._middle = _UNSET
+        obj._trailing = _UNSET
+        return obj
 
-        if trailing_b:
-            trailing = trailing_b.decode(encoding)
-        else:
-            trailing = None
-
-        if len(command) == 3 and "0" <= command[0] <= "9":
-            # Handle numeric replies
-            numeric = command
-            command = REPLY_CODES.get(command, None)
-            if command is None:
-                # Unknown reply code
-                raise InvalidIRCCommandError(numeric)
-        else:
-            numeric = None
-            if command not in COMMANDS:
-                # Bad command
-                raise InvalidIRCCommandError(command)
-
-        return IRCMessage(
-            encoding=encoding,
-            prefix=prefix,
-            command=command,
-            numeric=numeric,
-            middle=middle,
-            trailing=trailing
+    @property
+    def tags(self) -> Dict[str, str]:
+        """
+        Message tags with their values unescaped. Tags without a value map
+        to an empty string.
+        """
+        if (tags := self._tags) is _UNSET:
+            tags = {}
+            raw = self._raw
+            if raw[0] == 0x40:  # '@'
+                span = raw[1: raw.find(b" ")].decode(self.encoding, "replace")
+                for tag in span.split(";"):
+                    if tag:
+                        key, _, value = tag.partition("=")
+                        tags[key] = _unescape_tag(value)
+            self._tags = tags
+        elif tags is None:
+            # Built without tags
+            tags = self._tags = {}
+        return tags
+
+    @property
+    def prefix(self) -> Optional[str]:
+        if (prefix := self._prefix) is _UNSET:
+            if self._prefix_end > 0:
+                raw = self._raw
+                # Skip the ':' and, if tagged, the tags and their space
+                start = raw.find(b" ") + 2 if raw[0] == 0x40 else 1
+                prefix = raw[start: self._prefix_end].decode(
+                    self.encoding, "replace"
+                )
+            else:
+                prefix = None
+            self._prefix = prefix
+        return prefix
+
+    def _decode_params(self) -> None:
+        # Middle params and trailing text are decoded together, whoever
+        # reads one of them almost always reads the other
+        params = self._raw[self._params_start: self._end].decode(
+            self.encoding, "replace"
         )
+        # Decoding keeps ASCII in place, so the first " :" is still the
+        # start of the trailing text
+        middle, sep, trailing = params.partition(" :")
+        self._middle = tuple(m for m in middle.split(" ") if m)
+        self._trailing = trailing if trailing else None
+
+    @property
+    def middle(self) -> Tuple[str, ...]:
+        if self._middle is _UNSET:
+            self._decode_params()
+        return self._middle
+
+    @property
+    def trailing(self) -> Optional[str]:
+        if self._trailing is _UNSET:
+            self._decode_params()
+        return self._trailing
 
     @property
     def raw(self) -> bytes:
+        """
+        The message as sent over the wire, including CRLF. Parsed messages
+        return the line they were parsed from.
+        """
+        if self._raw is not None:
+            return self._raw
+
         buf = bytearray()
 
-        if self.prefix:
-            buf.extend(f":{self.prefix} ".encode(self.encoding))
+        if self._tags:
+            buf.extend(b"@")
+            buf.extend(";".join(
+                f"{key}={_escape_tag(value)}" if value else key
+                for key, value in self._tags.items()
+            ).encode(self.encoding))
+            buf.extend(b" ")
+
+        if self._prefix:
+            buf.extend(f":{self._prefix} ".encode(self.encoding))
 
         if not self.numeric:
             buf.extend(self.command.encode(self.encoding))
         else:
             buf.extend(self.numeric.encode(self.encoding))
 
-        if len(self.middle) > 0:
-            for mid in self.middle:
+        if len(self._middle) > 0:
+            for mid in self._middle:
                 buf.extend(f" {mid}".encode(self.encoding))
 
-        if self.trailing:
-            buf.extend(f" :{self.trailing}".encode(self.encoding))
+        if self._trailing:
+            buf.extend(f" :{self._trailing}".encode(self.encoding))
 
         buf.extend(b"\r\n")
-        return bytes(buf)
+        # Outbound messages are immutable, serialise them only once
+        self._raw = bytes(buf)
+        return self._raw
 
     def parse_prefix_as_user(self) -> IRCUser:
         try:
             return IRCUser.from_address(self.prefix)
         except (AttributeError, ValueError):
             return UNKNOWN_USER
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, IRCMessage):
+            return NotImplemented
+        return (
+            self.command == other.command
+            and self.numeric == other.numeric
+            and self.prefix == other.prefix
+            and self.middle == other.middle
+            and self.trailing == other.trailing
+            and self.tags == other.tags
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"{type(self).__name__}(command={self.command!r}, "
+            f"prefix={self.prefix!r}, middle={self.middle!r}, "
+            f"trailing={self.trailing!r}, numeric={self.numeric!r}, "
+            f"encoding={self.encoding!r}, tags={self.tags!r})"
+        )
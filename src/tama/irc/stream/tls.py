@@ -0,0 +1,144 @@
+"""
+Provides the process-wide SSL contexts used by IRC connections.
+
+A context is built once per client certificate, so certificate stores are
+loaded a single time, and it remembers the TLS session of every server it
+connected to. Reconnections
+offer that session again and, if the server accepts it, skip the full
+handshake.
+"""
+import ssl
+from typing import Optional, Dict, Tuple, List
+
+from tama.config.schema import TLSConfig
+
+__all__ = [
+    "TLSSessionCache", "ResumingSSLContext", "ClientCert",
+    "configure_tls", "get_ssl_context", "get_session_caches",
+]
+
+# Client certificate file and key file, the key may be in the certificate file
+ClientCert = Tuple[str, Optional[str]]
+
+
+class TLSSessionCache:
+    __slots__ = ("sessions", "handshakes", "resumed")
+
+    # Latest session per server hostname
+    sessions: Dict[str, ssl.SSLSession]
+    # Completed handshakes
+    handshakes: int
+    # Completed handshakes which resumed a cached session
+    resumed: int
+
+    def __init__(self) -> None:
+        self.sessions = {}
+        self.handshakes = 0
+        self.resumed = 0
+
+    @property
+    def resumption_rate(self) -> Optional[float]:
+        if self.handshakes == 0:
+            return None
+        return self.resumed / self.handshakes
+
+    def record_handshake(self, resumed: bool) -> None:
+        self.handshakes += 1
+        if resumed:
+            self.resumed += 1
+
+    def store(self, host: str, session: Optional[ssl.SSLSession]) -> None:
+        if session is not None:
+            self.sessions[host] = session
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """
+    Client SSLContext which offers the cached session of a server whenever a
+    new connection to it is wrapped.
+    """
+    session_cache: TLSSessionCache
+
+    def wrap_bio(
+        self,
+        incoming: ssl.MemoryBIO,
+        outgoing: ssl.MemoryBIO,
+        server_side: bool = False,
+        server_hostname: Optional[str] = None,
+        session: Optional[ssl.SSLSession] = None,
+    ) -> ssl.SSLObject:
+        # asyncio wraps connections through wrap_bio without a session
+        if session is None and server_hostname is not None:
+            session = self.session_cache.sessions.get(server_hostname)
+        return super().wrap_bio(
+            incoming, outgoing,
+            server_side=server_side,
+            server_hostname=server_hostname,
+            session=session,
+        )
+
+
+def _create_ssl_context(
+    cfg: Optional[TLSConfig], client_cert: Optional[ClientCert]
+) -> ResumingSSLContext:
+    # Same defaults as ssl.create_default_context()
+    ctx = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    ctx.session_cache = TLSSessionCache()
+    if client_cert is not None:
+        ctx.load_cert_chain(*client_cert)
+    if cfg is not None and (cfg.ca_file or cfg.ca_path):
+        ctx.load_verify_locations(cafile=cfg.ca_file, capath=cfg.ca_path)
+    else:
+        ctx.load_default_certs(ssl.Purpose.SERVER_AUTH)
+    if cfg is None:
+        return ctx
+
+    if cfg.verify is False:
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+    if cfg.min_version:
+        ctx.minimum_version = ssl.TLSVersion[cfg.min_version]
+    return ctx
+
+
+# One context per client certificate, None for connections without one
+_ssl_contexts: Dict[Optional[ClientCert], ResumingSSLContext] = {}
+_ssl_config: Optional[TLSConfig] = None
+
+
+def configure_tls(cfg: Optional[TLSConfig]) -> None:
+    """
+    Sets the configuration of the process-wide SSL contexts. The contexts and
+    their cached sessions are kept if the configuration did not change.
+
+    :param cfg: TLS configuration, defaults are used if None.
+    :return: None
+    """
+    global _ssl_config
+    if cfg == _ssl_config:
+        return
+    _ssl_contexts.clear()
+    _ssl_config = cfg
+
+
+def get_ssl_context(
+    client_cert: Optional[ClientCert] = None
+) -> ResumingSSLContext:
+    """
+    Returns the process-wide SSL context, building it on first use.
+
+    :param client_cert: Client certificate presented by the context, if any.
+    :return: SSL context.
+    """
+    if (ctx := _ssl_contexts.get(client_cert)) is None:
+        ctx = _ssl_contexts[client_cert] = _create_ssl_context(
+            _ssl_config, client_cert
+        )
+    return ctx
+
+
+def get_session_caches() -> List[TLSSessionCache]:
+    """
+    Returns the session caches of every context built so far.
+    """
+    return [ctx.session_cache for ctx in _ssl_contexts.values()]
@@ -1,24 +1,126 @@
-from dataclasses import dataclass
+"""
+Users are identified by the nick!user@host prefix of the messages they send.
 
-__all__ = ["IRCUser"]
+The same few hundred prefixes repeat constantly on a busy network, so parsed
+users are immutable and shared through a bounded LRU cache keyed by the
+prefix string.
+"""
+from collections import OrderedDict
+from typing import Any, Optional
+
+__all__ = ["IRCUser", "UserCache", "user_cache"]
+
+# Prefixes kept by the process-wide cache
+USER_CACHE_SIZE = 4096
 
 
-@dataclass
 class IRCUser:
+    __slots__ = ("nick", "user", "host", "address")
+
     nick: str
     user: str
     host: str
+    # nick!user@host
+    address: str
 
-    @property
-    def address(self):
-        return f"{self.nick}!{self.user}@{self.host}"
+    def __init__(self, nick: str, user: str, host: str) -> None:
+        object.__setattr__(self, "nick", nick)
+        object.__setattr__(self, "user", user)
+        object.__setattr__(self, "host", host)
+        object.__setattr__(self, "address", f"{nick}!{user}@{host}")
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        # Instances are shared by the cache
+        raise AttributeError(f"IRCUser is immutable, cannot set {name}")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"IRCUser is immutable, cannot delete {name}")
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, IRCUser):
+            return NotImplemented
+        return self.address == other.address
+
+    def __hash__(self) -> int:
+        return hash(self.address)
+
+    def __repr__(self) -> str:
+        return (
+            f"IRCUser(nick={self.nick!r}, user={self.user!r}, "
+            f"host={self.host!r})"
+        )
 
     @classmethod
     def from_address(cls, address: str) -> "IRCUser":
+        """
+        Returns the user for a nick!user@host prefix, from the process-wide
+        cache if it was seen recently.
+
+        :param address: Message prefix.
+        :return: Parsed user.
+        :raises ValueError: If the prefix is not a user address.
+        """
+        return user_cache.get(address)
+
+    @classmethod
+    def parse(cls, address: str) -> "IRCUser":
+        """
+        Parses a nick!user@host prefix, bypassing the cache.
+        """
         nick, prefix = address.split("!", 1)
         user, host = prefix.split("@", 1)
-        return IRCUser(
-            nick=nick,
-            user=user,
-            host=host,
-        )
+        return cls(nick=nick, user=user, host=host)
+
+
+class UserCache:
+    """
+    Bounded LRU cache from message prefixes to users.
+    """
+    __slots__ = ("maxsize", "hits", "misses", "_users")
+
+    maxsize: int
+    hits: int
+    misses: int
+    _users: "OrderedDict[str, IRCUser]"
+
+    def __init__(self, maxsize: int = USER_CACHE_SIZE) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._users = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    @property
+    def hit_rate(self) -> Optional[float]:
+        total = self.hits + self.misses
+        if total == 0:
+            return None
+        return self.hits / total
+
+    def get(self, address: str) -> IRCUser:
+        users = self._users
+        if (user := users.get(address)) is not None:
+            self.hits += 1
+            users.move_to_end(address)
+            return user
+
+        self.misses += 1
+        user = IRCUser.parse(address)
+        users[address] = user
+        if len(users) > self.maxsize:
+            users.popitem(last=False)
+        return user
+
+    def invalidate(self, address: str) -> None:
+        """
+        Drops a prefix which is no longer in use, e.g. after a nick change.
+        """
+        self._users.pop(address, None)
+
+    def clear(self) -> None:
+        self._users.clear()
+
+
+user_cache = UserCache()
@@ -0,0 +1,124 @@
+"""
+Resolves hostnames through aiodns and caches the results for as long as their
+TTL allows, so reconnects don't pay the resolver cost again.
+"""
+import asyncio as aio
+import ipaddress
+import socket
+from time import monotonic
+from typing import Dict, List, Tuple, Optional
+
+import aiodns
+
+__all__ = ["CachingResolver", "get_resolver"]
+
+# Bounds applied to record TTLs
+MIN_TTL = 30
+MAX_TTL = 3600
+
+
+class CachingResolver:
+    __slots__ = ("min_ttl", "max_ttl", "hits", "misses", "_cache", "_resolver")
+
+    min_ttl: int
+    max_ttl: int
+    hits: int
+    misses: int
+    # Hostname to (addresses, monotonic expiry time)
+    _cache: Dict[str, Tuple[List[str], float]]
+    _resolver: Optional[aiodns.DNSResolver]
+
+    def __init__(self, min_ttl: int = MIN_TTL, max_ttl: int = MAX_TTL) -> None:
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.hits = 0
+        self.misses = 0
+        self._cache = {}
+        # Created on first use as it binds to the running loop
+        self._resolver = None
+
+    async def resolve(self, host: str) -> List[str]:
+        """
+        Resolves a hostname to its IPv4 and IPv6 addresses, IPv4 first.
+
+        :param host: Hostname or IP address literal.
+        :return: List of addresses.
+        """
+        try:
+            ipaddress.ip_address(host)
+            return [host]
+        except ValueError:
+            pass
+
+        now = monotonic()
+        if (cached := self._cache.get(host)) is not None:
+            addresses, expiry = cached
+            if now < expiry:
+                self.hits += 1
+                return addresses
+            del self._cache[host]
+        self.misses += 1
+
+        addresses, ttl = await self._query(host)
+        ttl = min(self.max_ttl, max(self.min_ttl, ttl))
+        self._cache[host] = addresses, now + ttl
+        return addresses
+
+    async def _query(self, host: str) -> Tuple[List[str], int]:
+        if self._resolver is None:
+            self._resolver = aiodns.DNSResolver()
+        results = await aio.gather(
+            self._lookup(host, "A"),
+            self._lookup(host, "AAAA"),
+            return_exceptions=True,
+        )
+        addresses = []
+        ttls = []
+        for records in results:
+            if isinstance(records, aiodns.error.DNSError):
+                continue
+            if isinstance(records, BaseException):
+                raise records
+            for address, ttl in records:
+                addresses.append(address)
+                ttls.append(ttl)
+        if addresses:
+            return addresses, min(ttls)
+
+        # Names the DNS doesn't know about may still be resolvable by the
+        # system, e.g. through the hosts file.
+        try:
+            infos = await aio.get_running_loop().getaddrinfo(
+                host, None, type=socket.SOCK_STREAM
+            )
+        except socket.gaierror as exc:
+            raise OSError(f"Could not resolve {host}") from exc
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        return addresses, self.min_ttl
+
+    async def _lookup(self, host: str, qtype: str) -> List[Tuple[str, int]]:
+        # Addresses of a record type with their TTLs
+        resolver = self._resolver
+        if hasattr(resolver, "query_dns"):
+            # aiodns 4 deprecates query, query_dns answers with the records
+            # of pycares, CNAMEs included
+            result = await resolver.query_dns(host, qtype)
+            return [
+                (record.data.addr, record.ttl) for record in result.answer
+                if hasattr(record.data, "addr")
+            ]
+        records = await resolver.query(host, qtype)
+        return [(record.host, record.ttl) for record in records]
+
+
+_resolver: Optional[CachingResolver] = None
+
+
+def get_resolver() -> CachingResolver:
+    """
+    Returns the process-wide resolver.
+    """
+    global _resolver
+    if _resolver is None:
+        _resolver = CachingResolver()
+    return _resolver
@@ -0,0 +1,176 @@
+"""
+Matches a line against many patterns at once, running only the patterns which
+can possibly match it.
+
+Most patterns require some literal text, e.g. the host of a URL expander. The
+longest literal each pattern requires is taken from its parsed form, and the
+literals of every pattern are combined into a single alternation. A line is
+scanned once with it, and only the patterns whose literal was found, plus the
+ones requiring no usable literal, run their full regex.
+"""
+import re
+from typing import (
+    Dict, Generic, Iterable, List, Match, Optional, Pattern, Set, Tuple,
+    TypeVar,
+)
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+__all__ = ["RegexDispatcher", "required_literal"]
+
+T = TypeVar("T")
+
+# Literals shorter than this would let through most lines anyway, their
+# patterns are run on every line instead
+MIN_LITERAL = 3
+
+_REPEATS = tuple(
+    op for op in (
+        sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT,
+        getattr(sre_parse, "POSSESSIVE_REPEAT", None),
+    ) if op is not None
+)
+_ATOMIC_GROUP = getattr(sre_parse, "ATOMIC_GROUP", None)
+
+
+def _required_runs(parsed) -> List[str]:
+    # Runs of literal characters every match of the parsed pattern contains
+    runs = []
+    run = []
+    for op, av in parsed:
+        if op is sre_parse.LITERAL:
+            run.append(chr(av))
+            continue
+        if op is sre_parse.AT:
+            # Anchors match no characters, the run goes on
+            continue
+        if run:
+            runs.append("".join(run))
+            run = []
+        if op is sre_parse.SUBPATTERN:
+            group, add_flags, del_flags, sub = av
+            if not add_flags & re.IGNORECASE:
+                runs.extend(_required_runs(sub))
+        elif op in _REPEATS:
+            low, high, sub = av
+            if low >= 1:
+                runs.extend(_required_runs(sub))
+        elif op is _ATOMIC_GROUP:
+            runs.extend(_required_runs(av))
+    if run:
+        runs.append("".join(run))
+    return runs
+
+
+def required_literal(pattern: Pattern) -> Optional[str]:
+    """
+    Longest literal text every match of a pattern contains.
+
+    :param pattern: Compiled str pattern.
+    :return: Literal, None if there is none of at least MIN_LITERAL
+             characters or the pattern ignores case.
+    """
+    if not isinstance(pattern.pattern, str):
+        return None
+    if pattern.flags & re.IGNORECASE:
+        return None
+    runs = _required_runs(sre_parse.parse(pattern.pattern, pattern.flags))
+    literal = max(runs, key=len, default="")
+    if len(literal) < MIN_LITERAL:
+        return None
+    return literal
+
+
+class RegexDispatcher(Generic[T]):
+    """
+    Patterns with an item each, e.g. the action the pattern triggers.
+    """
+    __slots__ = ("_entries", "_always", "_by_literal", "_prefilter")
+
+    # Patterns and their items, in the order given
+    _entries: List[Tuple[Pattern, T]]
+    # Entries which run on every line
+    _always: Tuple[int, ...]
+    # Entries whose literal is part of each literal the prefilter finds
+    _by_literal: Dict[str, Set[int]]
+    # Alternation of the literals, longest first
+    _prefilter: Optional[Pattern]
+
+    def __init__(self, patterns: Iterable[Tuple[Pattern, T]]) -> None:
+        """
+        Creates a new RegexDispatcher.
+
+        :param patterns: Compiled patterns and their items.
+        """
+        self._entries = list(patterns)
+        always = []
+        literals: Dict[str, Set[int]] = {}
+        for i, (pattern, _) in enumerate(self._entries):
+            if (literal := required_literal(pattern)) is None:
+                always.append(i)
+            else:
+                literals.setdefault(literal, set()).add(i)
+        self._always = tuple(always)
+        # A literal found also contains the shorter literals within it,
+        # which the alternation won't report at the same position
+        self._by_literal = {
+            literal: set().union(*(
+                entries for other, entries in literals.items()
+                if other in literal
+            ))
+            for literal in literals
+        }
+        self._prefilter = None
+        if literals:
+            self._prefilter = re.compile("|".join(
+                re.escape(literal)
+                for literal in sorted(literals, key=len, reverse=True)
+            ))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def candidates(self, text: str) -> Tuple[int, ...]:
+        """
+        Entries which may match text, in order.
+
+        :param text: Line to match.
+        :return: Indices of the entries.
+        """
+        if self._prefilter is None:
+            return self._always
+        search = self._prefilter.search
+        if (found := search(text)) is None:
+            return self._always
+        selected = set(self._always)
+        by_literal = self._by_literal
+        while found is not None:
+            selected.update(by_literal[found.group()])
+            # Literals may overlap, look again from the next character
+            found = search(text, found.start() + 1)
+        return tuple(sorted(selected))
+
+    def match(self, text: str) -> List[Tuple[T, Match]]:
+        """
+        Matches text against the patterns with re.match semantics.
+
+        :param text: Line to match.
+        :return: Items of the patterns which matched with their match, in
+                 the order the patterns were given.
+        """
+        matched = []
+        entries = self._entries
+        for i in self.candidates(text):
+            pattern, item = entries[i]
+            if (match := pattern.match(text)) is not None:
+                matched.append((item, match))
+        return matched
+
+    def __repr__(self) -> str:
+        return (
+            f"RegexDispatcher(patterns={len(self._entries)}, "
+            f"prefiltered={len(self._entries) - len(self._always)})"
+        )
@@ -0,0 +1,44 @@
+from typing import Optional
+
+__all__ = ["RunningStats"]
+
+
+class RunningStats:
+    """
+    Aggregates a series of samples without keeping them.
+    """
+    __slots__ = ("count", "total", "min", "max", "last")
+
+    count: int
+    total: float
+    min: Optional[float]
+    max: Optional[float]
+    last: Optional[float]
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.last = None
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.last = value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def mean(self) -> Optional[float]:
+        if self.count == 0:
+            return None
+        return self.total / self.count
+
+    def __repr__(self) -> str:
+        return (
+            f"{type(self).__name__}(count={self.count}, mean={self.mean}, "
+            f"min={self.min}, max={self.max}, last={self.last})"
+        )